@@ -5,3 +5,7 @@ from django.apps import AppConfig
 class FlexelogConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "flexelog"
+
+    def ready(self):
+        # Connect signal receivers
+        from flexelog import attr_indexes, counts, groups, permissions, threads  # noqa: F401
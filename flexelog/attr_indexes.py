@@ -0,0 +1,109 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Per-logbook expression indexes on configured attributes
+
+Each attribute in a logbook's `Attributes` config gets an index on its sort
+expression (see `listing.attr_sort_expression`), partial on the logbook so
+it only holds that logbook's entries.  A `Type <attr> = numeric` (or date,
+datetime) attribute is indexed on its numeric value.
+
+The indexes are made by the `attr_indexes` management command, or
+automatically when a logbook or the global config is saved if the setting
+FLEXELOG_AUTO_ATTR_INDEXES is True.
+"""
+from dataclasses import dataclass
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Index
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from flexelog.elog_cfg import LogbookConfig, get_config
+from flexelog.listing import ATTR_INDEX_PREFIX, attr_index
+from flexelog.models import ElogConfig, Entry, Logbook
+
+logger = logging.getLogger(__name__)
+
+AUTO_ATTR_INDEXES = getattr(settings, "FLEXELOG_AUTO_ATTR_INDEXES", False)
+
+
+@dataclass
+class IndexChanges:
+    created: list[str]
+    dropped: list[str]
+
+
+def wanted_indexes(logbooks: list[Logbook], cfg: LogbookConfig | None = None) -> dict:
+    """Return {index name: (Index, logbook name, attr name, type)} for the logbooks' attributes"""
+    cfg = cfg or get_config()
+    wanted = {}
+    for logbook in logbooks:
+        for attr_name, attr in cfg.lb_attrs.get(logbook.name, {}).items():
+            index = attr_index(logbook.id, attr_name, attr.val_type)
+            wanted[index.name] = (index, logbook.name, attr_name, attr.val_type)
+    return wanted
+
+
+def existing_indexes() -> list[str]:
+    """Return names of the attribute indexes currently in the database"""
+    with connection.cursor() as cursor:
+        constraints = connection.introspection.get_constraints(cursor, Entry._meta.db_table)
+    return sorted(
+        name for name, info in constraints.items()
+        if info["index"] and name.startswith(ATTR_INDEX_PREFIX)
+    )
+
+
+def stale_indexes(wanted: dict, existing: list[str], logbooks: list[Logbook] | None = None) -> list[str]:
+    """Return existing index names not wanted, for the logbooks or for any logbook if None"""
+    lb_prefixes = None if logbooks is None else tuple(
+        f"{ATTR_INDEX_PREFIX}{logbook.id}_" for logbook in logbooks
+    )
+    return [
+        name for name in existing
+        if name not in wanted and (lb_prefixes is None or name.startswith(lb_prefixes))
+    ]
+
+
+def sync_indexes(logbooks: list[Logbook] | None = None, drop_only=False) -> IndexChanges:
+    """Create missing attribute indexes for the logbooks, and drop ones no longer configured
+
+    If `logbooks` is None, all active logbooks, and indexes for any other
+    (inactive or deleted) logbooks are dropped.
+    `drop_only` drops the logbooks' attribute indexes without creating any.
+    """
+    wanted = {} if drop_only else wanted_indexes(
+        Logbook.active_logbooks() if logbooks is None else logbooks
+    )
+    existing = existing_indexes()
+    stale = stale_indexes(wanted, existing, logbooks)
+    missing = [name for name in wanted if name not in existing]
+    with connection.schema_editor() as schema_editor:
+        for name in stale:
+            # Only the name is needed to drop an index
+            schema_editor.remove_index(Entry, Index(fields=["id"], name=name))
+            logger.info(f"Dropped attribute index {name}")
+        for name in missing:
+            index, lb_name, attr_name, _ = wanted[name]
+            schema_editor.add_index(Entry, index)
+            logger.info(f"Created index {name} for logbook '{lb_name}' attribute '{attr_name}'")
+    if missing and connection.vendor in ("sqlite", "postgresql"):
+        # Without statistics, SQLite prefers the (lb, id) index and sorts, not knowing
+        # the partial index holds only the logbook's entries
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {connection.ops.quote_name(Entry._meta.db_table)}")
+    return IndexChanges(created=missing, dropped=stale)
+
+
+@receiver(post_save, sender=Logbook)
+def logbook_saved(sender, instance, raw, **kwargs):
+    if AUTO_ATTR_INDEXES and not raw:
+        # Config has been reloaded by elog_cfg's receiver, connected before this one
+        transaction.on_commit(lambda: sync_indexes([instance]))
+
+
+@receiver(post_save, sender=ElogConfig)
+def global_config_saved(sender, raw, **kwargs):
+    if AUTO_ATTR_INDEXES and not raw:
+        transaction.on_commit(sync_indexes)
@@ -0,0 +1,155 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Cached entry counts for logbook listings and the logbook index page
+
+Counting hundreds of thousands of rows on every page hit is wasteful, so:
+
+* unfiltered per-logbook totals are kept as counters in the cache,
+  incremented/decremented as entries are created/deleted
+* filtered listing counts are cached under a per-logbook "generation",
+  which changes whenever an entry in that logbook is saved or deleted
+* each logbook's latest entry date, for the index page, is kept up to date
+  as entries are created, and looked up again after other changes
+
+The default Django cache is per-process.  With several server processes,
+configure a shared cache (e.g. Redis or Memcached) in CACHES so all see the
+same counters.
+"""
+from datetime import datetime
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from flexelog.models import Entry, Logbook
+
+# Safety net in case something changes entries without signals, e.g. bulk_create
+COUNT_CACHE_TIMEOUT = getattr(settings, "FLEXELOG_COUNT_CACHE_TIMEOUT", 60 * 60)
+
+
+def _total_key(lb_id):
+    return f"flexelog:lb_total:{lb_id}"
+
+
+def _latest_key(lb_id):
+    return f"flexelog:lb_latest:{lb_id}"
+
+
+_NO_ENTRIES = False  # cached as the latest date of an empty logbook, as None can't be told from not cached
+
+
+def _generation_key(lb_id):
+    return f"flexelog:lb_generation:{lb_id}"
+
+
+def _new_generation():
+    # Never repeats, even if the cache loses the current value
+    return time.time_ns()
+
+
+def logbook_totals(logbooks: list[Logbook]) -> dict[int, int]:
+    """Return {logbook id: number of entries}, counting only those not already cached"""
+    return logbook_index_stats(logbooks, latest=False)[0]
+
+
+def logbook_index_stats(
+    logbooks: list[Logbook], latest=True
+) -> tuple[dict[int, int], dict[int, datetime | None]]:
+    """Return ({logbook id: number of entries}, {logbook id: latest entry date or None})
+
+    Those not already cached are found in one query, grouped by logbook.
+    If `latest` is False, the latest dates are not looked up (returns an empty dict)
+    """
+    total_keys = {_total_key(lb.id): lb.id for lb in logbooks}
+    latest_keys = {_latest_key(lb.id): lb.id for lb in logbooks} if latest else {}
+    cached = cache.get_many([*total_keys, *latest_keys])
+    totals = {lb_id: cached[key] for key, lb_id in total_keys.items() if key in cached}
+    latest_dates = {
+        lb_id: cached[key] or None for key, lb_id in latest_keys.items() if key in cached
+    }
+    missing_totals = [lb_id for lb_id in total_keys.values() if lb_id not in totals]
+    missing_latest = [lb_id for lb_id in latest_keys.values() if lb_id not in latest_dates]
+    if missing_totals or missing_latest:
+        aggregates = {}
+        if missing_totals:
+            aggregates["total"] = Count("pk")
+        if missing_latest:
+            aggregates["latest"] = Max("date")
+        rows = {
+            row["lb_id"]: row
+            for row in Entry.objects.filter(lb_id__in={*missing_totals, *missing_latest})
+            .values("lb_id")
+            .annotate(**aggregates)
+            .order_by()
+        }
+        new_totals = {lb_id: rows.get(lb_id, {}).get("total", 0) for lb_id in missing_totals}
+        new_latest = {lb_id: rows.get(lb_id, {}).get("latest") for lb_id in missing_latest}
+        cache.set_many(
+            {_total_key(lb_id): total for lb_id, total in new_totals.items()}
+            | {_latest_key(lb_id): date or _NO_ENTRIES for lb_id, date in new_latest.items()},
+            COUNT_CACHE_TIMEOUT,
+        )
+        totals.update(new_totals)
+        latest_dates.update(new_latest)
+    return totals, latest_dates
+
+
+def listing_count(logbook: Logbook, queryset, filtered=True) -> int:
+    """Return the number of entries in the logbook's listing queryset, cached
+
+    `filtered` False means the queryset is all the logbook's entries.
+    Otherwise the cache key is the queryset's SQL, so the same filters in a
+    different order or spelling give the same key.
+    """
+    if not filtered:
+        return logbook_totals([logbook])[logbook.id]
+
+    generation = cache.get_or_set(_generation_key(logbook.id), _new_generation, None)
+    sql_hash = hashlib.md5(str(queryset.order_by().query).encode()).hexdigest()
+    key = f"flexelog:lb_count:{logbook.id}:{generation}:{sql_hash}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def invalidate_counts(logbook: Logbook):
+    """Drop cached counts for the logbook, e.g. after bulk changes which don't send signals"""
+    cache.delete_many([_total_key(logbook.id), _latest_key(logbook.id)])
+    cache.set(_generation_key(logbook.id), _new_generation(), None)
+
+
+def _adjust_total(lb_id, delta):
+    try:
+        cache.incr(_total_key(lb_id), delta)
+    except ValueError:
+        pass  # not cached, will be counted when next needed
+    cache.set(_generation_key(lb_id), _new_generation(), None)
+
+
+def _new_entry_date(lb_id, date):
+    latest = cache.get(_latest_key(lb_id))
+    if latest is not None and (latest is _NO_ENTRIES or date > latest):
+        cache.set(_latest_key(lb_id), date, COUNT_CACHE_TIMEOUT)
+
+
+@receiver(post_save, sender=Entry)
+def entry_saved(sender, instance, created, **kwargs):
+    lb_id, date = instance.lb_id, instance.date
+    transaction.on_commit(lambda: _adjust_total(lb_id, 1 if created else 0))
+    if created:
+        transaction.on_commit(lambda: _new_entry_date(lb_id, date))
+    else:  # date may have changed
+        transaction.on_commit(lambda: cache.delete(_latest_key(lb_id)))
+
+
+@receiver(post_delete, sender=Entry)
+def entry_deleted(sender, instance, **kwargs):
+    lb_id = instance.lb_id
+    transaction.on_commit(lambda: _adjust_total(lb_id, -1))
+    transaction.on_commit(lambda: cache.delete(_latest_key(lb_id)))
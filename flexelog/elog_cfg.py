@@ -1,15 +1,27 @@
 # Copyright 2025 flexelog authors. See LICENSE file for details.
 from collections import defaultdict
+from collections.abc import Mapping
 import configparser
+from contextvars import ContextVar
+import copy
 import csv
 from dataclasses import dataclass, field
 import re
 from typing import Any
 import warnings
 import functools
+import hashlib
+import itertools
+import os
+from pathlib import Path
+import pickle
+import time
 
 from django.conf import settings
-from django.db.models.signals import post_save  # update config when logbook changed
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save  # update config when logbook changed
 from django.contrib.auth.models import Group
 from flexelog.models import ElogConfig, Logbook
 from guardian.shortcuts import assign_perm
@@ -18,6 +30,21 @@ import logging
 logger = logging.getLogger("flexelog")
 
 _cfg = None  # singleton of LogbookConfig class
+_config_versions = itertools.count(1)
+
+# Other server processes learn of config changes from a stamp in the (shared) cache
+CONFIG_STAMP_KEY = "flexelog:config_stamp"
+CONFIG_CHECK_SECONDS = getattr(settings, "FLEXELOG_CONFIG_CHECK_SECONDS", 2)
+_cfg_stamp = None  # stamp in the cache when _cfg was loaded
+_cfg_checked = 0.0  # time.monotonic() of last check of the stamp
+
+# Parsed configs saved on disk, so new server processes needn't parse the config again
+CONFIG_CACHE_DIR = getattr(settings, "FLEXELOG_CONFIG_CACHE_DIR", None)
+CONFIG_CACHE_PREFIX = "flexelog-config-"
+_CONFIG_CACHE_FORMAT = b"1"  # change if what LogbookConfig pickles changes
+# Conditions active in this thread or async task, with the version of the config they are for,
+# so requests handled at the same time can share one LogbookConfig
+_active_conditions: ContextVar[tuple[int, tuple]] = ContextVar("flexelog_conditions", default=(0, ()))
 
 
 class ConfigError(Exception):
@@ -71,6 +98,103 @@ DEFAULT_ATTRIBUTES = {
 }
 
 
+def read_sections(config_text: str) -> dict[str, dict[str, dict]]:
+    """Return {section name: {lower-case key: {condition: value}}} as set in each section
+
+    Settings in [global] are not copied into the other sections, see `merge_section`.
+    """
+    # Starts with Python's ConfigParser, so
+    # cannot repeat keys (in default 'strict' mode) which is tolerated in psi elog
+    # interpolation must be None because of date/time formats with "%"
+    cp = configparser.ConfigParser(
+        default_section="global",
+        interpolation=None,
+        # ? allow_unnamed_section=True ? and just ignore them?
+    )
+    cp.optionxform = str  # keys are case sensitive
+    cp.read_string(config_text)
+    raw_sections = {"global": dict(cp.defaults())} if cp.defaults() else {}
+    cp.defaults().clear()  # so each section's items are only its own
+    raw_sections.update((section_name, cp[section_name]) for section_name in cp.sections())
+
+    # Go through all config keys and deal with conditionals
+    # All values become a dict mapped by conditions or empty string ""
+    # Key = val becomes Key: {"": val}
+    # {1} Key = val becomes Key: {"1": val}
+    # {1,2} Key = val becomes Key: {"1": val, "2": val}  ("or")
+    # {1&2} Key = val becomes Key: {("1", "2"): val}    ("and")
+    # Note the conditionals in the *values* are not parsed at this point
+    sections = {}
+    for section_name, items in raw_sections.items():
+        sections[section_name] = section_dict = defaultdict(dict)
+        for key, val in items.items():
+            # match [{<conditionals>}]<bare_key>
+            match = re.search(r"(?:\{(.*?)\})?\s*(.*?)$", key)
+            if not match:
+                logger.error(
+                    f"Unable to parse config file option '{key}' in section '{section_name}'"
+                )
+                continue
+            conditions, bare_key = match.groups()
+            bare_key = bare_key.lower()  # to use in case-insensitive `get`
+            if conditions is None:
+                section_dict[bare_key][""] = val
+            else:
+                conditions = [
+                    x.strip().lower() for x in conditions.split(",")
+                ]
+                for condition in conditions:
+                    if "&" in condition:
+                        condition = tuple(condition.split("&"))
+                    section_dict[bare_key][condition] = val
+        sections[section_name] = dict(section_dict)
+    return sections
+
+
+def merge_section(global_section: dict, section: dict) -> dict:
+    """Return the section's settings, with the global ones it doesn't set itself"""
+    merged = dict(global_section)
+    for key, vals in section.items():
+        merged[key] = {**global_section.get(key, {}), **vals}
+    return merged
+
+
+def warn_ignored_section(section_name: str):
+    if section_name.lower().startswith("group "):
+        logger.warning(
+            f"Found section [{section_name}] in ElogConfig: "
+            "[Group xxx] sections are ignored in this "
+            "version of FlexElog"
+        )
+
+
+class LogbookAttributes(Mapping):
+    """{logbook name: {attr name: Attribute}} for one set of conditions
+
+    Each logbook's Attributes are parsed when first asked for, then kept,
+    so switching conditions needn't parse every logbook's config again.
+    """
+    def __init__(self, cfg: "LogbookConfig", conditions: tuple):
+        self._cfg = cfg
+        self._conditions = conditions
+        self._attrs = {}
+
+    def __getitem__(self, lb_name: str) -> dict[str, Attribute]:
+        try:
+            return self._attrs[lb_name]
+        except KeyError:
+            if lb_name not in self._cfg._lb_names:
+                raise
+        attrs = self._attrs[lb_name] = self._cfg.parse_lb_attrs(lb_name, self._conditions)
+        return attrs
+
+    def __iter__(self):
+        return iter(self._cfg._lb_names)
+
+    def __len__(self):
+        return len(self._cfg._lb_names)
+
+
 # Default settings for database ElogConfig settings if not specified
 ELOGCONFIG_DEFAULTS = {
     "all display limit": 500,
@@ -107,39 +231,78 @@ def cfg_bool(s: str | bool) -> bool | str:
 
 
 class LogbookConfig:
+    """The parsed config of all logbooks
+
+    Not changed once made (a reload makes a new one), apart from caches of
+    looked up values, so can be shared by threads.  The active conditions
+    are held per thread or async task, in a context variable.
+    """
     def __init__(self, config_text: str):
         self._config_text = config_text
-        self._conditions = []
+        self.version = next(_config_versions)  # different for each (re)load, to key caches
+        self._get_memo = {}  # {(section, param, default, valtype, as_list, conditions): value}
         self.clear_conditions()
         self.load_config()
         self.parse_config()
 
+    def _set_conditions(self, conditions: tuple):
+        _active_conditions.set((self.version, conditions))
+
+    def __getstate__(self):
+        # The memo and conditions are per process, but keep Attributes parsed with no conditions
+        unconditional = self._lb_attrs.get(())
+        return {
+            "own_sections": self._own_sections,
+            "cfg": self._cfg,
+            "lb_attrs": unconditional._attrs if unconditional else {},
+        }
+
+    def __setstate__(self, state):
+        self._config_text = None
+        self.version = next(_config_versions)
+        self._get_memo = {}
+        self._own_sections = state["own_sections"]
+        self._cfg = state["cfg"]
+        self.parse_config()
+        lb_attrs = self._lb_attrs[()] = LogbookAttributes(self, ())
+        lb_attrs._attrs = state["lb_attrs"]
+
+    def parse_all(self):
+        """Parse every logbook's Attributes (with no conditions) now, rather than when used"""
+        lb_attrs = self._lb_attrs.setdefault((), LogbookAttributes(self, ()))
+        for lb_name in lb_attrs:
+            lb_attrs[lb_name]
+
     def add_condition(self, condition: str):
-        if condition not in self._conditions:
-            self._conditions.append(condition.lower())
-            self.parse_config()
+        condition = condition.lower()
+        if condition not in self.conditions:
+            self._set_conditions(self.conditions + (condition,))
 
     def set_conditions_from_attrs(self, lb_name: str, attrs: dict):
         lb_attrs = self.lb_attrs[lb_name]
+        conditions = list(self.conditions)
         have_conditional = False
         for attr, val in attrs.items():
             if not isinstance(val, list):
                 val = [val]
             for v in val:
                 try:
-                    # Note add_condition reparses config'd Attributes available
-                    self._conditions.append(lb_attrs[attr].val_conditions[v])
+                    conditions.append(lb_attrs[attr].val_conditions[v])
                     have_conditional = True
                 except KeyError:
                     pass
 
         if have_conditional:
-            self.parse_config()
+            self._set_conditions(tuple(conditions))
+
+    @property
+    def conditions(self) -> tuple:
+        version, conditions = _active_conditions.get()
+        return conditions if version == self.version else ()
 
     def clear_conditions(self):
-        if self._conditions:
-            self._conditions = []
-            self.parse_config()
+        if self.conditions:
+            self._set_conditions(())
 
     def __enter__(self):
         self.clear_conditions()
@@ -149,17 +312,6 @@ class LogbookConfig:
 
     def load_config(self):
         # Load `elogd.cfg` style config textfile into self._cfg dict
-        # Starts with Python's ConfigParser, so
-        # cannot repeat keys (in default 'strict' mode) which is tolerated in psi elog
-        # interpolation must be None because of date/time formats with "%"
-        self.configp = configparser.ConfigParser(
-            default_section="global",
-            interpolation=None,
-            # ? allow_unnamed_section=True ? and just ignore them?
-        )
-        self.configp.optionxform = str  # keys are case sensitive
-        self.configp.read_string(self._config_text)
-
         # Determine language translations, if any
         # lang = "english"
         # if "global" in self.configp:
@@ -168,100 +320,73 @@ class LogbookConfig:
         # set_language(HERE / "resources", lang)
         # self.editor.set_lang(iso639_for_language.get(lang.lower(), "en"))
 
-        cp = self.configp
-
-        # Go through all config keys and deal with conditionals
-        # All values become a dict mapped by conditions or empty string ""
-        # Key = val becomes Key: {"": val}
-        # {1} Key = val becomes Key: {"1": val}
-        # {1,2} Key = val becomes Key: {"1": val, "2": val}  ("or")
-        # {1&2} Key = val becomes Key: {("1", "2"): val}    ("and")
-        # Note the conditionals in the *values* are not parsed at this point
-        self._cfg = dict()
-
-        for section_name in cp.sections() + ["global"]:
-            self._cfg[section_name] = section_dict = defaultdict(dict)
-            for key, val in cp[section_name].items():
-                # match [{<conditionals>}]<bare_key>
-                match = re.search(r"(?:\{(.*?)\})?\s*(.*?)$", key)
-                if not match:
-                    logger.error(
-                        f"Unable to parse config file option '{key}' in section '{section_name}'"
-                    )
+        # Each logbook section's dict also has the global settings it doesn't override
+        self._own_sections = read_sections(self._config_text)
+        global_section = self._own_sections.setdefault("global", {})
+        self._cfg = {
+            name: merge_section(global_section, own)
+            for name, own in self._own_sections.items() if name != "global"
+        }
+        self._cfg["global"] = global_section
+        for section_name in self._cfg:
+            warn_ignored_section(section_name)
+
+    def with_section(self, section_name: str, config_text: str | None) -> "LogbookConfig":
+        """Return a new LogbookConfig with one section's text replaced, or removed if None
+
+        Only logbooks whose settings change have their Attributes parsed again
+        and their looked up values forgotten, e.g. only the saved logbook, or
+        for a global change, those that don't set the changed keys themselves.
+        """
+        new = copy.copy(self)
+        new.version = next(_config_versions)
+        new._config_text = None  # no longer the whole text
+        new._own_sections = dict(self._own_sections)
+        new._cfg = dict(self._cfg)
+        own = {}
+        if config_text is not None:
+            own = read_sections(f"[{section_name}]\n{config_text}\n").get(section_name, {})
+            warn_ignored_section(section_name)
+
+        if section_name == "global":
+            old_global = self._own_sections["global"]
+            changed = {key for key in old_global.keys() | own.keys() if old_global.get(key) != own.get(key)}
+            new._own_sections["global"] = new._cfg["global"] = own
+            affected = {"global"}
+            for name, own_section in new._own_sections.items():
+                if name == "global":
                     continue
-                conditions, bare_key = match.groups()
-                bare_key = bare_key.lower()  # to use in case-insensitive `get`
-                if conditions is None:
-                    section_dict[bare_key][""] = val
-                else:
-                    conditions = [
-                        x.strip().lower() for x in conditions.split(",")
-                    ]
-                    for condition in conditions:
-                        if "&" in condition:
-                            condition = tuple(condition.split("&"))
-                        section_dict[bare_key][condition] = val
+                merged = merge_section(own, own_section)
+                if any(merged.get(key) != self._cfg[name].get(key) for key in changed):
+                    new._cfg[name] = merged
+                    affected.add(name)
+        else:
+            affected = {section_name}
+            if config_text is None:
+                new._own_sections.pop(section_name, None)
+                new._cfg.pop(section_name, None)
+            else:
+                new._own_sections[section_name] = own
+                new._cfg[section_name] = merge_section(new._own_sections["global"], own)
+
+        new._get_memo = {key: val for key, val in self._get_memo.items() if key[0] not in affected}
+        new.parse_config()
+        for conditions, lb_attrs in self._lb_attrs.items():
+            new_lb_attrs = new._lb_attrs[conditions] = LogbookAttributes(new, conditions)
+            new_lb_attrs._attrs = {
+                name: attrs for name, attrs in lb_attrs._attrs.items() if name not in affected
+            }
+        return new
 
     def parse_config(self):
-        self._lb_attrs = {}
-        for lb_name in self._cfg:
-            # don't include global sections, doing logbooks only
-            if lb_name.lower().startswith("global"):
-                continue
-            if lb_name.lower().startswith("group "):
-                logger.warning(
-                    f"Found section [{lb_name}] in ElogConfig: "
-                    "[Group xxx] sections are ignored in this "
-                    "version of FlexElog"
-                )
-                
-            attrs = {
-                name: Attribute(name)
-                for name in self.get(lb_name, "Attributes", as_list=True)
-            }
+        # Attributes are parsed when first used, for each logbook and set of conditions
+        self._lb_attrs = {}  # {conditions: LogbookAttributes}
+        # don't include global sections, doing logbooks only
+        # dict for quick `in`, and config order
+        self._lb_names = {
+            lb_name: None for lb_name in self._cfg if not lb_name.lower().startswith("global")
+        }
 
-            if not attrs:
-                attrs = DEFAULT_ATTRIBUTES
-
-            self._lb_attrs[lb_name] = attrs
-
-            # Set Required Attributes
-            for attr in self.get(lb_name, "Required Attributes", as_list=True):
-                if attr not in attrs:
-                    warnings.warn(
-                        f"Required Attributes '{attr}' is not listed in Attributes line and is ignored"
-                    )
-                else:
-                    attrs[attr].required = True
-
-            # Set Extendable Options (attributes)
-            for attr in self.get(lb_name, "Extendable Options", as_list=True):
-                if attr not in attrs:
-                    logger.warning(
-                        f"In config for logbook '{lb_name}', "
-                        f"Extendable Options '{attr}' is not listed in Attributes line and is ignored"
-                    )
-                else:
-                    attrs[attr].extendable = True
-            
-            # Categorize attribute value type e.g. `Type Start date = datetime`
-            for attr_name, attr in attrs.items():
-                if valtype := self.get(lb_name, f"Type {attr_name}"):
-                    attr.val_type = valtype
-
-            # Set the Option Types (Text by default)
-            # Logic here means if repeated, last one spec'd wins
-            for attr_name, attr in attrs.items():
-                for option_type in ["Options", "MOptions", "ROptions", "IOptions"]:
-                    # XX below is specific to single space, could make whitespace tolerant
-                    options = self.get(
-                        lb_name, f"{option_type} {attr_name}", as_list=True
-                    )
-                    if options:
-                        attr.options_type = option_type
-                        attr.options = options
-                attr.parse_conditions()
-            
         # Create Logbook class instance for each logbook
         # self._logbooks = {}
         # For migration only, get paths to original PSI file-based logbooks
@@ -281,6 +406,67 @@ class LogbookConfig:
             #     subdir if subdir.is_absolute() else self.logbooks_dir / lb_name
             # )
 
+    def parse_lb_attrs(self, lb_name: str, conditions: tuple = ()) -> dict[str, Attribute]:
+        """Return {name: Attribute} of the logbook's config'd Attributes under the conditions"""
+        def get(param, **kwargs):
+            return self._get(lb_name, param, conditions=conditions, **kwargs)
+
+        attrs = {
+            name: Attribute(name)
+            for name in get("Attributes", as_list=True)
+        }
+
+        if not attrs:
+            attrs = copy.deepcopy(DEFAULT_ATTRIBUTES)
+
+        # Set Required Attributes
+        for attr in get("Required Attributes", as_list=True):
+            if attr not in attrs:
+                warnings.warn(
+                    f"Required Attributes '{attr}' is not listed in Attributes line and is ignored"
+                )
+            else:
+                attrs[attr].required = True
+
+        # Set Extendable Options (attributes)
+        for attr in get("Extendable Options", as_list=True):
+            if attr not in attrs:
+                logger.warning(
+                    f"In config for logbook '{lb_name}', "
+                    f"Extendable Options '{attr}' is not listed in Attributes line and is ignored"
+                )
+            else:
+                attrs[attr].extendable = True
+        
+        # Categorize attribute value type e.g. `Type Start date = datetime`
+        for attr_name, attr in attrs.items():
+            if valtype := get(f"Type {attr_name}"):
+                attr.val_type = valtype
+
+        # Set the Option Types (Text by default)
+        # Logic here means if repeated, last one spec'd wins
+        for attr_name, attr in attrs.items():
+            for option_type in ["Options", "MOptions", "ROptions", "IOptions"]:
+                # XX below is specific to single space, could make whitespace tolerant
+                options = get(
+                    f"{option_type} {attr_name}", as_list=True
+                )
+                if options:
+                    attr.options_type = option_type
+                    attr.options = options
+            attr.parse_conditions()
+        return attrs
+
+    @property
+    def lb_attrs(self) -> "LogbookAttributes":
+        """{logbook name: {attr name: Attribute}}, for the current conditions"""
+        conditions = self.conditions
+        try:
+            return self._lb_attrs[conditions]
+        except KeyError:
+            lb_attrs = self._lb_attrs[conditions] = LogbookAttributes(self, conditions)
+            return lb_attrs
+
     def get(
         self,
         lb: str | Logbook,
@@ -298,7 +484,46 @@ class LogbookConfig:
         then in ELOGCONFIG_DEFAULTS in elog_cfg.py.
 
         If `valtype` specified, return the ELOGCONFIG_DEFAULTS value if conversion gives an error
+
+        Values are looked up, split and converted once for each set of arguments
+        and active conditions; a reload makes a new LogbookConfig, so a new memo.
+        """
+        lb_name = lb.name if isinstance(lb, Logbook) else lb
+        return self._get(
+            lb_name, param, default=default, valtype=valtype, as_list=as_list, conditions=self.conditions
+        )
+
+    def _get(self, lb_name: str, param: str, *, default=None, valtype=None, as_list=False, conditions=()):
+        """Return the config key's value under the given conditions, memoized"""
+        kwargs = dict(default=default, valtype=valtype, as_list=as_list, conditions=conditions)
+        key = (lb_name, param, default, valtype, as_list, conditions)
+        try:
+            val = self._get_memo[key]
+        except KeyError:
+            val = self._lookup(lb_name, param, **kwargs)
+            if lb_name in self._cfg:  # don't memo unknown sections, so each is logged
+                self._get_memo[key] = val
+        except TypeError:  # unhashable default
+            return self._lookup(lb_name, param, **kwargs)
+        # Callers may change a returned list, e.g. Attribute.options
+        return list(val) if isinstance(val, list) else val
+
+    def _lookup(
+        self,
+        lb_name: str,
+        param: str,
+        *,
+        default: Any | None = None,
+        valtype: type | None = None,
+        as_list: bool = False,
+        conditions: tuple | None = None,
+    ) -> Any:
+        """Return the config key's value, as `get` but without the memo
+
+        `conditions` default to the current ones
         """
+        if conditions is None:
+            conditions = self.conditions
         if as_list and default is None:
             default = []
 
@@ -307,7 +532,7 @@ class LogbookConfig:
         if valtype is bool:
             valtype = cfg_bool
 
-        lb_name = lb.name if isinstance(lb, Logbook) else lb  # XX need to clean lb_name?
+        # XX need to clean lb_name?
         if lb_name not in self._cfg:
             logger.warning(f"Unknown config section {lb_name}")
             return default
@@ -331,7 +556,7 @@ class LogbookConfig:
         ), "Error, Config._cfg values must be a dict"
 
         # Go through conditions in order, fall back to no condition ("")
-        for condition in self._conditions:
+        for condition in conditions:
             try:
                 val = val_dict[condition]
                 break
@@ -365,13 +590,9 @@ class LogbookConfig:
         return return_vals if as_list else return_vals[0]
 
     def logbook_names(self):
-        return self.configp.sections()
+        return [name for name in self._cfg if name != "global"]
 
 
-    @property
-    def lb_attrs(self):
-        return self._lb_attrs
-
     def IOptions(self, logbook: Logbook, lowercase=False):
         return [
             attr_name.lower() if lowercase else attr_name
@@ -393,8 +614,12 @@ def active_config(cls) -> LogbookConfig:
 
 
 def config_updated(sender, **kwargs):
-    global _cfg
-    reload_config()
+    elog_config = kwargs['instance']
+    if _cfg is not None and elog_config.name == "global":
+        update_config_section("global", elog_config.config_text)
+    else:
+        reload_config()
+    transaction.on_commit(bump_config_stamp)
 
 
 def logbook_updated(sender, **kwargs):
@@ -409,29 +634,151 @@ def logbook_updated(sender, **kwargs):
                 for perm in group_perms:
                     assign_perm(perm, group, logbook)
 
-    reload_config()
+    update_logbook_config(logbook)
+    transaction.on_commit(bump_config_stamp)
 
 
-def reload_config():
+def logbook_deleted(sender, **kwargs):
+    update_logbook_config(kwargs['instance'], deleted=True)
+    transaction.on_commit(bump_config_stamp)
+
+
+def update_logbook_config(logbook: Logbook, deleted=False):
+    """Update the config for a change to one logbook, re-parsing only its section"""
+    if _cfg is None:
+        reload_config()
+        return
+    # If another section has gone (e.g. logbook renamed), start afresh
+    other_names = set(_cfg.logbook_names()) - {logbook.name}
+    if not other_names <= set(Logbook.objects.filter(active=True).values_list("name", flat=True)):
+        reload_config()
+        return
+    in_config = logbook.active and not deleted
+    update_config_section(logbook.name, (logbook.config or "\n") if in_config else None)
+
+
+def update_config_section(section_name: str, config_text: str | None):
+    """Re-parse one section of the config, or all of it if another process has changed it"""
     global _cfg
+    if cache.get(CONFIG_STAMP_KEY) != _cfg_stamp:  # else the update would lose the other change
+        reload_config()
+        return
+    _cfg = _cfg.with_section(section_name, config_text)
+
+
+def bump_config_stamp():
+    """Tell other processes the config has changed, so they reload it
+
+    The stamp is incremented (atomically in the cache), so this process knows
+    whether another one also changed the config since it was loaded here.
+    If so, this process reloads it too.
+    """
+    global _cfg, _cfg_stamp
+    if cache.add(CONFIG_STAMP_KEY, stamp := time.time_ns(), None):  # no stamp yet
+        is_ours = _cfg_stamp is None
+    else:
+        try:
+            stamp = cache.incr(CONFIG_STAMP_KEY)
+        except ValueError:  # gone from the cache since `add`
+            stamp = None
+        is_ours = stamp is not None and _cfg_stamp is not None and stamp == _cfg_stamp + 1
+    if is_ours:
+        _cfg_stamp = stamp  # this process already has the new config
+    else:
+        _cfg = None  # reload when next needed
+
+
+def db_config_text() -> str:
+    """Return the whole config text, from the global ElogConfig and active logbooks"""
     try:
         global_config_text = "[global]\n" + ElogConfig.objects.get(name="global").config_text + "\n"
     except ElogConfig.DoesNotExist:
         global_config_text = "[global]\n"
     lb_config_texts = [f"\n\n[{lb.name}]\n" + (lb.config if lb.config else "\n") for lb in Logbook.active_logbooks()]
-    _cfg = LogbookConfig(global_config_text + "".join(lb_config_texts))
+    return global_config_text + "".join(lb_config_texts)
+
+
+def config_cache_path(config_text: str, cache_dir: str | Path | None = None) -> Path | None:
+    """Return the file for the text's parsed config, or None if no FLEXELOG_CONFIG_CACHE_DIR"""
+    cache_dir = cache_dir or CONFIG_CACHE_DIR
+    if not cache_dir:
+        return None
+    digest = hashlib.sha256(_CONFIG_CACHE_FORMAT + config_text.encode("utf-8")).hexdigest()
+    return Path(cache_dir) / f"{CONFIG_CACHE_PREFIX}{digest}.pickle"
+
+
+def save_compiled_config(cfg: LogbookConfig, path: Path):
+    """Write the parsed config to path, removing any others in its directory"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temp_path, "wb") as f:
+        pickle.dump(cfg, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temp_path, path)  # so other processes never read a partly written file
+    for old_path in path.parent.glob(f"{CONFIG_CACHE_PREFIX}*.pickle"):
+        if old_path != path:
+            old_path.unlink(missing_ok=True)
+
+
+def compiled_config(config_text: str) -> LogbookConfig:
+    """Return the LogbookConfig for the text, from the on-disk cache if there is one"""
+    path = config_cache_path(config_text)
+    if path is None:
+        return LogbookConfig(config_text)
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Unable to read config cache file {path}, parsing config instead: {e}")
+    cfg = LogbookConfig(config_text)
+    try:
+        save_compiled_config(cfg, path)
+    except OSError as e:
+        logger.warning(f"Unable to write config cache file {path}: {e}")
+    return cfg
+
+
+def reload_config():
+    global _cfg, _cfg_stamp, _cfg_checked
+    # Read before the config, so a change while loading is picked up at the next check
+    _cfg_stamp = cache.get(CONFIG_STAMP_KEY)
+    _cfg_checked = time.monotonic()
+    _cfg = compiled_config(db_config_text())
+
+def request_started_clear_conditions(sender, **kwargs):
+    # Threads are reused for later requests, so don't keep an earlier request's conditions
+    _active_conditions.set((0, ()))
+
 
 # Set up signal to reload config if ElogConfig changed
 post_save.connect(config_updated, sender=ElogConfig)
 post_save.connect(logbook_updated, sender=Logbook)
+post_delete.connect(logbook_deleted, sender=Logbook)
+request_started.connect(request_started_clear_conditions)
+
+
+def config_is_stale() -> bool:
+    """Return True if another process has changed the config since it was loaded here
+
+    Checks the cache at most every CONFIG_CHECK_SECONDS
+    """
+    global _cfg_checked
+    now = time.monotonic()
+    if now - _cfg_checked < CONFIG_CHECK_SECONDS:
+        return False
+    _cfg_checked = now
+    stamp = cache.get(CONFIG_STAMP_KEY)
+    return stamp is not None and stamp != _cfg_stamp
+
 
 def get_config() -> LogbookConfig:
     global _cfg
-    if _cfg is None:
+    if _cfg is None or config_is_stale():
         reload_config()
     return _cfg
 
 def cfg_context(request):
     return {
-        "cfg": _cfg
+        "cfg": get_config()
     }
\ No newline at end of file
@@ -85,7 +85,7 @@ def lb_attrs_to_form_fields(
 
         elif lb_attr.options_type in ("Options", "ROptions", "MOptions", "IOptions"):
             # Show choices(options) in current logbook config, and if entry has another, add them to choices
-            choices = lb_attr.options
+            choices = list(lb_attr.options)  # don't add to the config's options
             if data and name in data:
                 for entry_choice in data.getlist(name):
                     if entry_choice not in choices:
@@ -0,0 +1,165 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Optional full-text index over entry text and attribute values
+
+Without it, a text search reads the text of every entry in the logbook.
+The index is made (or rebuilt) by the `fulltext_index` management command:
+
+* SQLite: an FTS5 table with the trigram tokenizer, so any 3+ character
+  text is found, as with a plain search.  Triggers on the entry table keep it
+  up to date, including for bulk changes which don't send Django signals.
+* PostgreSQL: GIN indexes on `tsvector`s of the text, and of the text plus
+  the attributes' string values.  PostgreSQL maintains these itself.
+  Words are matched from their start, so a search for part of a word
+  from its middle is not found.
+
+The index only narrows down the entries; the search pattern is still
+applied to them, so case sensitivity, `^`, `$` etc. work as without it.
+Whether the index exists is kept in the cache, rather than looked up for
+every search; the management command clears it when making or dropping
+the index.
+"""
+from functools import reduce
+import operator
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from flexelog.listing import compile_filter, parse_pattern
+from flexelog.models import Entry
+
+FTS_NAME = "flexelog_entry_fts"
+AVAILABLE_CACHE_KEY = "flexelog:fulltext_available"
+AVAILABLE_CACHE_TIMEOUT = getattr(settings, "FLEXELOG_FULLTEXT_CACHE_TIMEOUT", 60 * 60)
+_TRIGRAM_MIN_LENGTH = 3  # FTS5 trigram can't match shorter text
+
+_ATTR_STRINGS_SQL = "(SELECT group_concat(value, ' ') FROM json_tree({row}.attrs) WHERE type = 'text')"
+_FTS_INSERT_SQL = (
+    f"INSERT INTO {FTS_NAME}(rowid, text, attrs) "
+    f"VALUES ({{row}}.rowid, {{row}}.text, {_ATTR_STRINGS_SQL})"
+)
+
+_PG_TEXT_VECTOR = """to_tsvector('simple', coalesce("text", ''))"""
+_PG_ALL_VECTOR = f"""({_PG_TEXT_VECTOR} || to_tsvector('simple', coalesce("attrs", '{{}}'::jsonb)))"""
+
+
+def _sqlite_create_sql(table):
+    return [
+        f"CREATE VIRTUAL TABLE {FTS_NAME} USING fts5(text, attrs, tokenize='trigram')",
+        f"INSERT INTO {FTS_NAME}(rowid, text, attrs) "
+        f"SELECT rowid, text, {_ATTR_STRINGS_SQL.format(row=table)} FROM {table}",
+        f"CREATE TRIGGER {FTS_NAME}_insert AFTER INSERT ON {table} BEGIN "
+        f"{_FTS_INSERT_SQL.format(row='new')}; END",
+        f"CREATE TRIGGER {FTS_NAME}_delete AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {FTS_NAME} WHERE rowid = old.rowid; END",
+        f"CREATE TRIGGER {FTS_NAME}_update AFTER UPDATE OF text, attrs ON {table} BEGIN "
+        f"DELETE FROM {FTS_NAME} WHERE rowid = old.rowid; {_FTS_INSERT_SQL.format(row='new')}; END",
+    ]
+
+
+def _sqlite_drop_sql():
+    return [
+        f"DROP TRIGGER IF EXISTS {FTS_NAME}_{action}" for action in ("insert", "delete", "update")
+    ] + [f"DROP TABLE IF EXISTS {FTS_NAME}"]
+
+
+def _postgresql_create_sql(table):
+    return [
+        f"CREATE INDEX {FTS_NAME}_text ON {table} USING GIN (({_PG_TEXT_VECTOR}))",
+        f"CREATE INDEX {FTS_NAME}_all ON {table} USING GIN ({_PG_ALL_VECTOR})",
+    ]
+
+
+def _postgresql_drop_sql():
+    return [f"DROP INDEX IF EXISTS {FTS_NAME}_text", f"DROP INDEX IF EXISTS {FTS_NAME}_all"]
+
+
+def is_supported() -> bool:
+    return connection.vendor in ("sqlite", "postgresql")
+
+
+def is_available() -> bool:
+    """Return True if the full-text index has been made in the database (cached)"""
+    available = cache.get(AVAILABLE_CACHE_KEY)
+    if available is None:
+        available = _index_exists()
+        cache.set(AVAILABLE_CACHE_KEY, available, AVAILABLE_CACHE_TIMEOUT)
+    return available
+
+
+def clear_available_cache():
+    cache.delete(AVAILABLE_CACHE_KEY)
+
+
+def _index_exists() -> bool:
+    if connection.vendor == "sqlite":
+        sql = "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s"
+    elif connection.vendor == "postgresql":
+        sql = "SELECT 1 FROM pg_indexes WHERE indexname = %s"
+    else:
+        return False
+    name = FTS_NAME if connection.vendor == "sqlite" else f"{FTS_NAME}_all"
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [name])
+        return cursor.fetchone() is not None
+
+
+def drop_index():
+    """Remove the full-text index, if it exists"""
+    statements = _sqlite_drop_sql() if connection.vendor == "sqlite" else _postgresql_drop_sql()
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql)
+    clear_available_cache()
+
+
+def rebuild_index():
+    """(Re)make the full-text index from all entries"""
+    if not is_supported():
+        raise NotImplementedError(f"Full-text index is not available for {connection.vendor} databases")
+    table = connection.ops.quote_name(Entry._meta.db_table)
+    create = _sqlite_create_sql if connection.vendor == "sqlite" else _postgresql_create_sql
+    drop_index()
+    with connection.cursor() as cursor:
+        for sql in create(table):
+            cursor.execute(sql)
+    clear_available_cache()
+
+
+def _index_match(literal: str, also_attrs: bool) -> Q | None:
+    """Return condition for entries the index says may contain literal, or None if no help"""
+    if connection.vendor == "sqlite":
+        if len(literal) < _TRIGRAM_MIN_LENGTH:
+            return None
+        columns = "{text attrs}" if also_attrs else "{text}"
+        phrase = '"' + literal.replace('"', '""') + '"'
+        sql = f"SELECT rowid FROM {FTS_NAME} WHERE {FTS_NAME} MATCH %s"
+        return Q(rowid__in=RawSQL(sql, [f"{columns} : {phrase}"]))
+
+    words = re.findall(r"\w+", literal)
+    if not words:
+        return None
+    table = connection.ops.quote_name(Entry._meta.db_table)
+    vector = _PG_ALL_VECTOR if also_attrs else f"({_PG_TEXT_VECTOR})"
+    sql = f"SELECT rowid FROM {table} WHERE {vector} @@ to_tsquery('simple', %s)"
+    return Q(rowid__in=RawSQL(sql, [" & ".join(f"{word}:*" for word in words)]))
+
+
+def text_search_filter(pattern: str, case_sensitive=False, attr_fields=()) -> Q:
+    """Return filter condition for entries with the pattern in their text or (optionally) attrs
+
+    `attr_fields` are listing db fields, e.g. `attrs__Subject`, also searched
+    for "Search text also in attributes"
+    """
+    conditions = [compile_filter("text", pattern, case_sensitive)]
+    conditions.extend(compile_filter(field, pattern, case_sensitive) for field in attr_fields)
+    condition = reduce(operator.or_, (Q(cond) for cond in conditions))
+
+    literal = parse_pattern(pattern)[0]
+    if literal and is_available():
+        if index_match := _index_match(literal, also_attrs=bool(attr_fields)):
+            condition = index_match & condition
+    return condition
@@ -0,0 +1,54 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Cached logbook group membership, for the logbook index and tabs
+
+Which logbooks are in which LogbookGroup is read in one query and kept in
+the cache until a logbook or group is changed.  Each request then only
+picks out the logbooks the user can see (see `views.available_groups`).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from flexelog.models import Logbook, LogbookGroup
+
+GROUPS_KEY = "flexelog:group_membership"
+# Safety net in case something changes groups without signals, e.g. bulk changes
+GROUPS_CACHE_TIMEOUT = 60 * 60
+
+
+def group_membership() -> list[tuple[str, list[int]]]:
+    """Return [(group name, [logbook id, ...]), ...] for groups with any logbooks"""
+    membership = cache.get(GROUPS_KEY)
+    if membership is None:
+        membership = {}
+        rows = (
+            LogbookGroup.logbooks.through.objects
+            .order_by("logbookgroup_id", "logbook__order", "logbook_id")
+            .values_list("logbookgroup__name", "logbook_id")
+        )
+        for group_name, lb_id in rows:
+            membership.setdefault(group_name, []).append(lb_id)
+        membership = list(membership.items())
+        cache.set(GROUPS_KEY, membership, GROUPS_CACHE_TIMEOUT)
+    return membership
+
+
+def invalidate_groups():
+    cache.delete(GROUPS_KEY)
+    # and again once committed, in case a request cached the old membership meanwhile
+    transaction.on_commit(lambda: cache.delete(GROUPS_KEY))
+
+
+@receiver(m2m_changed, sender=LogbookGroup.logbooks.through)
+def group_logbooks_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_groups()
+
+
+@receiver(post_save, sender=Logbook)
+@receiver(post_save, sender=LogbookGroup)
+@receiver(post_delete, sender=Logbook)
+@receiver(post_delete, sender=LogbookGroup)
+def logbook_or_group_changed(sender, **kwargs):
+    invalidate_groups()
@@ -0,0 +1,365 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Database queries for logbook listings: sorting on attributes, related objects
+
+Attributes live in the `Entry.attrs` JSON field, so on their own they can't
+use an index.  The expressions here are also used to build per-logbook
+expression indexes (see the `attr_indexes` management command), so a listing
+sorted by an attribute reads the index in order rather than scanning and
+sorting the whole logbook.
+
+For the database to match a query to an index, the SQL must be the same
+in both, so attribute names and constants are written into the SQL as
+literals rather than passed as query parameters.
+"""
+from dataclasses import dataclass
+import hashlib
+
+from django.db.models import Expression, F, FloatField, Index, Q, TextField, Value
+from django.db.models.functions import Cast, Coalesce, Left, Lower, Right, StrIndex
+from django.db.models.lookups import (
+    Exact, GreaterThan, GreaterThanOrEqual, IContains, IEndsWith, IExact, IRegex,
+    IStartsWith, LessThan, Regex,
+)
+from django.utils.translation import get_language, gettext as _
+
+from flexelog.elog_cfg import LogbookConfig, get_config
+from flexelog.models import Entry, Logbook
+
+NUMERIC_TYPES = ("numeric", "date", "datetime")  # PSI elog stores dates as seconds since epoch
+ATTR_INDEX_PREFIX = "flexelog_attr_"
+_MISSING_NUMBER = "-1e308"  # Missing numeric attributes sort before any value
+_NUMBER_REGEX = r"^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$"
+
+
+def _sql_literal(text: str) -> str:
+    # Single quotes doubled for SQL; `%` doubled as the SQL is %-formatted with params
+    return "'" + text.replace("'", "''").replace("%", "%%") + "'"
+
+
+class Literal(Expression):
+    """Constant SQL text, rather than a query parameter like `Value`"""
+
+    def __init__(self, sql, output_field=None):
+        super().__init__(output_field=output_field)
+        self.sql = sql
+
+    def as_sql(self, compiler, connection):
+        return self.sql, []
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.sql})"
+
+
+class AttrText(Expression):
+    """The text value of an entry attribute, e.g. `json_extract(attrs, '$."Category"')`"""
+
+    output_field = TextField()
+
+    def __init__(self, attr_name):
+        super().__init__()
+        self.attr_name = attr_name
+        self.attrs = F("attrs")
+
+    def get_source_expressions(self):
+        return [self.attrs]
+
+    def set_source_expressions(self, exprs):
+        (self.attrs,) = exprs
+
+    def as_sql(self, compiler, connection):
+        attrs_sql, params = compiler.compile(self.attrs)
+        if connection.vendor == "postgresql":
+            return f"({attrs_sql} ->> {_sql_literal(self.attr_name)})", params
+        path = '$."' + self.attr_name.replace('"', '\\"') + '"'
+        if connection.vendor == "mysql":
+            return f"JSON_UNQUOTE(JSON_EXTRACT({attrs_sql}, {_sql_literal(path)}))", params
+        return f"json_extract({attrs_sql}, {_sql_literal(path)})", params
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.attr_name!r})"
+
+
+class NumberFromText(Cast):
+    """Text cast to a float, or null if the text isn't a number
+
+    PostgreSQL raises an error casting text which isn't a number, so there
+    the cast is only made if the text matches a number pattern.  SQLite
+    casts such text to 0 (and MySQL to its leading number) without error.
+    """
+
+    def __init__(self, expression):
+        super().__init__(expression, FloatField())
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        sql, params = super().as_postgresql(compiler, connection, **extra_context)
+        text_sql, text_params = compiler.compile(self.get_source_expressions()[0])
+        return f"(CASE WHEN {text_sql} ~ {_sql_literal(_NUMBER_REGEX)} THEN {sql} END)", [*text_params, *params]
+
+
+def attr_sort_expression(attr_name: str, val_type: str = ""):
+    """Return the expression to sort entries by for an attribute of the given `Type`
+
+    Numeric attributes which are missing sort first.  So do those which
+    aren't numbers, on PostgreSQL; SQLite sorts them as 0.
+    """
+    if val_type.lower() in NUMERIC_TYPES:
+        return Coalesce(
+            NumberFromText(AttrText(attr_name)),
+            Literal(_MISSING_NUMBER),
+            output_field=FloatField(),
+        )
+    # text-based, make case-insensitive.  Missing attributes sort as empty text
+    return Coalesce(Lower(AttrText(attr_name)), Literal("''"), output_field=TextField())
+
+
+def sort_expression(sort_attr_field: str, val_type: str = ""):
+    """Return the expression entries are sorted by for a listing column's db field"""
+    if sort_attr_field in ("id", "date"):
+        return F(sort_attr_field)
+    if sort_attr_field.startswith("attrs__"):
+        return attr_sort_expression(sort_attr_field.removeprefix("attrs__"), val_type)
+    return Coalesce(Lower(sort_attr_field), Literal("''"), output_field=TextField())
+
+
+def attr_index_name(lb_id: int, attr_name: str, val_type: str = "") -> str:
+    """Return index name for a logbook attribute, changing if the attribute type changes"""
+    # Names are limited in length (e.g. 63 in PostgreSQL), so hash the attribute
+    digest = hashlib.md5(f"{attr_name}\n{val_type.lower()}".encode()).hexdigest()[:10]
+    return f"{ATTR_INDEX_PREFIX}{lb_id}_{digest}"
+
+
+def attr_index(lb_id: int, attr_name: str, val_type: str = "") -> Index:
+    """Return an expression index on an attribute's sort value, for one logbook's entries"""
+    return Index(
+        attr_sort_expression(attr_name, val_type),
+        F("id"),
+        name=attr_index_name(lb_id, attr_name, val_type),
+        condition=Q(lb_id=lb_id),
+    )
+
+
+_REGEX_SPECIAL = set(".^$*+?{}[]\\|()")
+
+
+def _literal_text(pattern: str) -> str | None:
+    """Return the text a regex pattern matches literally, or None if it is not a plain literal
+
+    Escaped punctuation, e.g. `\\.`, is literal
+    """
+    chars = []
+    escaped = False
+    for char in pattern:
+        if escaped:
+            if char.isalnum() or char == "_":  # \d, \w, \b etc.
+                return None
+            chars.append(char)
+            escaped = False
+        elif char == "\\":
+            escaped = True
+        elif char in _REGEX_SPECIAL:
+            return None
+        else:
+            chars.append(char)
+    return None if escaped else "".join(chars)
+
+
+def parse_pattern(pattern: str) -> tuple[str | None, bool, bool]:
+    """Return (literal text or None if a real regex, anchored at start, anchored at end)"""
+    starts = pattern.startswith("^")
+    ends = pattern.endswith("$") and not pattern.endswith("\\$")
+    literal = _literal_text(pattern[int(starts):len(pattern) - int(ends)])
+    if not literal and not (starts and ends):  # e.g. "^" matches anything
+        literal = None
+    return literal, starts, ends
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    # Smallest string greater than every string starting with prefix
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def compile_filter(field: str, pattern: str, case_sensitive=False, val_type=""):
+    """Return a filter condition for a listing column matching a search (regex) pattern
+
+    The user's pattern is searched for anywhere in the value, like `re.search`,
+    but most are plain text, perhaps anchored with `^` or `$`.  Those become
+    exact/startswith/contains lookups, which don't call a regex function for
+    every row, and for attributes compared case-insensitively, can use the
+    attribute's expression index (see `attr_indexes`).
+    Only real regular expressions fall back to a regex lookup.
+    """
+    is_attr = field.startswith("attrs__")
+    expr = AttrText(field.removeprefix("attrs__")) if is_attr else F(field)
+
+    literal, starts, ends = parse_pattern(pattern)
+    if literal is None:
+        return Regex(expr, pattern) if case_sensitive else IRegex(expr, pattern)
+
+    if case_sensitive:
+        # Not Django's contains etc., which SQLite's LIKE does case-insensitively
+        if starts and ends:
+            return Exact(expr, literal)
+        if starts:
+            return Exact(Left(expr, len(literal)), literal)
+        if ends:
+            return Exact(Right(expr, len(literal)), literal)
+        return GreaterThan(StrIndex(expr, Value(literal)), 0)
+
+    if not literal.isascii():  # SQLite's LIKE and LOWER() only fold ASCII case
+        return IRegex(expr, pattern)
+    if is_attr and val_type.lower() not in NUMERIC_TYPES and literal and starts:
+        # The attribute's indexed sort expression is lower-cased text
+        sort_expr = attr_sort_expression(field.removeprefix("attrs__"))
+        if ends:
+            return Exact(sort_expr, literal.lower())
+        # prefix as a range, so the index can be searched
+        return GreaterThanOrEqual(sort_expr, literal.lower()) & LessThan(
+            sort_expr, _prefix_upper_bound(literal.lower())
+        )
+    if starts and ends:
+        return IExact(expr, literal)
+    if starts:
+        return IStartsWith(expr, literal)
+    if ends:
+        return IEndsWith(expr, literal)
+    return IContains(expr, literal)
+
+
+def compile_filters(filter_attrs: dict[str, str], case_sensitive=False, val_types=None) -> list:
+    """Return filter conditions for {listing db field: search pattern}
+
+    `val_types` gives the config'd `Type <attr>` for attribute fields
+    """
+    val_types = val_types or {}
+    return [
+        compile_filter(field, pattern, case_sensitive, val_types.get(field, ""))
+        for field, pattern in filter_attrs.items()
+    ]
+
+
+# Entry foreign keys which can be listing columns, and what their display needs
+_RELATED_COLUMNS = {
+    "author": ["author"],
+    "last_modified_author": ["last_modified_author"],
+    "in_reply_to": ["in_reply_to__lb"],  # str(entry) shows logbook name
+}
+
+
+def with_listing_relations(queryset, col_db_fields: list[str]):
+    """Return queryset which fetches what the listing columns show, rather than per row
+
+    The logbook (used for every row's link) and related users are joined,
+    and attachments are fetched in one extra query for the whole page
+    """
+    related = ["lb"]
+    for field in col_db_fields:
+        related.extend(_RELATED_COLUMNS.get(field, []))
+    queryset = queryset.select_related(*related)
+    if "attachments" in col_db_fields:
+        queryset = queryset.prefetch_related("attachments")
+    return queryset
+
+
+def get_list_titles_and_fields(logbook: Logbook, cfg: LogbookConfig | None = None):
+    """Return (column titles, db fields) for the logbook's `List display`"""
+    cfg = cfg or get_config()
+
+    config_attr_names = list(
+        cfg.lb_attrs[logbook.name].keys()
+    )
+    config_attr_names_lower = [attr.lower() for attr in config_attr_names]
+
+    # Get configured database and column titles
+    # Don't include Text even if listed, if config Show text=False
+    # "*attributes" puts in the Attributes for the logbook not otherwise listed
+    list_display = cfg.get(logbook, "list display", as_list=True) or []
+    list_display_lower = [x.lower() for x in list_display]
+    try:
+        i_star_attr = list_display_lower.index("*attributes")
+    except ValueError:
+        pass
+    else:
+        used_attributes = [name for name in config_attr_names if name.lower() in list_display_lower]
+        adding_attributes = [name for name in config_attr_names if name not in used_attributes]
+        list_display = list_display[:i_star_attr] + adding_attributes + list_display[i_star_attr + 1:]
+
+    col_db_fields = []
+    col_titles = []
+    show_text = cfg.get(logbook, "Show text", valtype=bool)
+    for attr_name in list_display:
+        if hasattr(Entry, attr_name.lower()):
+            # Don't add Text if configd Show text = False
+            if attr_name.lower() != "text" or show_text:
+                col_db_fields.append(attr_name.lower())
+                col_titles.append(_(attr_name))
+        elif attr_name.lower() in config_attr_names_lower:
+            col_db_fields.append(f"attrs__{attr_name}")
+            col_titles.append(attr_name)
+        # else ignore those not in Entry or config'd
+        # ^- XX could allow to show old attributes? 
+
+    return col_titles, col_db_fields
+
+
+@dataclass(frozen=True)
+class ListingPlan:
+    """What a logbook's listing shows and can sort/filter by, from its config
+
+    Built once per logbook, config version, active conditions and language
+    (column titles can be translated), rather than on every listing request
+    """
+    columns: dict[str, str]  # {column title: db field}
+    filterable: dict[str, str]  # {lower-case query parameter: db field}
+    val_types: dict[str, str]  # {db field: config'd `Type <attr>`}, attributes only
+    attr_fields: list[str]  # db fields of all config'd attributes, for "search in attributes"
+    default_sort_field: str
+    reverse_sort: bool
+    io_options: list[str]  # db fields of IOptions attributes
+
+    def val_type(self, field: str) -> str:
+        return self.val_types.get(field, "")
+
+
+_plans = {}  # {(logbook name, conditions, language): ListingPlan}
+_plans_version = None  # config version the plans were made from
+
+
+def _make_listing_plan(logbook: Logbook, cfg: LogbookConfig) -> ListingPlan:
+    col_titles, col_db_fields = get_list_titles_and_fields(logbook, cfg)
+    columns = dict(zip(col_titles, col_db_fields))
+    lb_attrs = cfg.lb_attrs[logbook.name]
+    attr_fields = [f"attrs__{name}" for name in lb_attrs]
+
+    filterable = {
+        title.lower(): field for title, field in columns.items() if field != "id"
+    }
+    filterable["subtext"] = "text"  # used in original psi elog query string
+    # Column fields are as spelled in `List display`, maybe not as in `Attributes`
+    val_types_lower = {name.lower(): attr.val_type for name, attr in lb_attrs.items()}
+    val_types = {
+        field: val_types_lower.get(field.removeprefix("attrs__").lower(), "")
+        for field in attr_fields + col_db_fields if field.startswith("attrs__")
+    }
+
+    return ListingPlan(
+        columns=columns,
+        filterable=filterable,
+        val_types=val_types,
+        attr_fields=attr_fields,
+        default_sort_field=columns.get(_("Date"), "id"),  # use ID if date not shown
+        reverse_sort=cfg.get(logbook, "Reverse sort", valtype=bool),
+        io_options=[f"attrs__{attr_name}" for attr_name in cfg.IOptions(logbook)],
+    )
+
+
+def listing_plan(logbook: Logbook, cfg: LogbookConfig | None = None) -> ListingPlan:
+    """Return the logbook's ListingPlan, made only if the config has changed"""
+    global _plans_version
+    cfg = cfg or get_config()
+    if cfg.version != _plans_version:
+        _plans.clear()
+        _plans_version = cfg.version
+    key = (logbook.name, cfg.conditions, get_language())
+    if (plan := _plans.get(key)) is None:
+        plan = _plans[key] = _make_listing_plan(logbook, cfg)
+    return plan
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flexelog.attr_indexes import existing_indexes, stale_indexes, sync_indexes, wanted_indexes
+from flexelog.models import Logbook
+
+
+class Command(BaseCommand):
+    help = (
+        "Create (or drop) database indexes on each logbook's configured attributes, "
+        "so listings sorted by an attribute don't scan the whole logbook"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-l", "--logbooks", nargs="*", type=str,
+            help="Logbook names (default all active logbooks; indexes for others are dropped)",
+        )
+        parser.add_argument("--status", action="store_true", help="Report index state, make no changes")
+        parser.add_argument("--drop", action="store_true", help="Drop the attribute indexes")
+
+    def handle(self, *args, **options):
+        logbooks = None
+        if options["logbooks"]:
+            logbooks = list(Logbook.objects.filter(name__in=options["logbooks"]))
+            unknown = set(options["logbooks"]) - {lb.name for lb in logbooks}
+            if unknown:
+                raise CommandError(f"Unknown logbook(s): {', '.join(sorted(unknown))}")
+
+        if options["status"]:
+            self.report_status(logbooks)
+            return
+
+        changes = sync_indexes(logbooks, drop_only=options["drop"])
+        for name in changes.dropped:
+            self.stdout.write(f"Dropped {name}")
+        for name in changes.created:
+            self.stdout.write(self.style.SUCCESS(f"Created {name}"))
+        if not changes.dropped and not changes.created:
+            self.stdout.write("Attribute indexes already up to date")
+
+    def report_status(self, logbooks):
+        wanted = wanted_indexes(Logbook.active_logbooks() if logbooks is None else logbooks)
+        existing = existing_indexes()
+        for name, (_, lb_name, attr_name, val_type) in wanted.items():
+            state = "ok" if name in existing else "missing"
+            style = self.style.SUCCESS if state == "ok" else self.style.WARNING
+            type_text = f" ({val_type})" if val_type else ""
+            self.stdout.write(style(f"{state:8} {name}  {lb_name}: {attr_name}{type_text}"))
+        for name in stale_indexes(wanted, existing, logbooks):
+            self.stdout.write(self.style.WARNING(f"{'stale':8} {name}"))
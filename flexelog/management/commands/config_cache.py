@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flexelog import elog_cfg
+from flexelog.elog_cfg import (
+    CONFIG_CACHE_PREFIX, LogbookConfig, config_cache_path, db_config_text, save_compiled_config
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Parse the logbooks' config and save it in FLEXELOG_CONFIG_CACHE_DIR, "
+        "so new server processes load it rather than parse it"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dir", help="Directory for the file (default FLEXELOG_CONFIG_CACHE_DIR)")
+        parser.add_argument("--clear", action="store_true", help="Remove saved config files")
+
+    def handle(self, *args, **options):
+        cache_dir = options["dir"] or elog_cfg.CONFIG_CACHE_DIR
+        if not cache_dir:
+            raise CommandError("Set FLEXELOG_CONFIG_CACHE_DIR in settings, or use --dir")
+
+        config_text = db_config_text()
+        path = config_cache_path(config_text, cache_dir)
+        if options["clear"]:
+            for old_path in path.parent.glob(f"{CONFIG_CACHE_PREFIX}*.pickle"):
+                old_path.unlink()
+                self.stdout.write(f"Removed {old_path}")
+            return
+
+        cfg = LogbookConfig(config_text)
+        cfg.parse_all()
+        save_compiled_config(cfg, path)
+        self.stdout.write(self.style.SUCCESS(f"Saved parsed config to {path}"))
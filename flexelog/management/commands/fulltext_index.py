@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from flexelog import fulltext
+
+
+class Command(BaseCommand):
+    help = (
+        "(Re)build the full-text index of entry text and attributes, "
+        "so text searches don't read every entry"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--status", action="store_true", help="Report whether the index exists, make no changes")
+        parser.add_argument("--drop", action="store_true", help="Remove the index")
+
+    def handle(self, *args, **options):
+        if not fulltext.is_supported():
+            raise CommandError(f"Full-text index is not available for {connection.vendor} databases")
+        fulltext.clear_available_cache()  # e.g. if the index was dropped in the database directly
+
+        if options["status"]:
+            if fulltext.is_available():
+                self.stdout.write(self.style.SUCCESS("Full-text index exists"))
+            else:
+                self.stdout.write(self.style.WARNING("No full-text index"))
+        elif options["drop"]:
+            fulltext.drop_index()
+            self.stdout.write("Dropped full-text index")
+        else:
+            fulltext.rebuild_index()
+            self.stdout.write(self.style.SUCCESS("Built full-text index"))
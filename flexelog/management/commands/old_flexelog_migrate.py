@@ -2,8 +2,10 @@ from collections import defaultdict
 import re
 import sys
 from django.core.management.base import BaseCommand, CommandError
+from flexelog.counts import invalidate_counts
 from flexelog.elog_cfg import LogbookConfig
 from flexelog.models import Logbook
+from flexelog.threads import rebuild_threads
 
 from itertools import batched, count
 import pathlib
@@ -323,6 +325,8 @@ class Command(BaseCommand):
                 sys.stdout.write(
                     f"Entries {min(entry_ids)}-{max(entry_ids)} committed."
                 )
+            invalidate_counts(logbook)  # bulk_create doesn't send signals
+            rebuild_threads([logbook])
 
 
 
@@ -2,6 +2,8 @@ from collections import defaultdict
 import re
 import sys
 from django.core.management.base import BaseCommand, CommandError
+from flexelog.counts import invalidate_counts
+from flexelog.threads import rebuild_threads
 from flexelog.elog_cfg import LogbookConfig
 from flexelog.models import Logbook
 
@@ -168,7 +170,7 @@ class Command(BaseCommand):
             subdir = Path(psi_cfg.get(lb_name, "Subdir", default=lb_name))
             lb_dir = subdir if subdir.is_absolute() else logbooks_dir / lb_name
             try:
-                psi_logbooks[lb_name] = PSILogbook(lb_name, lb_dir, psi_cfg._lb_attrs[lb_name])
+                psi_logbooks[lb_name] = PSILogbook(lb_name, lb_dir, psi_cfg.lb_attrs[lb_name])
             except OSError:
                 missing_logbooks.append(lb_name)
         if missing_logbooks:
@@ -291,6 +293,8 @@ class Command(BaseCommand):
                 sys.stdout.write(
                     f"Entries {min(entry_ids)}-{max(entry_ids)} committed."
                 )
+            invalidate_counts(logbook)  # bulk_create doesn't send signals
+            rebuild_threads([logbook])
 
             # XXX do the work
             self.stdout.write(self.style.SUCCESS("OK"))
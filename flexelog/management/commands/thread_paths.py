@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from flexelog.models import Logbook
+from flexelog.threads import rebuild_threads
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill in (or correct) each entry's thread root and path, e.g. after migrating "
+        "or bulk loading entries, so thread trees are read with one query"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-l", "--logbooks", nargs="*", type=str,
+            help="Logbook names (default all logbooks)",
+        )
+        parser.add_argument("--status", action="store_true", help="Report entries without thread paths, make no changes")
+
+    def handle(self, *args, **options):
+        logbooks = list(Logbook.objects.all())
+        if options["logbooks"]:
+            logbooks = [lb for lb in logbooks if lb.name in options["logbooks"]]
+            unknown = set(options["logbooks"]) - {lb.name for lb in logbooks}
+            if unknown:
+                raise CommandError(f"Unknown logbook(s): {', '.join(sorted(unknown))}")
+
+        if options["status"]:
+            for logbook in logbooks:
+                missing = logbook.entries.filter(thread_path="").count()
+                style = self.style.WARNING if missing else self.style.SUCCESS
+                self.stdout.write(style(f"{logbook.name}: {missing} entries without thread paths"))
+            return
+
+        for lb_name, changed in rebuild_threads(logbooks).items():
+            self.stdout.write(self.style.SUCCESS(f"{lb_name}: updated {changed} entries"))
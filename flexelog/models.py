@@ -105,7 +105,8 @@ class Logbook(models.Model):
             f"{'   unlisted' if self.is_unlisted else ''}"
         )
     def latest_date(self):
-        return self.entries.latest("date").date  # XXX need to check if no entries
+        """Return date of the logbook's latest entry, or None if it has none"""
+        return self.entries.aggregate(latest=models.Max("date"))["latest"]
     
     @classmethod
     def active_logbooks(cls):
@@ -150,6 +151,11 @@ class Entry(models.Model):
     encoding = models.TextField(blank=True, null=True)
     locked_by = models.TextField(blank=True, null=True)
     text = models.TextField(blank=True, null=True)
+    # Thread this entry is in, maintained by flexelog.threads:
+    #   id of the entry starting the thread, and the ids from there down to this entry
+    #   as fixed-width numbers joined with ".", so sorting by path gives the tree's order
+    thread_root = models.IntegerField(blank=True, null=True)
+    thread_path = models.TextField(blank=True, default="")
     # attachments
 
  
@@ -161,7 +167,11 @@ class Entry(models.Model):
     
     def reply_ancestor(self):
         """Return self, or first ancestor that is not a reply to another entry"""
-        root = self
+        if self.thread_path:
+            if self.thread_root == self.id:
+                return self
+            return Entry.objects.get(lb=self.lb_id, id=self.thread_root)
+        root = self  # thread not yet filled in, see `thread_paths` command
         while root.in_reply_to:
             root = root.in_reply_to
         return root
@@ -174,7 +184,8 @@ class Entry(models.Model):
         verbose_name_plural = _("Entries")
         indexes = [
             models.Index(fields=["lb", "-id"]),
-            models.Index(fields=["lb", "-date"])
+            models.Index(fields=["lb", "-date"]),
+            models.Index(fields=["lb", "thread_root", "thread_path"]),
         ]
     
     @property
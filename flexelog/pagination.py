@@ -0,0 +1,197 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Keyset (cursor) pagination for logbook entry listings
+
+Django's Paginator uses OFFSET to get to a page, so the deeper the page,
+the more rows the database has to walk past.  Here a cursor records the
+(sort value, id) of the row at a page boundary, and the next/previous page is
+found by seeking past that position, e.g. `WHERE (sort, id) > (...)`, which
+can use the logbook indexes and costs the same on any page.
+
+A cursor also records the sort it was made for (field and direction).  A cursor
+carried over to a listing with another sort, or one which is not valid, is
+ignored, so the listing falls back to `?page=N`.
+
+The queryset must be annotated with `SORT_KEY` and ordered by
+(SORT_KEY, id field) in the directions passed to `KeysetPaginator`.
+`?page=N` still works through the usual `get_page`.
+"""
+import base64
+from datetime import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db.models import Count, Q, Subquery, Value
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+SORT_KEY = "sort_key"  # queryset annotation holding the primary sort value
+
+
+def encode_cursor(
+    sort_val, entry_id: int, number: int, before: bool = False, sort: tuple[str, bool] = ("", False)
+) -> str:
+    """Return url-safe cursor text for a page boundary row
+
+    `sort` is the (sort field, descending) the listing was sorted by
+    """
+    if isinstance(sort_val, datetime):
+        sort_val = {"dt": sort_val.isoformat()}
+    sort_field, sort_desc = sort
+    payload = json.dumps(
+        [sort_val, entry_id, number, int(before), sort_field, int(sort_desc)], separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple | None:
+    """Return the parts of cursor text, or None if it is not valid
+
+    i.e. (sort_val, entry_id, page number, before, (sort field, descending))
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_val, entry_id, number, before, sort_field, sort_desc = json.loads(base64.urlsafe_b64decode(padded))
+        if isinstance(sort_val, dict):
+            if (sort_val := parse_datetime(sort_val["dt"])) is None:
+                return None
+        elif sort_val is None or isinstance(sort_val, (list, bool)):
+            return None
+        if not isinstance(sort_field, str):
+            return None
+        return sort_val, int(entry_id), max(1, int(number)), bool(before), (sort_field, bool(sort_desc))
+    except (ValueError, TypeError, KeyError):
+        return None
+
+
+class KeysetPage(Page):
+    """A Page which knows the cursors for the pages either side of it
+
+    For pages found by cursor, whether there is a next/previous page is known
+    from fetching one extra row, rather than from the total count.
+    """
+
+    def __init__(self, object_list, number, paginator, *, has_next=None, has_previous=None):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def has_next(self):
+        return super().has_next() if self._has_next is None else self._has_next
+
+    def has_previous(self):
+        return super().has_previous() if self._has_previous is None else self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def _boundary_cursor(self, index, number, before=False):
+        if not isinstance(self.object_list, list):
+            self.object_list = list(self.object_list)
+        if not self.object_list:
+            return None
+        row = self.object_list[index]
+        return encode_cursor(
+            getattr(row, SORT_KEY), getattr(row, self.paginator.id_field), number, before, self.paginator.sort
+        )
+
+    @cached_property
+    def next_cursor(self):
+        return self._boundary_cursor(-1, self.number + 1)
+
+    @cached_property
+    def previous_cursor(self):
+        return self._boundary_cursor(0, self.number - 1, before=True)
+
+
+class KeysetPaginator(Paginator):
+    """Paginator which can also find pages from cursors
+
+    `sort_field` names the listing's sort (e.g. `date`, `attrs__Subject`),
+    so cursors made for another sort are not used
+    """
+
+    def __init__(
+        self, object_list, per_page, *, sort_field="", sort_desc=False, id_desc=False, id_field="id", **kwargs
+    ):
+        super().__init__(object_list, per_page, **kwargs)
+        self.sort_field = sort_field
+        self.sort_desc = bool(sort_desc)
+        self.id_desc = bool(id_desc)
+        self.id_field = id_field
+
+    @property
+    def sort(self) -> tuple[str, bool]:
+        return self.sort_field, self.sort_desc
+
+    def seek(self, sort_val, entry_id, *, before=False) -> Q:
+        """Return Q for the rows after (or before) position (sort_val, entry_id) in sort order
+
+        `sort_val` can also be an expression, e.g. a Subquery for a row's sort value
+        """
+        sort_cmp = "lt" if self.sort_desc != before else "gt"
+        id_cmp = "lt" if self.id_desc != before else "gt"
+        # The redundant `sort >= val` bound lets the database range-scan an index on sort
+        return Q(**{f"{SORT_KEY}__{sort_cmp}e": sort_val}) & (
+            Q(**{f"{SORT_KEY}__{sort_cmp}": sort_val})
+            | Q(**{SORT_KEY: sort_val, f"{self.id_field}__{id_cmp}": entry_id})
+        )
+
+    def position(self, entry_id) -> int | None:
+        """Return the 0-based index of entry_id in the sorted list, or None if it is not in it
+
+        One query: count the rows which sort before the entry's (sort value, id),
+        seeking on the sort index rather than numbering every row
+        """
+        id_filter = {self.id_field: entry_id}
+        sel_sort_val = Subquery(self.object_list.filter(**id_filter).values(SORT_KEY)[:1])
+        rows_before = (
+            self.object_list.filter(self.seek(sel_sort_val, entry_id, before=True))
+            .order_by()
+            .annotate(all_rows=Value(1))  # one group: all the rows before
+            .values("all_rows")
+            .annotate(count=Count("pk"))
+            .values("count")
+        )
+        return (
+            self.object_list.filter(**id_filter)
+            .annotate(rows_before=Subquery(rows_before))
+            .values_list("rows_before", flat=True)
+            .first()
+        )
+
+    def page_from_cursor(self, cursor: str) -> KeysetPage | None:
+        """Return the page the cursor points to, or None if the cursor is not valid for this listing"""
+        decoded = decode_cursor(cursor)
+        if decoded is None:
+            return None
+        sort_val, entry_id, number, before, sort = decoded
+        if sort != self.sort:  # e.g. a link kept the cursor when changing the sort
+            return None
+
+        sort_field = self.object_list.query.annotations[SORT_KEY].output_field
+        try:
+            sort_val = sort_field.to_python(sort_val)  # e.g. a number where a date is expected
+            queryset = self.object_list.filter(self.seek(sort_val, entry_id, before=before))
+            if before:
+                queryset = queryset.reverse()
+            rows = list(queryset[: self.per_page + 1])  # one extra to see if there are more
+        except (ValidationError, TypeError):
+            return None
+        has_more = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        if not rows:  # e.g. entries deleted since the link was made
+            return self.get_page(number)
+
+        if before:
+            rows.reverse()
+            number = max(number, 2) if has_more else 1
+            return KeysetPage(rows, number, self, has_next=True, has_previous=has_more)
+        number = min(number, self.num_pages)
+        return KeysetPage(rows, number, self, has_next=has_more, has_previous=number > 1)
+
+    def _get_page(self, *args, **kwargs):
+        return KeysetPage(*args, **kwargs)
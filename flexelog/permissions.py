@@ -0,0 +1,91 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Cached per-user logbook permissions
+
+Each user's object permissions on all logbooks, {logbook id: codenames},
+are read in bulk (their own and their groups') and kept in the cache, so
+views needn't ask guardian about each logbook on every request.
+
+Any change to object permissions, group membership or a user clears all
+users' cached permissions, as does FLEXELOG_PERMS_CACHE_TIMEOUT passing
+(a safety net for changes which don't send signals, e.g. guardian's bulk
+assignment to a queryset).
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from flexelog.models import Logbook
+
+PERMS_CACHE_TIMEOUT = getattr(settings, "FLEXELOG_PERMS_CACHE_TIMEOUT", 5 * 60)
+_GENERATION_KEY = "flexelog:perms_generation"
+ALL_LOGBOOKS = None  # key in a superuser's permissions, as they have all perms on every logbook
+
+
+def _perms_key(user_id):
+    generation = cache.get_or_set(_GENERATION_KEY, time.time_ns, None)
+    return f"flexelog:perms:{generation}:{user_id}"
+
+
+def user_logbook_perms(user) -> dict[int | None, frozenset[str]]:
+    """Return {logbook id: codenames} of the user's object permissions on logbooks
+
+    As for guardian's `get_perms`, inactive users have none, and superusers have
+    all of them on every logbook, under the key ALL_LOGBOOKS.
+    """
+    if not user.is_authenticated or not user.is_active:
+        return {}
+    key = _perms_key(user.pk)
+    perms = cache.get(key)
+    if perms is None:
+        content_type = ContentType.objects.get_for_model(Logbook)
+        if user.is_superuser:
+            codenames = Permission.objects.filter(content_type=content_type).values_list("codename", flat=True)
+            perms = {ALL_LOGBOOKS: frozenset(codenames)}
+        else:
+            user_perms = UserObjectPermission.objects.filter(user=user, content_type=content_type)
+            group_perms = GroupObjectPermission.objects.filter(group__user=user, content_type=content_type)
+            lb_codenames = {}
+            for object_perms in (user_perms, group_perms):
+                for object_pk, codename in object_perms.values_list("object_pk", "permission__codename"):
+                    lb_codenames.setdefault(int(object_pk), set()).add(codename)
+            perms = {lb_id: frozenset(codenames) for lb_id, codenames in lb_codenames.items()}
+        cache.set(key, perms, PERMS_CACHE_TIMEOUT)
+    return perms
+
+
+def logbook_perms(user, logbook: Logbook) -> frozenset[str]:
+    """Return the codenames of the user's permissions on the logbook"""
+    perms = user_logbook_perms(user)
+    return perms.get(ALL_LOGBOOKS) or perms.get(logbook.id, frozenset())
+
+
+def invalidate_perms():
+    """Drop all users' cached permissions"""
+    cache.set(_GENERATION_KEY, time.time_ns(), None)
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+def permissions_changed(sender, **kwargs):
+    invalidate_perms()
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, update_fields=None, **kwargs):
+    # e.g. made superuser or inactive, but not just logged in
+    if update_fields is None or set(update_fields) != {"last_login"}:
+        invalidate_perms()
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, action, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_perms()
@@ -0,0 +1,131 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Entry text summaries for listings, showing the text around search matches
+
+Search patterns are compiled by `compile_pattern`, which keeps the most
+recently used ones (also used for highlighting the matches).  Each entry's
+summary is then made in time linear in the text:
+
+* matches are found in one pass, each clipped to some text either side,
+  moved to a nearby word break, and merged with the previous clip if they
+  overlap
+* once the clips hold more text than the summary can show, no more
+  matches are looked for, so a huge entry (e.g. a pasted log file)
+  with many matches costs no more than a small one
+* without a search pattern, only the start of the text is wrapped
+"""
+from functools import lru_cache
+import re
+import textwrap
+
+BREAK_WITHIN = 12  # adjust clips to include a word break within this many characters
+ELLIPSIS = "..."
+PATTERN_CACHE_SIZE = 256
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def compile_pattern(pattern: str | None, case_sensitive=False) -> re.Pattern | None:
+    """Return regex for the search pattern, or None if no (valid) pattern"""
+    if not pattern:
+        return None
+    case_sens = "" if case_sensitive else "(?i)"
+    try:
+        return re.compile(rf"{case_sens}({pattern})")
+    except re.error:
+        return None  # If problem with the search pattern, ignore it
+
+
+@lru_cache(maxsize=32)
+def _wrapper(width: int, max_lines: int) -> textwrap.TextWrapper:
+    return textwrap.TextWrapper(width, max_lines=max_lines)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def nearest_break(text: str, index: int, lo: int, hi: int, break_tie_left=True) -> int:
+    """Return the position of the word break in text[lo:hi] nearest to index
+
+    The ends of the window count as breaks.  Scans forward through the
+    window once, stopping when past `index` and further from it than
+    the nearest break so far.
+    """
+    lo = max(0, lo)
+    hi = min(len(text), hi)
+    index = max(lo, min(index, hi))
+    nearest = lo
+    min_distance = index - lo
+    is_word_prev = _is_word_char(text[lo]) if lo < hi else False
+    for i in range(lo + 1, hi + 1):
+        distance = abs(i - index)
+        if i > index and distance > min_distance:
+            break
+        is_word = _is_word_char(text[i]) if i < hi else not is_word_prev
+        if is_word != is_word_prev:
+            if distance < min_distance or (distance == min_distance and not break_tie_left):
+                nearest = i
+                min_distance = distance
+        is_word_prev = is_word
+    return nearest
+
+
+def _clips(text: str, regex: re.Pattern, width: int, max_chars: int) -> list[tuple[int, int]]:
+    """Return merged (start, end) clips of the text around the regex matches
+
+    Stops looking for matches once the clips hold `max_chars` characters
+    """
+    max_pre = width // 2
+    max_post = width // 3
+    merged = []
+    total = 0
+    for match in regex.finditer(text):
+        start_near = max(0, match.start() - max_pre)
+        end_near = match.end() + max_post
+        start = nearest_break(text, start_near, start_near - BREAK_WITHIN, start_near + BREAK_WITHIN)
+        end = nearest_break(
+            text, end_near, end_near - BREAK_WITHIN, end_near + BREAK_WITHIN, break_tie_left=False
+        )
+        if merged and start <= merged[-1][1]:
+            prev_start, prev_end = merged[-1]
+            merged[-1] = (prev_start, max(prev_end, end))
+            total += max(0, end - prev_end)
+        else:
+            merged.append((start, end))
+            total += end - start
+        if total >= max_chars:
+            break
+        if match.start() == match.end():  # empty match, would repeat at every position
+            break
+    return merged
+
+
+def summary_lines(text: str, width: int, max_lines: int, regex: re.Pattern | None = None) -> list[str]:
+    """Return up to max_lines lines of text wrapped to width, around the regex's matches if given"""
+    if not text:
+        return []
+    max_chars = width * max_lines
+    if regex is not None and len(text) >= max_chars:
+        clips = _clips(text, regex, width, max_chars)
+        if clips:
+            snippet = ELLIPSIS.join(text[start:end] for start, end in clips)
+            prepend = "" if clips[0][0] == 0 else ELLIPSIS
+            postpend = "" if clips[-1][1] >= len(text) else ELLIPSIS
+            text = prepend + snippet + postpend
+
+    # Only the start of the text can be shown.  Each source line is also cut,
+    # but left long enough for the wrapper to see it needs truncating
+    wrapper = _wrapper(width, max_lines)
+    max_line_chars = (width + 1) * (max_lines + 1)
+    lines = []
+    pos = 0
+    while pos < len(text) and len(lines) <= max_lines:
+        newline = text.find("\n", pos, pos + max_line_chars + 1)
+        if newline == -1:
+            line = text[pos:pos + max_line_chars]
+            newline = text.find("\n", pos + max_line_chars)
+            pos = len(text) if newline == -1 else newline + 1
+        else:
+            line = text[pos:newline]
+            pos = newline + 1
+        lines += wrapper.wrap(line.removesuffix("\r"))
+    return lines[:max_lines]
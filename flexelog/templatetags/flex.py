@@ -4,9 +4,9 @@ from django import template
 from django.conf import settings
 from django.templatetags.static import static
 from django.urls import reverse
-from django.utils import formats
+from django.utils import dateformat, formats
 from django.utils.safestring import mark_safe
-from django.utils.html import conditional_escape, format_html
+from django.utils.html import conditional_escape
 from django.template.defaultfilters import stringfilter
 
 import re
@@ -14,6 +14,8 @@ import re
 from flexelog.elog_cfg import get_config
 from flexelog.editor.widgets_toastui import MarkdownViewerWidget
 from flexelog.models import Entry
+from flexelog.snippets import compile_pattern, summary_lines
+from flexelog.threads import thread_depth, thread_entries
 
 register = template.Library()
 
@@ -22,22 +24,35 @@ HIGHLIGHT_OPEN = '<span class="highlight">'
 HIGHLIGHT_CLOSE = "</span>"
 
 
-# XXX need to check that still escapes html properly
-#   Django help suggests `format_html` instead to help with that
+def highlight_html(text, regex, esc=conditional_escape):
+    """Return safe html of the escaped text, with highlighting around the regex's matches
+
+    One pass over the text, for any number of matches.  Matches are always escaped.
+    """
+    if regex is None:
+        return mark_safe(esc(text))
+    text = str(text)
+    parts = []
+    pos = 0
+    for match in regex.finditer(text):
+        start, end = match.span()
+        if start == end:
+            continue
+        parts.append(esc(text[pos:start]))
+        parts.append(f"{HIGHLIGHT_OPEN}{conditional_escape(match.group())}{HIGHLIGHT_CLOSE}")
+        pos = end
+    parts.append(esc(text[pos:]))
+    return mark_safe("".join(parts))
+
+
 @register.filter(needs_autoescape=True)
 @stringfilter
 def highlight(value, search_term, autoescape=True):
-    if autoescape:
-        esc = conditional_escape
-    else:
-        esc = lambda x: x
-    if search_term is None:
-        return mark_safe(esc(value))
-    return mark_safe(
-        esc(value).replace(
-            esc(search_term), f"{HIGHLIGHT_OPEN}{esc(search_term)}{HIGHLIGHT_CLOSE}"
-        )
-    )
+    """Highlight the (literal, case-sensitive) search term in the value"""
+    esc = conditional_escape if autoescape else lambda x: x
+    regex = compile_pattern(re.escape(search_term), case_sensitive=True) if search_term else None
+    return highlight_html(value, regex, esc)
+
 
 @register.filter
 def get_item(dictionary, key):
@@ -74,108 +89,6 @@ def list_replies(entry):
 
 
 
-def _nearest_break(text, index, break_tie_left=True):
-    if not text:
-        return 0
-
-    index = max(0, min(index, len(text)))
-
-    word_breaks = [m.start() for m in re.finditer(r"\b", text)]
-    
-    # Add start and end of text if not present
-    if 0 not in word_breaks:
-        word_breaks.insert(0, 0)
-    if len(text) not in word_breaks:
-        word_breaks.append(len(text))
-    
-    word_breaks = sorted(set(word_breaks)) # unique and sorted
-
-    if not word_breaks:
-        return index
-
-    nearest_break = -1
-    min_distance = len(text) + 1
-
-    for wb_i in word_breaks:
-        distance = abs(wb_i - index)
-        if distance < min_distance:
-            min_distance = distance
-            nearest_break = wb_i
-        elif distance == min_distance:
-            # If distances are equal, user tie-break flag
-            if break_tie_left:
-                if wb_i <= index:
-                    nearest_break = wb_i
-            elif wb_i >= index:
-                nearset_break = wb_i
-
-    return nearest_break
-
-
-def _text_summary_lines(text, width, max_lines, pattern):
-    BREAK_WITHIN = 12 # adjust clips to include a work break within this many characters
-    text_wrapper = textwrap.TextWrapper(width, max_lines=max_lines)
-
-    if not text:
-        return ""
-
-    # If problem with the search pattern, ignore it    
-    if pattern:
-        try:
-            regex = re.compile(rf"(?i)({pattern})")
-        except:
-            pattern = None
-
-    if len(text) < width * max_lines:
-        lines = []
-        for line in text.splitlines():
-            lines += text_wrapper.wrap(line)
-            if len(lines) > max_lines:
-                break
-        return lines[:max_lines]
-
-    if pattern:
-        breaks = re.compile(r"\W+")
-        start_end_match = [(m.start(), m.end(), m.group(0)) for m in regex.finditer(text)]
-        
-        max_pre = width // 2 
-        max_post = width // 3
-        clips = [
-            (max(0, start-max_pre), end+max_post)
-            for (start, end, _) in start_end_match
-        ]
-        word_break_clips = []
-        for start_near, end_near in clips:
-            piece_start = max(0, start_near-BREAK_WITHIN)
-            post_piece_start = max(0, end_near - BREAK_WITHIN)
-            break_start = _nearest_break(text[piece_start:start_near + BREAK_WITHIN], start_near-piece_start)
-            break_end = _nearest_break(text[post_piece_start:end_near + BREAK_WITHIN], end_near-post_piece_start, break_tie_left=False)
-            word_break_clips.append((break_start+piece_start, break_end+post_piece_start))
-
-        # Merge overlapping clips of text
-        merged = []
-        start, end = word_break_clips[0]
-        for start2, end2 in word_break_clips[1:]:
-            if start2 <= end:
-                end = max(end, end2)  # use max in case different processing later, e.g. word breaks
-            else:
-                merged.append((start, end))
-                start, end = start2, end2
-        # add last one
-        merged.append((start, end))
-        text = "...".join(text[start:end] for (start, end) in merged)
-        prepend = "" if merged[0][0] == 0 else "..."
-        postpend = "" if merged[-1][1] >= len(text) else "..."
-        text = prepend + text + postpend
-    
-    lines = []
-    for line in text.splitlines():
-        lines += text_wrapper.wrap(line)
-        if len(lines) > max_lines:
-            break
-    return lines[:max_lines]
-
-
 def highlight_text(text, pattern, case_sensitive=False, autoescape=True):
     """Place html highlighting around matched pattern in the string
     
@@ -186,126 +99,194 @@ def highlight_text(text, pattern, case_sensitive=False, autoescape=True):
     However, if a search pattern is used, then escapes all values to avoid any issues
     with the search string entered by the user, when used in Summary listing mode.
     """
-    esc = conditional_escape if autoescape else lambda x:x
     if not pattern:
         return text
-    
-    # Note is case-sensitive, so if need insensitive pattern should start with "(?i)"
-    case_sens = "" if case_sensitive else "(?i)"
-    pattern = rf"{case_sens}({pattern})"
+    esc = conditional_escape if autoescape else lambda x:x
+    return highlight_html(text, compile_pattern(pattern, case_sensitive), esc)
 
-    
-    parts = re.split(pattern, text)  # parentheses so match is output in list
-    return mark_safe(
-        "".join(
-            format_html(f"{HIGHLIGHT_OPEN}{{}}{HIGHLIGHT_CLOSE}", part) if re.match(pattern, part) else esc(part)
-            for part in parts
-        )
-    )
 
-@register.simple_tag
-def entry_listing(entry, columns, selected_id, filter_attrs, casesensitive, mode, cycle, index, autoescape=True):
-    text_fmt_summary = """<td class="summary{cycle}">{val}</td>"""
-    text_fmt_full = """<tr><td class="messagelist" colspan="{colspan}">{val}</td></tr>"""
-    non_text_fmt = {
-        "summary": '<td class="list{cycle}{h_sel}"{nowrap}>{href_open}{val}</a></td>',
-        "full": '<td class="list1full{h_sel}"{nowrap}>{href_open}{val}</a></td>',
-    }
-    attachment_fmt = """<td class="listatt{cycle}">{linked_icons}</td>"""
-    attachment_img_fmt = """<img border="0" align="absmiddle" src="{img_src_url}" alt="{attach_name}" title="{attach_name}" />"""
-
-    cfg = get_config()
-    htmls = [] 
-    detail_url = reverse("flexelog:entry_detail", args=[entry.lb.name, entry.id])
-    href_open = f'<a href="{detail_url}">'
-    h_sel = "h" if entry.id == selected_id else ""
+TEXT_SUMMARY_FMT = """<td class="summary{cycle}">{val}</td>"""
+TEXT_FULL_FMT = """<tr><td class="messagelist" colspan="{colspan}">{val}</td></tr>"""
+NON_TEXT_FMT = {
+    "summary": '<td class="list{cycle}{h_sel}"{nowrap}>{href_open}{val}</a></td>',
+    "full": '<td class="list1full{h_sel}"{nowrap}>{href_open}{val}</a></td>',
+}
+NON_TEXT_FMT["threaded"] = NON_TEXT_FMT["summary"]
+ATTACHMENT_FMT = """<td class="listatt{cycle}">{linked_icons}</td>"""
+ATTACHMENT_IMG_FMT = """<img border="0" align="absmiddle" src="{img_src_url}" alt="{attach_name}" title="{attach_name}" />"""
 
-    esc = conditional_escape if autoescape else lambda x: x
 
-    # For mode=full track text and attachments separately
-    mode_full_row1_tds = []
-    mode_full_row2 = ""
-    mode_full_row3 = ""
-    
-    if mode == "summary":
-        htmls.append("<tr>")
-    
-    for field in columns.values():
-        val = getattr(entry, field, None) or entry.attrs.get(field.removeprefix("attrs__")) or ""
-        if isinstance(val, list):
-            val = " | ".join(val)
-        is_text = (field == "text")
-        if field == "date":  # XX need to localize other date fields, XX need to use configd date format
-            val = str(formats.localize(val, use_l10n=True))
-        search_pattern = filter_attrs.get(field)
-
-        if is_text and mode == "summary":
-            # if entry.encoding == "HTML":
-            #     text = markdownify(self.text)
-            width = cfg.get(entry.lb, "summary line length", valtype=int, default="100")
-            max_lines = cfg.get(entry.lb, "summary lines", valtype=int, default="3")
-            lines =  _text_summary_lines(entry.text, width, max_lines, search_pattern)
-            if search_pattern:
-                val = "<br/>".join(highlight_text(line, search_pattern, casesensitive) for line in lines)
+def _field_getter(field):
+    """Return function giving an entry's display value for the listing db field"""
+    if field == "lb":  # listings over several logbooks
+        return lambda entry: entry.lb.name
+    if field.startswith("attrs__"):
+        attr_name = field.removeprefix("attrs__")
+        return lambda entry: entry.attrs.get(attr_name) or ""
+    return lambda entry: getattr(entry, field, None) or entry.attrs.get(field) or ""
+
+
+class EntryRowRenderer:
+    """Renders entry listing rows, for one page's columns, mode and filters
+
+    Everything that is the same for each row (formats, config values,
+    compiled highlight patterns, which kind of cell each column is)
+    is worked out once here, rather than for every row.
+    """
+    def __init__(self, columns, selected_id, filter_attrs, casesensitive, mode, autoescape=True):
+        self.mode = mode
+        self.selected_id = selected_id
+        self.casesensitive = casesensitive
+        self.colspan = len(columns) - 2
+        self.esc = conditional_escape if autoescape else lambda x: x
+        self.cfg = get_config()
+        self.attachment_img_url = static("flexelog/attachment.png")
+        self._lb_settings = {}  # lb name: (entry url prefix, summary width, summary lines)
+
+        self.cells = []  # functions for the row's cells (for "full" mode, the first row)
+        self.text_cell = None  # "full" mode's row with the text
+        # "threaded" mode has no text or attachments columns; replies are shown under each row
+        for field in columns.values():
+            search_pattern = filter_attrs.get(field)
+            if field == "text":
+                if mode == "summary":
+                    self.cells.append(self._text_summary_renderer(search_pattern))
+                elif mode == "full":
+                    self.text_cell = self._text_full_renderer(search_pattern)
+            elif field == "attachments":
+                if mode == "summary":
+                    self.cells.append(self._attachments_cell)
+                # XXX "full" mode needs fix to display attachments
             else:
-                val = "<br/>".join(esc(line) for line in lines)
-            htmls.append(text_fmt_summary.format(cycle=cycle, val=val))                    
-        elif is_text and mode == "full":
-            highlighted_lines = (highlight_text(line, search_pattern, casesensitive) for line in entry.text.splitlines())
-            widget = MarkdownViewerWidget(attrs={"id": f"viewer{index}"})
-            mode_full_row2 = text_fmt_full.format(
-                val = widget.render(name=f"viewer_name{index}", value="\n".join(highlighted_lines)),
-                colspan=len(columns) -2,
+                self.cells.append(self._attr_renderer(field, search_pattern))
+
+    def lb_settings(self, lb):
+        try:
+            return self._lb_settings[lb.name]
+        except KeyError:
+            # Entry urls are the logbook's url + id, see urls.py
+            lb_values = (
+                reverse("flexelog:logbook", args=[lb.name]),
+                self.cfg.get(lb, "summary line length", valtype=int, default="100"),
+                self.cfg.get(lb, "summary lines", valtype=int, default="3"),
             )
-            # mode_full_row2 = text_fmt_full.format(
-            #     val="<br/>".join(highlighted_lines),
-            #     colspan=len(columns)-1
-            # )
-            
-        elif field == "attachments":
-            if entry.attachments.count():
-                link_icons = []
-                for attachment in entry.attachments.all():
-                    attachment_img = attachment_img_fmt.format(
-                        img_src_url=static("flexelog/attachment.png"),
-                        attach_name=attachment.display_filename,
-                    )
-                    link_icons.append(
-                        f"""<a href="{attachment.attachment_file.url}" target="_blank">{attachment_img}</a>""".format(
-                            attachment=attachment, 
-                            attachment_img=attachment_img,
-                        )
-                    )
-                linked_icons = "&nbsp;".join(link_icons)
-            else:
-                linked_icons = "&nbsp;"                
-            if mode == "summary":
-                htmls.append(attachment_fmt.format(linked_icons=linked_icons, cycle=cycle))
-            elif mode == "full":
-                pass  # XXX needs fix to display attachements
-                # mode_full_row3 = attachment_fmt.format(linked_icons=linked_icons, cycle=cycle)  
-        else:
-            attr_td = non_text_fmt[mode].format(
-                cycle=cycle,
-                h_sel = h_sel,
-                nowrap=" nowrap" if field == "date" else "",
-                href_open=href_open,
-                val = highlight_text(val, search_pattern), 
+            self._lb_settings[lb.name] = lb_values
+            return lb_values
+
+    def _attr_renderer(self, field, search_pattern):
+        fmt = NON_TEXT_FMT[self.mode]
+        get_val = _field_getter(field)
+        nowrap = " nowrap" if field == "date" else ""
+        # As formats.localize for a datetime, with the format looked up once
+        datetime_format = formats.get_format("DATETIME_FORMAT", use_l10n=True)
+        regex = compile_pattern(search_pattern)
+        esc = self.esc
+
+        def render(entry, row):
+            val = get_val(entry)
+            if isinstance(val, list):
+                val = " | ".join(val)
+            if field == "date":  # XX need to localize other date fields, XX need to use configd date format
+                val = str(dateformat.format(val, datetime_format))
+            return fmt.format(
+                cycle=row.cycle,
+                h_sel=row.h_sel,
+                nowrap=nowrap,
+                href_open=row.href_open,
+                val=highlight_html(val, regex, esc),
+            )
+        return render
+
+    def _text_summary_renderer(self, search_pattern):
+        regex = compile_pattern(search_pattern, self.casesensitive)
+        snippet_regex = compile_pattern(search_pattern)
+        esc = self.esc
+
+        def render(entry, row):
+            _, width, max_lines = row.lb_settings
+            lines = summary_lines(entry.text, width, max_lines, snippet_regex)
+            val = "<br/>".join(highlight_html(line, regex, esc) for line in lines)
+            return TEXT_SUMMARY_FMT.format(cycle=row.cycle, val=val)
+        return render
+
+    def _text_full_renderer(self, search_pattern):
+        regex = compile_pattern(search_pattern, self.casesensitive)
+        esc = self.esc
+
+        def render(entry, row):
+            text = "\n".join(entry.text.splitlines())
+            if regex is not None:  # else left for the viewer widget to escape
+                text = highlight_html(text, regex, esc)
+            widget = MarkdownViewerWidget(attrs={"id": f"viewer{row.index}"})
+            return TEXT_FULL_FMT.format(
+                val=widget.render(name=f"viewer_name{row.index}", value=text),
+                colspan=self.colspan,
+            )
+        return render
+
+    def _attachments_cell(self, entry, row):
+        attachments = entry.attachments.all()  # prefetched for the page
+        if attachments:
+            linked_icons = "&nbsp;".join(
+                f'<a href="{attachment.attachment_file.url}" target="_blank">'
+                + ATTACHMENT_IMG_FMT.format(
+                    img_src_url=self.attachment_img_url,
+                    attach_name=attachment.display_filename,
+                )
+                + "</a>"
+                for attachment in attachments
             )
+        else:
+            linked_icons = "&nbsp;"
+        return ATTACHMENT_FMT.format(linked_icons=linked_icons, cycle=row.cycle)
+
+    def render(self, entry, cycle, index):
+        row = _Row(self.lb_settings(entry.lb), entry, self.selected_id, cycle, index)
+        tds = [cell(entry, row) for cell in self.cells]
+        if self.mode == "full":
+            text_row = self.text_cell(entry, row) if self.text_cell else ""
+            return mark_safe("\n".join(["<tr>" + "".join(tds) + "</tr>", text_row, ""]))
+        elif self.mode == "summary":
+            return mark_safe("\n".join(["<tr>", *tds, "</tr>"]))
+        elif self.mode == "threaded":
+            replies = getattr(entry, "thread_replies", ())  # see threads.attach_thread_replies
+            return mark_safe("\n".join(["<tr>", *tds, "</tr>", *(self._reply_line(reply, row) for reply in replies)]))
+        return mark_safe("")
+
+    def _reply_line(self, reply, row):
+        entry_summary = _entry_thread_summary(reply, self.esc)
+        if reply.id == self.selected_id:
+            entry_summary = "<b>" + entry_summary + "</b>"
+        return thread_listing_line_fmt.format(
+            colspan=len(self.cells),
+            indent=INDENT * thread_depth(reply.thread_path),
+            link=f"{row.lb_settings[0]}{reply.id}/",
+            indent_chr=THREAD_INDENT_CHARACTER,
+            entry_summary=entry_summary,
+        )
+
 
-            if mode == "summary":
-                htmls.append(attr_td)
-            elif mode == "full":
-                mode_full_row1_tds.append(attr_td)
+class _Row:
+    """The per-row values shared by the cells"""
+    __slots__ = ("lb_settings", "href_open", "h_sel", "cycle", "index")
 
-    if mode == "full":
-        htmls.append("<tr>" + "".join(mode_full_row1_tds) + "</tr>")
-        htmls.append(mode_full_row2)
-        htmls.append(mode_full_row3)
-    elif mode == "summary":
-        htmls.append("</tr>")
+    def __init__(self, lb_settings, entry, selected_id, cycle, index):
+        self.lb_settings = lb_settings
+        self.href_open = f'<a href="{lb_settings[0]}{entry.id}/">'
+        self.h_sel = "h" if entry.id == selected_id else ""
+        self.cycle = cycle
+        self.index = index
 
-    return mark_safe("\n".join(htmls))
+
+@register.simple_tag(takes_context=True)
+def entry_listing(context, entry, columns, selected_id, filter_attrs, casesensitive, mode, cycle, index, autoescape=True):
+    # One renderer for all the rows of the page, kept for the rest of the template's rendering
+    key = ("entry_listing", id(columns), id(filter_attrs), selected_id, casesensitive, mode, autoescape)
+    renderer = context.render_context.get(key)
+    if renderer is None:
+        renderer = EntryRowRenderer(columns, selected_id, filter_attrs, casesensitive, mode, autoescape)
+        context.render_context[key] = renderer
+    return renderer.render(entry, cycle, index)
 
 # THREAD_INDENT_CHARACTER = "↳"  # \u21b3, Downwards Arrow With Tip Rightwards
 # THREAD_INDENT_CHARACTER = '⇨'  # ⇒
@@ -319,11 +300,16 @@ thread_line_fmt = (
     '{indent_chr}&nbsp;{entry_summary}'
     '</a></td></tr>'
 )
+thread_listing_line_fmt = (  # replies under each thread start in "threaded" listing mode
+    '<tr><td align="left" class="threadreply" colspan="{colspan}">'
+    '{indent}<a href="{link}">'
+    '{indent_chr}&nbsp;{entry_summary}'
+    '</a></td></tr>'
+)
 
 
 def _entry_thread_summary(entry, esc):
     """Return a brief summary of the entry: date, attr vals, some of text"""
-    cfg = get_config()    
     parts = [f"&nbsp;{entry.date}&nbsp;"]
     if entry.attrs:
         parts.append("; ".join(esc(attr_show(val)) for val in entry.attrs.values()))
@@ -332,22 +318,25 @@ def _entry_thread_summary(entry, esc):
     return textwrap.shorten("  ".join(parts), MAX_SUMMMARY_WIDTH)
 
 
-def _thread_tree(entry, indent_level, selected_id, esc) -> list[str]:
-    """Return html lines for an entry and descendants.  Used recursively"""
-    lines = []
-    # Render self first
+def _thread_line(entry, indent_level, selected_id, esc, link) -> str:
     entry_summary = _entry_thread_summary(entry, esc)
     if entry.id == selected_id:
         entry_summary = "<b>" + entry_summary + "</b>"
-    
-    lines.append(
-        thread_line_fmt.format(
-            indent = INDENT * indent_level,
-            link = reverse("flexelog:entry_detail", args=[entry.lb.name, entry.id]),
-            indent_chr = THREAD_INDENT_CHARACTER,
-            entry_summary=entry_summary,
-        )
+    return thread_line_fmt.format(
+        indent = INDENT * indent_level,
+        link = link,
+        indent_chr = THREAD_INDENT_CHARACTER,
+        entry_summary=entry_summary,
     )
+
+
+def _thread_tree(entry, indent_level, selected_id, esc) -> list[str]:
+    """Return html lines for an entry and descendants.  Used recursively
+
+    Only for entries without thread paths filled in (see `thread_paths` command)
+    """
+    link = reverse("flexelog:entry_detail", args=[entry.lb.name, entry.id])
+    lines = [_thread_line(entry, indent_level, selected_id, esc, link)]
     for reply in entry.replies.all():
         lines.extend(_thread_tree(reply, indent_level + 1, selected_id, esc))
     
@@ -357,7 +346,15 @@ def _thread_tree(entry, indent_level, selected_id, esc) -> list[str]:
 @register.simple_tag
 def thread_tree(entry: Entry, autoescape=True):
     # <a href="../Biz/227">
-    root = entry.reply_ancestor()
     esc = conditional_escape if autoescape else lambda x:x
-    lines = _thread_tree(root, 0, entry.id, esc)
-    return mark_safe("\n".join(lines))
\ No newline at end of file
+    if not entry.thread_path:
+        lines = _thread_tree(entry.reply_ancestor(), 0, entry.id, esc)
+        return mark_safe("\n".join(lines))
+
+    # Whole thread in one query, already in tree order
+    lb_url = reverse("flexelog:logbook", args=[entry.lb.name])  # entry urls are this + id
+    lines = [
+        _thread_line(thread_entry, thread_depth(thread_entry.thread_path), entry.id, esc, f"{lb_url}{thread_entry.id}/")
+        for thread_entry in thread_entries(entry)
+    ]
+    return mark_safe("\n".join(lines))
@@ -1,6 +1,9 @@
+from django.core.cache import cache
 from django.test import TestCase
-from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.models import AnonymousUser, Group
+from guardian.shortcuts import assign_perm
 from flexelog.models import User, Logbook
+from flexelog.permissions import logbook_perms
 from flexelog.views import available_logbooks
 
 
@@ -11,6 +14,10 @@ class MockRequest:
 class TestPermissions(TestCase):
     """Check that permissions are respected"""
     fixtures = ["test_stargate", "test_auth_stargate"]
+
+    def setUp(self):
+        cache.clear()  # cached permissions are not rolled back with the test database
+
     def test_available_logbooks_authd(self):
         """Auth'd user only gets offered logbooks they have view permission for"""
         req = MockRequest()
@@ -28,3 +35,54 @@ class TestPermissions(TestCase):
         logbooks = available_logbooks(req)
         self.assertTrue(empty_lb in logbooks)
         self.assertTrue(aliens_only not in logbooks)
+
+
+class TestAvailableLogbooksQueries(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_available_logbooks_queries(self):
+        """Permissions for any number of logbooks take the same queries, cached for later requests"""
+        user = User.objects.create_user(username="teal'c")
+        group = Group.objects.create(name="More logbooks")
+        user.groups.add(group)
+        # bulk_create, as default logbook groups are made by signal
+        logbooks = Logbook.objects.bulk_create(Logbook(name=f"Log {i}", order=i) for i in range(10))
+        logbooks.append(Logbook.objects.create(name="Open", order=10, auth_required=False))
+        expected = []
+        for i, lb in enumerate(logbooks):
+            if i % 3 == 1:
+                assign_perm("view_entries", group, lb)
+            elif i % 3 == 2:
+                assign_perm("view_entries", user, lb)
+            if i % 3 or not lb.auth_required:
+                expected.append(lb)
+
+        req = MockRequest()
+        req.user = user
+        with self.assertNumQueries(3):  # logbooks, user's and group's permissions
+            self.assertEqual(expected, available_logbooks(req))
+        with self.assertNumQueries(0):
+            self.assertEqual(expected, available_logbooks(req))
+        self.assertEqual(expected, [lb for lb in logbooks if not lb.auth_required or user.has_perm("view_entries", lb)])
+
+        req = MockRequest()  # a later request
+        req.user = user
+        with self.assertNumQueries(1):
+            self.assertEqual(expected, available_logbooks(req))
+
+        # Changes to permissions or groups are seen
+        assign_perm("view_entries", user, logbooks[0])
+        user.groups.remove(group)
+        req = MockRequest()
+        req.user = user
+        expected = [lb for lb in logbooks if not lb.auth_required or user.has_perm("view_entries", lb)]
+        self.assertEqual(logbooks[0], expected[0])
+        self.assertEqual(expected, available_logbooks(req))
+
+        user.is_superuser = True
+        user.save()
+        req = MockRequest()
+        req.user = user
+        self.assertEqual(logbooks, available_logbooks(req))
+        self.assertIn("configure_logbook", logbook_perms(user, logbooks[0]))
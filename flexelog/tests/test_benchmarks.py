@@ -0,0 +1,244 @@
+"""Performance benchmarks, skipped unless FLEXELOG_BENCHMARK is set in the environment
+
+Run with e.g.:
+    FLEXELOG_BENCHMARK=1 python manage.py test flexelog.tests.test_benchmarks
+
+FLEXELOG_BENCHMARK_ENTRIES sets the number of entries in the large logbook (default 250000)
+"""
+from datetime import datetime, timedelta
+import os
+from pathlib import Path
+import pickle
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from unittest import skipUnless
+
+from django.db import connection
+from django.db.models import F
+from django.template import Context, Template
+from django.test import TestCase
+from django.utils import timezone
+
+from flexelog.elog_cfg import LogbookConfig, config_cache_path, get_config, reload_config
+from flexelog.models import ElogConfig, Logbook, Entry
+from flexelog.pagination import KeysetPaginator, SORT_KEY
+from flexelog.listing import attr_index, sort_expression
+from flexelog.snippets import compile_pattern, summary_lines
+from flexelog.templatetags.flex import EntryRowRenderer
+
+RUN_BENCHMARKS = bool(os.environ.get("FLEXELOG_BENCHMARK"))
+BENCH_ENTRIES = int(os.environ.get("FLEXELOG_BENCHMARK_ENTRIES", 250_000))
+POSITION_TARGET_SECONDS = 0.1
+# Counting through an attribute's expression index, with its longer keys
+ATTR_POSITION_TARGET_SECONDS = 0.3
+CONFIG_GET_CALLS = 100_000
+CONFIG_SECTIONS = 150
+LISTING_ROWS = 500
+LARGE_ENTRY_TARGET_SECONDS = 0.01
+
+
+def best_time(func, repeat=5):
+    """Return the best wall time in seconds of `repeat` calls to func"""
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+@skipUnless(RUN_BENCHMARKS, "Set FLEXELOG_BENCHMARK=1 to run benchmarks")
+class BenchLargeLogbook(TestCase):
+    """Listing operations on a logbook with a large number of entries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.lb = Logbook.objects.create(name="Big", auth_required=False)
+        start = timezone.make_aware(datetime(2020, 1, 1))
+        categories = ["Hardware", "Software", "Meetings", "General", "Other"]
+        batch = []
+        for i in range(1, BENCH_ENTRIES + 1):
+            batch.append(
+                Entry(
+                    lb=cls.lb,
+                    id=i,
+                    date=start + timedelta(minutes=7 * i),
+                    attrs={
+                        "Subject": f"Subject {i % 1013}",
+                        "Category": [categories[i % 5], categories[i % 3]],
+                    },
+                    text=f"Entry number {i}",
+                )
+            )
+            if len(batch) >= 5000:
+                Entry.objects.bulk_create(batch)
+                batch = []
+        Entry.objects.bulk_create(batch)
+
+        # As made by the attr_indexes command, which can't run inside the test's transaction on SQLite
+        schema_editor = connection.schema_editor()
+        with connection.cursor() as cursor:
+            for attr_name in ("Subject", "Category"):
+                cursor.execute(str(attr_index(cls.lb.id, attr_name).create_sql(Entry, schema_editor)))
+            cursor.execute("ANALYZE")
+
+    def paginator(self, sort_attr_field, is_rsort=True):
+        queryset = (
+            self.lb.entries
+            .annotate(**{SORT_KEY: sort_expression(sort_attr_field)})
+            .order_by(F(SORT_KEY).desc() if is_rsort else F(SORT_KEY).asc(), "-id")
+        )
+        return KeysetPaginator(queryset, per_page=20, sort_field=sort_attr_field, sort_desc=is_rsort, id_desc=True)
+
+    def test_bench_selected_id_position(self):
+        """Find the page for ?id= in the middle of the logbook, for each kind of sort column"""
+        selected_id = BENCH_ENTRIES // 2
+        for sort_attr_field in ("date", "id", "attrs__Subject", "attrs__Category"):
+            paginator = self.paginator(sort_attr_field)
+            self.assertIsNotNone(paginator.position(selected_id))
+            seconds = best_time(lambda: paginator.position(selected_id))
+            print(f"\n?id= position, sort by {sort_attr_field}, {BENCH_ENTRIES} entries: {seconds * 1000:.1f} ms")
+            if sort_attr_field in ("date", "id"):
+                self.assertLess(seconds, POSITION_TARGET_SECONDS)
+            else:
+                self.assertLess(seconds, ATTR_POSITION_TARGET_SECONDS)
+
+
+
+@skipUnless(RUN_BENCHMARKS, "Set FLEXELOG_BENCHMARK=1 to run benchmarks")
+class BenchConfigGet(TestCase):
+    """LogbookConfig.get, called for each listing row, and many times per page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ElogConfig.objects.create(name="global", config_text="Summary lines = 3\nReverse sort = 1\n")
+        cls.lb = Logbook.objects.create(
+            name="Configured",
+            config="Attributes = Author, Type, Category, Subject\n"
+            "Options Category = Hardware, Software, \"Meetings, General\", Other\n",
+            auth_required=False,
+        )
+
+    def test_bench_get(self):
+        reload_config()
+        cfg = get_config()
+        lookups = [
+            dict(param="Summary lines", valtype=int),
+            dict(param="Reverse sort", valtype=bool),
+            dict(param="Options Category", as_list=True),
+            dict(param="List display", as_list=True),
+        ]
+        for kwargs in lookups:
+            self.assertEqual(cfg._lookup(self.lb.name, **kwargs), cfg.get(self.lb, **kwargs))
+
+        for name, get in (("unmemoized", cfg._lookup), ("memoized", cfg.get)):
+            def calls():
+                for _ in range(CONFIG_GET_CALLS // len(lookups)):
+                    for kwargs in lookups:
+                        get(self.lb.name, **kwargs)
+            seconds = best_time(calls, repeat=3)
+            print(f"\nLogbookConfig.get, {name}: {seconds / CONFIG_GET_CALLS * 1e6:.2f} us per call")
+            if name == "unmemoized":
+                unmemoized_seconds = seconds
+        self.assertLess(seconds, unmemoized_seconds / 2)
+
+    def test_bench_config_cache_file(self):
+        """Load a large parsed config from its cache file, rather than parse it"""
+        sections = "".join(
+            f"\n[Logbook {i}]\n"
+            f"Attributes = Author, Type, Category, Subject, Where{i}\n"
+            f"Options Type = Routine, Other{{{i}}}\n"
+            f"{{{i}}} Options Where{i} = Here, There\n"
+            "Required Attributes = Author, Subject\n"
+            for i in range(CONFIG_SECTIONS)
+        )
+        config_text = "[global]\nReverse sort = 1\n" + sections
+        with TemporaryDirectory() as cache_dir:
+            path = config_cache_path(config_text, cache_dir)
+
+            def parse():
+                LogbookConfig(config_text).parse_all()
+            parse_seconds = best_time(parse, repeat=3)
+
+            cfg = LogbookConfig(config_text)
+            cfg.parse_all()
+            Path(path).write_bytes(pickle.dumps(cfg))
+            load_seconds = best_time(lambda: pickle.loads(Path(path).read_bytes()), repeat=3)
+        print(
+            f"\nConfig of {CONFIG_SECTIONS} logbooks: parse {parse_seconds * 1000:.1f} ms, "
+            f"load from cache file {load_seconds * 1000:.1f} ms"
+        )
+        self.assertLess(load_seconds, parse_seconds / 2)
+
+
+@skipUnless(RUN_BENCHMARKS, "Set FLEXELOG_BENCHMARK=1 to run benchmarks")
+class BenchListingRows(TestCase):
+    """Rendering a page of entry_listing rows in summary mode"""
+
+    @classmethod
+    def setUpTestData(cls):
+        ElogConfig.objects.create(name="global", config_text="")
+        cls.lb = Logbook.objects.create(
+            name="Rows", config="Attributes = Author, Type, Subject\n", auth_required=False
+        )
+        start = timezone.make_aware(datetime(2020, 1, 1))
+        Entry.objects.bulk_create(
+            Entry(
+                lb=cls.lb,
+                id=i,
+                date=start + timedelta(minutes=7 * i),
+                attrs={"Author": "Someone", "Type": ["Routine", "Other"], "Subject": f"Pump check {i}"},
+                text=f"Pump {i} checked, pressure normal.\n" * 10,
+            )
+            for i in range(1, LISTING_ROWS + 1)
+        )
+
+    def test_bench_summary_page(self):
+        reload_config()
+        entries = list(self.lb.entries.prefetch_related("attachments").order_by("-id"))
+        columns = {
+            "ID": "id", "Date": "date", "Author": "attrs__Author", "Type": "attrs__Type",
+            "Subject": "attrs__Subject", "Text": "text", "Attachments": "attachments",
+        }
+        filter_attrs = {"attrs__Subject": "pump"}
+        template = Template(
+            "{% load flex %}{% for entry in entries %}{% cycle '2' '1' as listX silent %}"
+            "{% entry_listing entry columns None filter_attrs False 'summary' listX forloop.counter %}"
+            "{% endfor %}"
+        )
+        context = Context(dict(entries=entries, columns=columns, filter_attrs=filter_attrs))
+        page_seconds = best_time(lambda: template.render(context), repeat=3)
+
+        def renderer_per_row():  # i.e. all the per-page work repeated for every row
+            for i, entry in enumerate(entries, 1):
+                EntryRowRenderer(columns, None, filter_attrs, False, "summary").render(entry, "1", i)
+        per_row_seconds = best_time(renderer_per_row, repeat=3)
+        print(
+            f"\nSummary listing, {LISTING_ROWS} rows: {LISTING_ROWS / page_seconds:,.0f} rows/sec "
+            f"({page_seconds * 1000:.1f} ms); set up per row {LISTING_ROWS / per_row_seconds:,.0f} rows/sec"
+        )
+        self.assertLess(page_seconds, per_row_seconds)
+
+
+@skipUnless(RUN_BENCHMARKS, "Set FLEXELOG_BENCHMARK=1 to run benchmarks")
+class BenchTextSnippets(TestCase):
+    """Summary mode text snippets around search matches, for entries of real-world sizes"""
+
+    def test_bench_snippets(self):
+        paragraph = (
+            "Turbo pump on the beamline tripped overnight; restarted at 08:10 and the "
+            "pressure recovered to 2e-7 mbar within the hour.  Checked the interlock log, "
+            "no other faults.  Will keep an eye on the pump temperature.\n"
+        )
+        log_line = "2025-03-14 02:17:45,123 INFO  vacuum.gauge3  pressure=3.2e-07 mbar status=OK\n"
+        corpus = {  # name: (text, number of entries)
+            "note, 1 kB": (paragraph * 5, 500),
+            "report, 50 kB": (paragraph * 250, 100),
+            "pasted log, 2 MB": (log_line * 25_000, 5),
+        }
+        regex = compile_pattern("pressure")
+        for name, (text, count) in corpus.items():
+            seconds = best_time(lambda: [summary_lines(text, 100, 3, regex) for _ in range(count)], repeat=3)
+            per_entry = seconds / count
+            print(f"\nSnippets, {name}: {1 / per_entry:,.0f} entries/sec ({per_entry * 1e6:.0f} us per entry)")
+            self.assertLess(per_entry, LARGE_ENTRY_TARGET_SECONDS)
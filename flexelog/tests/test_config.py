@@ -1,8 +1,21 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
 from django.test import TestCase
 from textwrap import dedent
+from threading import Barrier
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
 
 from flexelog.models import Logbook, Entry, ValidationError, User
-from flexelog.elog_cfg import LogbookConfig, get_config
+from flexelog import elog_cfg
+from flexelog.elog_cfg import (
+    CONFIG_STAMP_KEY, LogbookConfig, config_cache_path, db_config_text, get_config, reload_config
+)
 from flexelog import subst
 
 class _MockEntry:
@@ -83,9 +96,224 @@ class TestConditionalConfig(TestCase):
             where2 = self.cfg.get("Travel", "MOptions Where2", as_list=True)
             assert where2 == "FL NY Other".split()            
 
+    def test_conditional_attributes_cached(self):
+        """Each set of conditions parses a logbook's Attributes once"""
+        cfg = LogbookConfig(self.config_text + "{eu} Attributes = Where, Where2, Who, Subject\n")
+        travel_attrs = cfg.lb_attrs["Travel"]
+        self.assertIn("Who", travel_attrs)
+        with cfg:
+            cfg.set_conditions_from_attrs("Travel", {"Where": "Europe"})
+            eu_attrs = cfg.lb_attrs["Travel"]
+            self.assertEqual(["Where", "Where2", "Who", "Subject"], list(eu_attrs))
+            self.assertEqual("Germany", eu_attrs["Where2"].options[0])
+        self.assertIs(travel_attrs, cfg.lb_attrs["Travel"])
+        with cfg:
+            cfg.add_condition("eu")
+            self.assertIs(eu_attrs, cfg.lb_attrs["Travel"])
+        self.assertEqual(["Travel"], list(cfg.lb_attrs))
+        self.assertNotIn("Other", cfg.lb_attrs)
+
+    def test_conditions_per_thread(self):
+        """Threads sharing the config each have their own conditions"""
+        barrier = Barrier(2)
+
+        def where2(condition):
+            with self.cfg:
+                self.cfg.add_condition(condition)
+                barrier.wait()  # both conditions set before either looks up
+                return self.cfg.get("Travel", "MOptions Where2", as_list=True)[0]
+
+        with ThreadPoolExecutor(2) as executor:
+            self.assertEqual(["Germany", "FL"], list(executor.map(where2, ["eu", "us"])))
+        self.assertEqual((), self.cfg.conditions)
+
+    def test_memoized_get(self):
+        """Memoized values follow the conditions, and returned lists are the caller's own"""
+        who = self.cfg.get("Travel", "MOptions Who", as_list=True)
+        who.append("Eve")
+        assert self.cfg.get("Travel", "MOptions Who", as_list=True) == ["Alice", "Bob", "Christine", "Dave"]
+        assert self.cfg.get("Travel", "MOptions Where2", as_list=True) == []
+        with self.cfg:
+            self.cfg.add_condition("oth")
+            assert self.cfg.get("Travel", "MOptions Where2", as_list=True) == ["Somewhere"]
+        assert self.cfg.get("Travel", "MOptions Where2", as_list=True) == []
+        assert self.cfg.get("Travel", "Reverse sort", valtype=bool) is True
+
+class TestSectionUpdates(TestCase):
+    """Changing one section's text re-parses only what depends on it"""
+    global_text = "[global]\nAttributes = Subject, Category\nOptions Category = A, B\n"
+    sections = {
+        "Own": "Attributes = Subject\nOptions Category = E\n",
+        "Inherits": "Reverse sort = 1\n",
+        "Sets Options": "Options Category = C\n",
+    }
+
+    def make_config(self, global_text, sections):
+        return LogbookConfig(global_text + "".join(f"[{name}]\n{text}" for name, text in sections.items()))
+
+    def assertSameConfig(self, expected, cfg):
+        self.assertEqual(list(expected.lb_attrs), list(cfg.lb_attrs))
+        for lb_name in expected.lb_attrs:
+            self.assertEqual(expected.lb_attrs[lb_name], cfg.lb_attrs[lb_name])
+            for param in ("Attributes", "Options Category", "Reverse sort"):
+                self.assertEqual(expected.get(lb_name, param), cfg.get(lb_name, param))
+
+    def test_logbook_section(self):
+        cfg = self.make_config(self.global_text, self.sections)
+        own_attrs = cfg.lb_attrs["Own"]
+        new_cfg = cfg.with_section("Inherits", "Attributes = Where\n")
+        self.assertSameConfig(
+            self.make_config(self.global_text, self.sections | {"Inherits": "Attributes = Where\n"}), new_cfg
+        )
+        self.assertIs(own_attrs, new_cfg.lb_attrs["Own"])
+        self.assertNotEqual(cfg.version, new_cfg.version)
+        self.assertEqual(["Subject", "Category"], list(cfg.lb_attrs["Inherits"]))  # original unchanged
+
+        self.assertEqual(["Own", "Sets Options"], list(new_cfg.with_section("Inherits", None).lb_attrs))
+        self.assertIn("New", new_cfg.with_section("New", "").lb_attrs)
+
+    def test_global_section(self):
+        cfg = self.make_config(self.global_text, self.sections)
+        old_attrs = {lb_name: cfg.lb_attrs[lb_name] for lb_name in self.sections}
+        new_global = "Attributes = Subject, Category\nOptions Category = A, B, D\n"
+        new_cfg = cfg.with_section("global", new_global)
+        self.assertSameConfig(self.make_config("[global]\n" + new_global, self.sections), new_cfg)
+        # Only the logbook inheriting the changed `Options Category` is parsed again
+        self.assertIsNot(old_attrs["Inherits"], new_cfg.lb_attrs["Inherits"])
+        self.assertIs(old_attrs["Own"], new_cfg.lb_attrs["Own"])
+        self.assertIsNot(old_attrs["Inherits"], cfg.with_section("global", "").lb_attrs["Inherits"])
+        self.assertIs(old_attrs["Sets Options"], new_cfg.lb_attrs["Sets Options"])
+
+    def test_logbook_save(self):
+        lb = Logbook.objects.create(name="Saved", config="Attributes = Subject\n", auth_required=False)
+        other = Logbook.objects.create(name="Other", config="Attributes = Who\n", auth_required=False)
+        other_attrs = get_config().lb_attrs["Other"]
+        lb.config = "Attributes = Subject, Where\n"
+        lb.save()
+        self.assertEqual(["Subject", "Where"], list(get_config().lb_attrs["Saved"]))
+        self.assertIs(other_attrs, get_config().lb_attrs["Other"])
+
+        lb.name = "Renamed"
+        lb.save()
+        self.assertEqual(["Other", "Renamed"], sorted(get_config().lb_attrs))
+        lb.active = False
+        lb.save()
+        self.assertEqual(["Other"], list(get_config().lb_attrs))
+
+
+class TestConfigCacheFile(TestCase):
+    """Parsed config saved on disk for new server processes"""
+    def setUp(self):
+        temp_dir = TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.cache_dir = Path(temp_dir.name)
+        patcher = mock.patch.object(elog_cfg, "CONFIG_CACHE_DIR", self.cache_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lb = Logbook.objects.create(
+            name="Cached", config=TestConditionalConfig.config_text.split("\n", 1)[1], auth_required=False
+        )
+
+    def cache_files(self):
+        return sorted(path.name for path in self.cache_dir.glob("*.pickle"))
+
+    def test_command_and_load(self):
+        out = StringIO()
+        call_command("config_cache", stdout=out)
+        path = config_cache_path(db_config_text())
+        self.assertIn(f"Saved parsed config to {path}", out.getvalue())
+        self.assertEqual([path.name], self.cache_files())
+
+        reload_config()
+        cfg = get_config()
+        self.assertIsNone(cfg._config_text)  # loaded, not parsed
+        parsed = LogbookConfig(db_config_text())
+        self.assertEqual(parsed.lb_attrs["Cached"], cfg.lb_attrs["Cached"])
+        self.assertEqual(parsed.get("Cached", "Reverse sort", valtype=bool), cfg.get("Cached", "Reverse sort", valtype=bool))
+        with cfg:
+            cfg.add_condition("eu")
+            self.assertEqual("Germany", cfg.lb_attrs["Cached"]["Where2"].options[0])
+
+        call_command("config_cache", "--clear", stdout=out)
+        self.assertEqual([], self.cache_files())
+
+    def test_saved_when_parsed(self):
+        reload_config()
+        path = config_cache_path(db_config_text())
+        self.assertEqual([path.name], self.cache_files())
+
+        # Changed config gets a new file, replacing the old
+        Logbook.objects.filter(pk=self.lb.pk).update(config="Attributes = Subject\n")
+        reload_config()
+        new_path = config_cache_path(db_config_text())
+        self.assertEqual([new_path.name], self.cache_files())
+
+        new_path.write_bytes(b"not a pickle")
+        with self.assertLogs("flexelog", "WARNING"):
+            reload_config()
+        self.assertEqual(["Subject"], list(get_config().lb_attrs["Cached"]))
+
+
+class TestConfigStamp(TestCase):
+    """Config changes made in other server processes are picked up"""
+    def setUp(self):
+        cache.clear()
+        self.lb = Logbook.objects.create(name="Stamped", config="Attributes = Subject\n", auth_required=False)
+        self.other = Logbook.objects.create(name="Other", config="Attributes = Subject\n", auth_required=False)
+        reload_config()
+
+    def save_elsewhere(self, config):
+        """Change the other logbook as another process would: no signal here, only its stamp bump"""
+        Logbook.objects.filter(pk=self.other.pk).update(config=config)
+        if not cache.add(CONFIG_STAMP_KEY, time.time_ns(), None):
+            cache.incr(CONFIG_STAMP_KEY)
+
+    def test_save_bumps_stamp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lb.config = "Attributes = Subject, Where\n"
+            self.lb.save()
+        cfg = get_config()
+        self.assertEqual(["Subject", "Where"], list(cfg.lb_attrs["Stamped"]))
+        self.assertIsNotNone(cache.get(CONFIG_STAMP_KEY))
+        with mock.patch.object(elog_cfg, "CONFIG_CHECK_SECONDS", 0):
+            self.assertIs(cfg, get_config())  # no reload for this process's own change
+
+    def test_reload_when_changed_elsewhere(self):
+        cfg = get_config()
+        # As if saved by another process: no signal here, only the new stamp
+        Logbook.objects.filter(pk=self.lb.pk).update(config="Attributes = Subject, Who\n")
+        cache.set(CONFIG_STAMP_KEY, time.time_ns())
+        self.assertIs(cfg, get_config())  # not checked again yet
+        with mock.patch.object(elog_cfg, "CONFIG_CHECK_SECONDS", 0):
+            new_cfg = get_config()
+            self.assertEqual(["Subject", "Who"], list(new_cfg.lb_attrs["Stamped"]))
+            self.assertIs(new_cfg, get_config())
+
+    def test_changed_elsewhere_while_saving(self):
+        """Another process's change between this one's saves, or before its commit, isn't lost"""
+        for attr in ("Where", "When"):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.lb.config = f"Attributes = Subject, {attr}\n"
+                self.lb.save()
+                self.save_elsewhere(f"Attributes = Who, {attr}\n")
+            cfg = get_config()
+            self.assertEqual(["Subject", attr], list(cfg.lb_attrs["Stamped"]))
+            self.assertEqual(["Who", attr], list(cfg.lb_attrs["Other"]))
+        with mock.patch.object(elog_cfg, "CONFIG_CHECK_SECONDS", 0):
+            self.assertIs(cfg, get_config())  # stamp is up to date
+
+    def test_section_update_after_change_elsewhere(self):
+        """A logbook's config is updated on the latest config, not one missing another process's change"""
+        self.save_elsewhere("Attributes = Who\n")
+        self.lb.config = "Attributes = Subject, Where\n"
+        self.lb.save()  # (not yet committed, nor checked for the stamp since loaded)
+        cfg = get_config()
+        self.assertEqual(["Subject", "Where"], list(cfg.lb_attrs["Stamped"]))
+        self.assertEqual(["Who"], list(cfg.lb_attrs["Other"]))
+
+
 # XXX TO DO:
 # * logbook name "urlsafe" - spaces, etc.
-# * check index page when latest_date has no entries 
 
 class TestSubstitutions(TestCase):
     def setUp(self):
@@ -0,0 +1,275 @@
+from io import StringIO
+from textwrap import dedent
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from flexelog import fulltext
+from flexelog.attr_indexes import existing_indexes
+from flexelog.elog_cfg import get_config, reload_config
+from flexelog.listing import attr_index_name, compile_filter, listing_plan, sort_expression
+from flexelog.models import ElogConfig, Entry, Logbook
+from flexelog.pagination import SORT_KEY
+
+
+log_config = dedent(
+    """\
+    Attributes = Subject, Count
+    Type Count = numeric
+    """
+)
+
+
+class TestSortExpressions(TestCase):
+    def setUp(self):
+        ElogConfig.objects.create(name="global", config_text="")
+        self.lb = Logbook.objects.create(name="Sorts", config=log_config, auth_required=False)
+        for i, attrs in enumerate([{"Subject": "b", "Count": "10"}, {"Subject": "A", "Count": "9"}, {}], 1):
+            Entry.objects.create(lb=self.lb, id=i, date=timezone.now(), attrs=attrs)
+
+    def sorted_ids(self, field, val_type=""):
+        return list(
+            self.lb.entries.annotate(**{SORT_KEY: sort_expression(field, val_type)})
+            .order_by(SORT_KEY, "id")
+            .values_list("id", flat=True)
+        )
+
+    def test_text_sort_case_insensitive_missing_first(self):
+        self.assertEqual([3, 2, 1], self.sorted_ids("attrs__Subject"))
+
+    def test_numeric_sort(self):
+        self.assertEqual([3, 1, 2], self.sorted_ids("attrs__Count"))  # as text
+        self.assertEqual([3, 2, 1], self.sorted_ids("attrs__Count", "numeric"))
+        # Not numbers: no error from the database, and sorted before numbers
+        Entry.objects.create(lb=self.lb, id=4, date=timezone.now(), attrs={"Count": "n/a"})
+        Entry.objects.create(lb=self.lb, id=5, date=timezone.now(), attrs={"Count": " 2.5e0"})
+        self.assertEqual([3, 4, 5, 2, 1], self.sorted_ids("attrs__Count", "numeric"))
+
+    def test_attr_name_is_sql_literal(self):
+        """Attribute name is in the SQL itself (to match indexes), safely quoted"""
+        Entry.objects.create(lb=self.lb, id=4, date=timezone.now(), attrs={"it's 100%": "x"})
+        queryset = self.lb.entries.annotate(**{SORT_KEY: sort_expression("attrs__it's 100%")})
+        self.assertEqual(["", "", "", "x"], sorted(queryset.values_list(SORT_KEY, flat=True)))
+        sql, params = queryset.query.sql_with_params()
+        self.assertIn("it''s 100%", sql % tuple("?" * len(params)))
+
+
+class TestListingPlan(TestCase):
+    def setUp(self):
+        ElogConfig.objects.create(name="global", config_text="")
+        self.lb = Logbook.objects.create(
+            name="Planned", config=log_config + "List display = ID, Date, count\n", auth_required=False
+        )
+        reload_config()
+
+    def test_plan(self):
+        plan = listing_plan(self.lb)
+        self.assertEqual({"ID": "id", "Date": "date", "count": "attrs__count"}, plan.columns)
+        self.assertEqual({"date": "date", "count": "attrs__count", "subtext": "text"}, plan.filterable)
+        self.assertEqual("numeric", plan.val_type("attrs__count"))
+        self.assertEqual("", plan.val_type("date"))
+        self.assertEqual("date", plan.default_sort_field)
+
+    def test_plan_reused_until_config_changes(self):
+        plan = listing_plan(self.lb)
+        self.assertIs(plan, listing_plan(self.lb, get_config()))
+        self.lb.config = log_config + "List display = ID, Subject\n"
+        self.lb.save()  # reloads the config
+        new_plan = listing_plan(self.lb)
+        self.assertIsNot(plan, new_plan)
+        self.assertEqual({"ID": "id", "Subject": "attrs__Subject"}, new_plan.columns)
+        self.assertEqual("id", new_plan.default_sort_field)
+
+
+class TestFilters(TestCase):
+    def setUp(self):
+        cache.clear()  # cached counts are not rolled back with the test database
+        self.lb = Logbook.objects.create(name="Filters", config=log_config, auth_required=False)
+        subjects = ["Power supply", "power cable", "Replaced supply", "a.b", "Größe"]
+        for i, subject in enumerate(subjects, 1):
+            Entry.objects.create(lb=self.lb, id=i, date=timezone.now(), attrs={"Subject": subject}, text=subject)
+
+    def matching_ids(self, pattern, case_sensitive=False, field="attrs__Subject"):
+        queryset = self.lb.entries.filter(compile_filter(field, pattern, case_sensitive)).order_by("id")
+        return list(queryset.values_list("id", flat=True)), str(queryset.query)
+
+    def test_literals_not_regex(self):
+        for pattern, case_sensitive, expected in [
+            ("power", False, [1, 2]),
+            ("power", True, [2]),
+            ("^power", False, [1, 2]),
+            ("^Power", True, [1]),
+            ("supply$", False, [1, 3]),
+            ("^power cable$", False, [2]),
+            ("^Power cable$", True, []),
+            (r"a\.b", False, [4]),
+            ("^REPL", False, [3]),
+        ]:
+            with self.subTest(pattern=pattern, case_sensitive=case_sensitive):
+                ids, sql = self.matching_ids(pattern, case_sensitive)
+                self.assertEqual(expected, ids)
+                self.assertNotIn("REGEXP", sql)
+
+        ids, sql = self.matching_ids("supply", field="text")
+        self.assertEqual([1, 3], ids)
+        self.assertNotIn("REGEXP", sql)
+
+    def test_regex_fallback(self):
+        for pattern, case_sensitive, expected in [
+            ("^p.*e$", False, [2]),
+            ("a.b", False, [4]),
+            (r"\bsupply", True, [1, 3]),
+            ("GRÖSSE|größe", False, [5]),  # non-ascii case-folding
+        ]:
+            with self.subTest(pattern=pattern):
+                ids, sql = self.matching_ids(pattern, case_sensitive)
+                self.assertEqual(expected, ids)
+                self.assertIn("REGEXP", sql)
+
+    def test_listing_filter_case_sensitive(self):
+        Logbook.objects.filter(pk=self.lb.pk).update(config=log_config + "List display = ID, Subject\n")
+        reload_config()
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Filters"})
+        response = self.client.get(url + "?Subject=power")
+        self.assertEqual(2, response.context["page_obj"].paginator.count)
+        response = self.client.get(url + "?Subject=power&casesensitive=1")
+        self.assertEqual(1, response.context["page_obj"].paginator.count)
+
+
+class TestAttrIndexes(TransactionTestCase):
+    # TransactionTestCase as SQLite can't change the schema inside a transaction
+    def setUp(self):
+        ElogConfig.objects.create(name="global", config_text="")
+        self.lb = Logbook.objects.create(name="Indexed", config=log_config, auth_required=False)
+        reload_config()
+
+    def command(self, *args):
+        out = StringIO()
+        call_command("attr_indexes", *args, stdout=out)
+        return out.getvalue()
+
+    def test_create_status_drop(self):
+        subject_index = attr_index_name(self.lb.id, "Subject")
+        count_index = attr_index_name(self.lb.id, "Count", "numeric")
+        self.assertIn(f"missing  {subject_index}", self.command("--status"))
+
+        out = self.command()
+        self.assertIn(f"Created {subject_index}", out)
+        self.assertEqual(sorted([subject_index, count_index]), existing_indexes())
+        self.assertIn(f"ok       {count_index}  Indexed: Count (numeric)", self.command("--status"))
+        self.assertIn("already up to date", self.command())
+
+        # Changing the attribute type replaces its index
+        self.lb.config = log_config.replace("numeric", "text")
+        self.lb.save()
+        self.assertIn(f"stale    {count_index}", self.command("--status"))
+        out = self.command("-l", "Indexed")
+        self.assertIn(f"Dropped {count_index}", out)
+        self.assertIn(attr_index_name(self.lb.id, "Count", "text"), existing_indexes())
+
+        self.command("--drop")
+        self.assertEqual([], existing_indexes())
+
+    def test_sorted_listing_uses_index(self):
+        """The listing query for an attribute sort matches the expression index"""
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plan check is for SQLite")
+        Entry.objects.bulk_create(
+            Entry(lb=self.lb, id=i, date=timezone.now(), attrs={"Count": str(i % 7)})
+            for i in range(1, 201)
+        )
+        self.command()
+        queryset = (
+            self.lb.entries.annotate(**{SORT_KEY: sort_expression("attrs__Count", "numeric")})
+            .order_by(SORT_KEY, "id")[:20]
+        )
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            plan = " ".join(str(row) for row in cursor.fetchall())
+        self.assertIn(attr_index_name(self.lb.id, "Count", "numeric"), plan)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_filter_uses_index(self):
+        """Case-insensitive text filters anchored at the start search the attribute's index"""
+        if connection.vendor != "sqlite":
+            self.skipTest("Query plan check is for SQLite")
+        Entry.objects.bulk_create(
+            Entry(lb=self.lb, id=i, date=timezone.now(), attrs={"Subject": f"Subject {i}"})
+            for i in range(1, 201)
+        )
+        self.command()
+        for pattern in ("^subject 1$", "^subject 1"):
+            queryset = self.lb.entries.filter(compile_filter("attrs__Subject", pattern))
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+                plan = " ".join(str(row) for row in cursor.fetchall())
+            self.assertIn(f"SEARCH flexelog_entry USING INDEX {attr_index_name(self.lb.id, 'Subject')}", plan)
+
+
+class TestFullText(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.lb = Logbook.objects.create(
+            name="Texts", config=log_config + "List display = ID, Subject, Text\n", auth_required=False
+        )
+        reload_config()
+        call_command("fulltext_index", stdout=StringIO())
+        self.entries = [
+            Entry.objects.create(lb=self.lb, id=i, date=timezone.now(), attrs=attrs, text=text)
+            for i, (attrs, text) in enumerate([
+                ({"Subject": "Vacuum pump"}, "Replaced the Turbo pump"),
+                ({"Subject": "Cryostat"}, "Pressure rising, check turbo"),
+                ({"Subject": "Turbopump spares"}, "Ordered two"),
+            ], 1)
+        ]
+
+    def listing_ids(self, query):
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Texts"})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{url}?{query}")
+        uses_index = any("MATCH" in q["sql"] for q in queries if connection.vendor == "sqlite")
+        return sorted(entry.id for entry in response.context["page_obj"]), uses_index
+
+    def test_status(self):
+        self.assertIn("exists", self.command_output("--status"))
+        self.command_output("--drop")
+        self.assertIn("No full-text index", self.command_output("--status"))
+
+    def command_output(self, *args):
+        out = StringIO()
+        call_command("fulltext_index", *args, stdout=out)
+        return out.getvalue()
+
+    def test_text_search(self):
+        self.assertEqual(([1, 2], True), self.listing_ids("subtext=turbo"))
+        self.assertEqual(([1], True), self.listing_ids("subtext=Turbo&casesensitive=1"))
+        self.assertEqual(([1, 2, 3], True), self.listing_ids("subtext=turbo&sall=1"))
+        self.assertEqual(([2], True), self.listing_ids("subtext=turbo$"))
+        self.assertEqual(([1, 2], False), self.listing_ids("subtext=tur.o"))  # a regex
+
+    def test_index_follows_changes(self):
+        self.entries[0].text = "Nothing to see"
+        self.entries[0].save()
+        self.entries[1].delete()
+        Entry.objects.bulk_create([Entry(lb=self.lb, id=4, date=timezone.now(), text="Turbo OK")])
+        self.assertEqual(([4], True), self.listing_ids("subtext=turbo"))
+        Entry.objects.filter(lb=self.lb, id=3).update(attrs={"Subject": "Other"})
+        self.assertEqual(([4], True), self.listing_ids("subtext=turbo&sall=1"))
+
+        self.command_output("--drop")  # works the same, without the index
+        self.assertEqual(([4], False), self.listing_ids("subtext=turbo&sall=1"))
+
+    def test_availability_cached(self):
+        self.listing_ids("subtext=turbo")
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(fulltext.is_available())
+        self.assertEqual(0, len(queries))
+        self.command_output("--drop")
+        self.assertFalse(fulltext.is_available())
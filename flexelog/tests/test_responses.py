@@ -1,15 +1,20 @@
-from datetime import datetime
+import base64
+from datetime import datetime, timedelta
 from io import BytesIO
+import json
 import re
 from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import translation, timezone
 
 from textwrap import dedent
 
-from flexelog.models import Logbook, ElogConfig, Entry, Attachment
+from flexelog.models import Logbook, LogbookGroup, ElogConfig, Entry, Attachment, User
 from flexelog.elog_cfg import LogbookConfig, get_config
 
 
@@ -76,8 +81,15 @@ empty_attachment_data = {
 }
     
 
+def _counts_entries(sql):
+    return "COUNT(" in sql and 'FROM "flexelog_entry"' in sql
+
+
 class TestResponsesEmptyDb(TestCase):
     """No ElogConfig or Logbooks set up - check error messages"""
+    def setUp(self):
+        cache.clear()  # cached counts etc. are not rolled back with the test database
+
     def test_index_no_logbooks(self):
         """Index page displays message if no active logbooks defined"""
         url = reverse("flexelog:index")
@@ -115,6 +127,9 @@ class TestEmptyLogbook(TestCase):
         cls.lb.config = emptylog_config
         cls.lb.save()
 
+    def setUp(self):
+        cache.clear()
+
     def test_empty_list_entries(self):
         url = reverse("flexelog:logbook", kwargs={"lb_name": "EmptyLog"})
         response = self.client.get(url)
@@ -206,6 +221,9 @@ class TestResponsesNoAuth(TestCase):
         cls.lb1.save()
         cls.lb2.save()
 
+    def setUp(self):
+        cache.clear()
+
     def test_logbook_list(self):
         url = reverse("flexelog:index")
         response = self.client.get(url)
@@ -221,6 +239,55 @@ class TestResponsesNoAuth(TestCase):
         )
         self.assertTrue(re.search(pattern, rstr, re.DOTALL))
 
+    def test_logbook_list_counts_maintained(self):
+        """Index page entry totals follow entries being added and deleted"""
+        url = reverse("flexelog:index")
+        self.assertEqual(self.client.get(url).context["entry_counts"][self.lb1.id], 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.entry_elcode.delete()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.context["entry_counts"][self.lb1.id], 2)
+        self.assertFalse(any(_counts_entries(query["sql"]) for query in queries))
+
+    def test_logbook_list_latest_dates(self):
+        """Index page counts and latest dates come from one query, then the cache"""
+        url = reverse("flexelog:index")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        entry_queries = [query["sql"] for query in queries if 'FROM "flexelog_entry"' in query["sql"]]
+        self.assertEqual(1, len(entry_queries))
+        self.assertEqual({self.lb1.id: self.entry_elcode.date, self.lb2.id: None}, response.context["latest_dates"])
+        self.assertIsNone(self.lb2.latest_date())
+        self.assertEqual(self.entry_elcode.date, self.lb1.latest_date())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            new_entry = Entry.objects.create(lb=self.lb2, id=1, date=timezone.now())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertFalse(any('FROM "flexelog_entry"' in query["sql"] for query in queries))
+        self.assertEqual(new_entry.date, response.context["latest_dates"][self.lb2.id])
+        self.assertEqual(1, response.context["entry_counts"][self.lb2.id])
+
+    def test_logbook_groups(self):
+        """Logbook groups are read once, cached, and follow changes"""
+        url = reverse("flexelog:index")
+        self.assertEqual({None: [self.lb1, self.lb2]}, self.client.get(url).context["group_logbooks"])
+        group = LogbookGroup.objects.create(name="Group A")
+        group.logbooks.add(self.lb2)
+        response = self.client.get(url)
+        self.assertEqual({"Group A": [self.lb2], None: [self.lb1]}, response.context["group_logbooks"])
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        self.assertFalse(any("flexelog_logbookgroup" in query["sql"] for query in queries))
+
+        group.logbooks.add(self.lb1)
+        response = self.client.get(url)
+        self.assertEqual({"Group A": [self.lb1, self.lb2]}, response.context["group_logbooks"])
+        group.logbooks.clear()
+        response = self.client.get(url)
+        self.assertEqual({None: [self.lb1, self.lb2]}, response.context["group_logbooks"])
+
     def test_logbook_entry_list(self):
         """Test html returned from listing of a log books entries"""
         url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
@@ -243,18 +310,207 @@ class TestResponsesNoAuth(TestCase):
         response = self.client.get(url + "?mode=full&page=2")
         self.assertContains(response, "blah")
 
+    def test_logbook_entry_list_mode_names(self):
+        """The Find form's mode names work, and unknown modes list as Summary"""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        for mode, expected in [("Display full", "full"), ("Summary", "summary"), ("Threads", "threaded"), ("bogus", "summary")]:
+            with self.subTest(mode=mode):
+                self.assertEqual(expected, self.client.get(url, {"mode": mode}).context["mode"])
+        for mode, expected in [("Display full", "full"), ("Threads", "summary")]:
+            with self.subTest(mode=mode, options="all"):
+                response = self.client.get(url, {"mode": mode, "options": "all"})
+                self.assertEqual(expected, response.context["mode"])
+
     def test_logbook_entry_list_sort_and_sel_id(self):
         """Test entries list with sort=(moptions attr) and selected id"""
         url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
         response = self.client.get(url + "?sort=Category&id=2")
         self.assertContains(response, "blah")
 
+    def test_logbook_entry_list_sel_id_page(self):
+        """?id= positions to the page holding that entry, for attribute and date sorts"""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        # Category lower-cased: entry 1 '["cat 1", ...', entries 2, 3 '["cat 2"]', ties by -id
+        page_obj = self.client.get(url + "?sort=Category&id=2&npp=1").context["page_obj"]
+        self.assertEqual([entry.id for entry in page_obj], [2])
+        self.assertEqual(page_obj.number, 3)
+
+        page_obj = self.client.get(url + "?id=1&npp=2").context["page_obj"]
+        self.assertEqual([entry.id for entry in page_obj], [1])
+        self.assertEqual(page_obj.number, 2)
+
+        # Selected entry filtered out - id is ignored
+        page_obj = self.client.get(url + "?Status=Started&id=2&npp=1").context["page_obj"]
+        self.assertEqual([entry.id for entry in page_obj], [1])
+
     def test_logbook_entry_list_sort_reserved_attr_page_all(self):
         """Test entries list with rsort=Date and page=all"""
         url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
         response = self.client.get(url + "?rsort=Date&page=all")
         self.assertContains(response, "blah")
 
+    def test_logbook_entry_list_cursor_pages(self):
+        """Next/Previous page links carry cursors which page through the entries"""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        response = self.client.get(url + "?npp=1")
+        page1 = response.context["page_obj"]
+        self.assertEqual([entry.id for entry in page1], [3])
+        self.assertContains(response, f"cursor={page1.next_cursor}")
+
+        # Entries 1 and 2 have the same date, so ties are broken by id
+        response = self.client.get(url, {"npp": 1, "cursor": page1.next_cursor})
+        page2 = response.context["page_obj"]
+        self.assertEqual([entry.id for entry in page2], [2])
+        self.assertEqual(page2.number, 2)
+
+        response = self.client.get(url, {"npp": 1, "cursor": page2.next_cursor})
+        page3 = response.context["page_obj"]
+        self.assertEqual([entry.id for entry in page3], [1])
+        self.assertFalse(page3.has_next())
+
+        response = self.client.get(url, {"npp": 1, "cursor": page3.previous_cursor})
+        self.assertEqual([entry.id for entry in response.context["page_obj"]], [2])
+
+    def test_logbook_entry_list_cursor_sorted_attr(self):
+        """Cursor paging follows an attribute sort, and bad cursors fall back to ?page="""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        ids = []
+        params = {"npp": 1, "sort": "Subject"}
+        for _ in range(3):
+            page_obj = self.client.get(url, params).context["page_obj"]
+            ids.extend(entry.id for entry in page_obj)
+            params["cursor"] = page_obj.next_cursor
+        self.assertEqual(ids, [3, 1, 2])  # ELCode, First, Second
+
+        response = self.client.get(url, {"npp": 1, "cursor": "not-a-cursor", "page": 2})
+        self.assertEqual([entry.id for entry in response.context["page_obj"]], [2])
+
+    def test_logbook_entry_list_cursor_then_resort(self):
+        """A cursor kept when changing the sort is ignored, rather than seeking in the wrong order"""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        page1 = self.client.get(url, {"npp": 1}).context["page_obj"]
+        response = self.client.get(url, {"npp": 1, "cursor": page1.next_cursor})
+        self.assertEqual([entry.id for entry in response.context["page_obj"]], [2])
+        self.assertNotContains(response, page1.next_cursor)  # sort, mode and search links drop it
+
+        for sort in ({"sort": "Subject"}, {"rsort": "Subject"}, {"sort": "Date"}):
+            with self.subTest(sort=sort):
+                expected = self.client.get(url, {"npp": 1, **sort}).context["page_obj"]
+                response = self.client.get(url, {"npp": 1, "cursor": page1.next_cursor, **sort})
+                self.assertEqual(200, response.status_code)
+                page_obj = response.context["page_obj"]
+                self.assertEqual(1, page_obj.number)
+                self.assertEqual([entry.id for entry in expected], [entry.id for entry in page_obj])
+
+    def test_logbook_entry_list_cursor_malformed(self):
+        """Cursors with the wrong types of values fall back to ?page="""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        sort_field, sort_desc = self.client.get(url, {"npp": 1}).context["page_obj"].paginator.sort
+        sort = [sort_field, int(sort_desc)]
+        for payload in [
+            [{"dt": "garbage"}, 3, 2, 0, *sort],
+            [None, 3, 2, 0, *sort],
+            [[1], 3, 2, 0, *sort],
+            ["garbage", 3, 2, 0, *sort],  # a string for the date sort
+            [{"dt": "2025-01-01T10:00:00+00:00"}, [3], 2, 0, *sort],
+            None,
+            [1, 2],
+            "x",
+        ]:
+            with self.subTest(payload=payload):
+                cursor = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+                response = self.client.get(url, {"npp": 1, "cursor": cursor, "page": 2})
+                self.assertEqual(200, response.status_code)
+                self.assertEqual(2, response.context["page_obj"].number)
+
+    def test_logbook_entry_list_count_cached(self):
+        """Filtered listing counts are cached until an entry in the logbook changes"""
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        response = self.client.get(url + "?Status=Done")
+        self.assertEqual(response.context["page_obj"].paginator.count, 2)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url + "?Status=Done")
+        self.assertEqual(response.context["page_obj"].paginator.count, 2)
+        self.assertFalse(any(_counts_entries(query["sql"]) for query in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Entry.objects.create(
+                lb=self.lb1,
+                id=50,
+                date=timezone.make_aware(datetime(2025,1,2,9,0,0)),
+                attrs={"Subject": "Count me", "Category": ["Cat 1"], "Status": "Done"},
+            )
+        response = self.client.get(url + "?Status=Done")
+        self.assertEqual(response.context["page_obj"].paginator.count, 3)
+        response = self.client.get(url)
+        self.assertEqual(response.context["page_obj"].paginator.count, 4)
+
+    def test_logbook_entry_list_query_count_constant(self):
+        """Listing queries don't grow with the number of rows shown"""
+        Entry.objects.create(  # a second attachment, to fetch more than one per entry
+            lb=self.lb1, id=4, date=timezone.now(), author=User.objects.create(username="writer"),
+            attrs={"Subject": "Fourth entry"}, in_reply_to=self.entry_elcode,
+        ).attachments.create(attachment_file=self.attachment1.attachment_file.name)
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        self.client.get(url + "?npp=1")  # config, cached counts etc.
+        query_counts = []
+        for npp in (1, 4):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url + f"?npp={npp}")
+            self.assertEqual(len(response.context["page_obj"]), npp)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertContains(response, "writer")
+        # Storage may have renamed the upload, if the media dir already had the file
+        self.assertContains(response, f'{self.attachment1.attachment_file.url}" target="_blank"', count=2)
+
+    def test_search_all_logbooks(self):
+        """options=all searches every available logbook, merged in date order"""
+        Entry.objects.create(
+            lb=self.lb2, id=1, date=timezone.make_aware(datetime(2025,1,1,9,30,0)),
+            attrs={"Subject": "Log2 entry"}, text="An entry in Log2",
+        )
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log2"})
+        response = self.client.get(url + "?options=all&options=reverse&subtext=entry&npp=2")
+        page_obj = response.context["page_obj"]
+        self.assertEqual(4, page_obj.paginator.count)
+        self.assertEqual([("Log 1", 3), ("Log2", 1)], [(lb.name, hits) for lb, hits, _ in response.context["logbook_hits"]])
+        self.assertEqual([("Log 1", 3), ("Log2", 1)], [(e.lb.name, e.id) for e in page_obj])
+        self.assertContains(response, '<span class="highlight">entry</span>')
+
+        response = self.client.get(url, {"options": ["all", "reverse"], "subtext": "entry", "npp": 2, "cursor": page_obj.next_cursor})
+        self.assertEqual([("Log 1", 2), ("Log 1", 1)], [(e.lb.name, e.id) for e in response.context["page_obj"]])
+
+        # Attribute filter, and oldest first
+        response = self.client.get(url + "?options=all&subject=log2|second")
+        self.assertEqual([("Log 1", 2), ("Log2", 1)], [(e.lb.name, e.id) for e in response.context["page_obj"]])
+
+    def test_logbook_entry_list_date_window(self):
+        """past<N> url, and Find form start/end dates and last N days, combined with other filters"""
+        Entry.objects.create(
+            lb=self.lb1, id=4, date=timezone.now() - timedelta(hours=2),
+            attrs={"Subject": "Recent", "Status": "Done"},
+        )
+        url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
+        past_url = reverse("flexelog:logbook_past", kwargs={"lb_name": "Log+1", "last_days": 1})
+        self.assertEqual(past_url, url + "past1")
+        for query, expected_ids in [
+            (past_url, [4]),
+            (url + "?last=7&Status=Done", [4]),
+            (url + "?start_date=2025-01-01T09:30", [4, 3]),
+            (url + "?start_date=2025-01-01T09:30&end_date=2025-01-02", [3]),
+            (url + "?start_date=2025-01-01&end_date=2025-01-01", [3, 2, 1]),  # single day
+            (url + "?last=99999999", [4, 3, 2, 1]),  # too many days is all of them
+            (url + "past99999999", [4, 3, 2, 1]),
+            (url + "?last=-1", [4, 3, 2, 1]),  # ignored
+            (url + "?end_date=2025-01-01T09:30&Status=Done", [2]),
+            (url + "?end_date=2025-01-01T09:30&npp=1&page=2", [1]),
+        ]:
+            with self.subTest(query=query):
+                response = self.client.get(query)
+                self.assertEqual(expected_ids, [entry.id for entry in response.context["page_obj"]])
+        self.assertContains(response, "Jan. 1, 2025, 9:30 a.m.")  # filter shown
+
     def test_entry_list_with_search_text(self):
         """Test html returned from listing of a log books entries"""
         url = reverse("flexelog:logbook", kwargs={"lb_name": "Log+1"})
@@ -0,0 +1,79 @@
+from django.test import SimpleTestCase
+
+from flexelog.snippets import compile_pattern, nearest_break, summary_lines
+from flexelog.templatetags.flex import highlight, highlight_text
+
+
+class TestSnippets(SimpleTestCase):
+    def test_nearest_break(self):
+        text = "alpha beta gamma"
+        self.assertEqual(5, nearest_break(text, 4, 0, 10))
+        self.assertEqual(6, nearest_break(text, 7, 0, 10))
+        self.assertEqual(0, nearest_break(text, 1, 0, 10))  # window ends are breaks
+        self.assertEqual(10, nearest_break(text, 9, 7, 10))
+        # equally near breaks, either side of "abcd"
+        self.assertEqual(2, nearest_break("x abcd y", 4, 0, 8))
+        self.assertEqual(6, nearest_break("x abcd y", 4, 0, 8, break_tie_left=False))
+
+    def test_short_text_wrapped(self):
+        text = "First line\nsecond line that is a bit longer than the width"
+        self.assertEqual(
+            ["First line", "second line that is a bit", "longer than the width"],
+            summary_lines(text, 25, 5, compile_pattern("longer")),
+        )
+        self.assertEqual(["First line", "second line that is a bit"], summary_lines(text, 25, 2))
+        self.assertEqual([], summary_lines("", 25, 2))
+
+    def test_clips_around_matches(self):
+        text = " ".join(f"word{i}" for i in range(200))
+        lines = summary_lines(text, 40, 3, compile_pattern("WORD100 "))
+        self.assertTrue(lines[0].startswith("..."))
+        self.assertIn("word100", lines[0])
+        self.assertTrue(lines[-1].endswith("..."))
+        joined = " ".join(lines)
+        self.assertNotIn("word90 ", joined)
+        self.assertNotIn("word110", joined)
+
+        # Overlapping clips are merged, others joined with ...
+        lines = summary_lines(text, 40, 3, compile_pattern("word10 |word12 |word150 "))
+        joined = " ".join(lines)
+        self.assertEqual(1, joined.count("word11 "))
+        self.assertIn("word14... word148", joined)
+
+    def test_no_match_shows_start(self):
+        text = "start " + "x" * 500
+        self.assertTrue(summary_lines(text, 40, 3, compile_pattern("absent"))[0].startswith("start x"))
+
+    def test_bad_pattern_ignored(self):
+        self.assertIsNone(compile_pattern("a(b"))
+        self.assertIsNone(compile_pattern(""))
+
+    def test_large_text(self):
+        """Only enough of a large text for the summary is looked at"""
+        line = "2025-01-01 12:00:00 pump pressure 1e-6 mbar ok\n"
+        text = line * 100_000  # about 5 MB
+        lines = summary_lines(text, 100, 3, compile_pattern("pressure"))
+        self.assertEqual(3, len(lines))
+        self.assertTrue(all("pressure" in line for line in lines))
+        self.assertEqual(["x" * 100] * 2 + ["[...]"], summary_lines("x" * 5_000_000, 100, 3))
+
+
+class TestHighlight(SimpleTestCase):
+    def test_highlight_text(self):
+        hl = '<span class="highlight">{}</span>'.format
+        self.assertEqual(f"a {hl('Pump')} &lt;b&gt; {hl('pump')}", highlight_text("a Pump <b> pump", "pump"))
+        self.assertEqual("a Pump &lt;b&gt; " + hl("pump"), highlight_text("a Pump <b> pump", "pump", True))
+        self.assertEqual(f"{hl('&lt;b&gt;')}x", highlight_text("<b>x", "<b>"))
+        self.assertEqual("&lt;b&gt;x", highlight_text("<b>x", "z*"))  # empty matches ignored
+        self.assertEqual("&lt;b&gt;x", highlight_text("<b>x", "(b"))  # bad pattern, but escaped
+        self.assertEqual("<b>x", highlight_text("<b>x", ""))  # no pattern, left for viewer to escape
+
+    def test_highlight_filter(self):
+        hl = '<span class="highlight">{}</span>'.format
+        self.assertEqual(f"x {hl('a.b')} axb", highlight("x a.b axb", "a.b"))  # literal
+        self.assertEqual("A.B", highlight("A.B", "a.b"))
+        self.assertEqual("&lt;i&gt;", highlight("<i>", None))
+
+    def test_patterns_cached(self):
+        self.assertIs(compile_pattern("pump", True), compile_pattern("pump", True))
+        self.assertIsNot(compile_pattern("pump", True), compile_pattern("pump"))
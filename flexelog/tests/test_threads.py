@@ -0,0 +1,164 @@
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.template import Context, Template
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from flexelog.models import ElogConfig, Entry, Logbook
+from flexelog.threads import path_segment, thread_entries
+
+
+def tree_ids(entry):
+    return [(e.id, e.thread_path.count(".")) for e in thread_entries(entry)]
+
+
+class TestThreadPaths(TestCase):
+    def setUp(self):
+        cache.clear()
+        ElogConfig.objects.create(name="global", config_text="")
+        self.lb = Logbook.objects.create(name="Threads", auth_required=False)
+        self.entries = {}
+        # 1 ─ 2 ─ 4
+        #   └ 3
+        # 5
+        for entry_id, parent_id in [(1, None), (2, 1), (3, 1), (4, 2), (5, None)]:
+            self.entries[entry_id] = Entry.objects.create(
+                lb=self.lb, id=entry_id, date=timezone.now(), text=f"Entry {entry_id}",
+                in_reply_to=self.entries.get(parent_id),
+            )
+
+    def entry(self, entry_id):
+        return Entry.objects.get(lb=self.lb, id=entry_id)
+
+    def test_paths_on_save(self):
+        entry4 = self.entry(4)
+        self.assertEqual(1, entry4.thread_root)
+        self.assertEqual(".".join(path_segment(i) for i in (1, 2, 4)), entry4.thread_path)
+        self.assertEqual([(1, 0), (2, 1), (4, 2), (3, 1)], tree_ids(entry4))
+        self.assertEqual([(5, 0)], tree_ids(self.entry(5)))
+        self.assertEqual(1, entry4.reply_ancestor().id)
+
+    def test_move_and_delete(self):
+        entry2 = self.entry(2)
+        entry2.in_reply_to = self.entry(5)
+        entry2.save()
+        self.assertEqual([(5, 0), (2, 1), (4, 2)], tree_ids(self.entry(4)))
+        self.assertEqual([(1, 0), (3, 1)], tree_ids(self.entry(1)))
+
+        self.entry(2).delete()
+        self.assertEqual([(4, 0)], tree_ids(self.entry(4)))
+        self.assertEqual([(5, 0)], tree_ids(self.entry(5)))
+
+    def test_reply_to_entry_without_path(self):
+        """Replying to bulk loaded entries fills in the thread, so none of it is left out"""
+        Entry.objects.bulk_create([
+            Entry(lb=self.lb, id=10, date=timezone.now()),
+            Entry(lb=self.lb, id=11, date=timezone.now(), in_reply_to=self.entry(5)),
+        ])
+        Entry.objects.bulk_create([
+            Entry(lb=self.lb, id=12, date=timezone.now(), in_reply_to=self.entry(10)),
+            Entry(lb=self.lb, id=13, date=timezone.now(), in_reply_to=self.entry(10)),
+        ])
+        Entry.objects.create(lb=self.lb, id=14, date=timezone.now(), in_reply_to=self.entry(12))
+        self.assertEqual([(10, 0), (12, 1), (14, 2), (13, 1)], tree_ids(self.entry(14)))
+        html = Template("{% load flex %}{% thread_tree entry %}").render(Context({"entry": self.entry(14)}))
+        self.assertEqual(4, html.count("<tr>"))
+
+        # Parent with no path, but the rest of the thread has them
+        Entry.objects.create(lb=self.lb, id=15, date=timezone.now(), in_reply_to=self.entry(11))
+        self.assertEqual([(5, 0), (11, 1), (15, 2)], tree_ids(self.entry(15)))
+
+    def test_thread_tree_queries(self):
+        template = Template("{% load flex %}{% thread_tree entry %}")
+        entry = Entry.objects.select_related("lb").get(lb=self.lb, id=4)
+        with self.assertNumQueries(1):
+            html = template.render(Context({"entry": entry}))
+        self.assertEqual(4, html.count("<tr>"))
+        self.assertIn("<b>", html.split("\n")[2])  # the selected entry
+
+        # Bigger thread, same queries
+        Entry.objects.create(lb=self.lb, id=6, date=timezone.now(), in_reply_to=entry)
+        Entry.objects.create(lb=self.lb, id=7, date=timezone.now(), in_reply_to=self.entry(6))
+        with self.assertNumQueries(1):
+            html = template.render(Context({"entry": entry}))
+        self.assertEqual(6, html.count("<tr>"))
+
+    def test_command_backfills(self):
+        Entry.objects.filter(lb=self.lb).update(thread_root=None, thread_path="")
+        Entry.objects.bulk_create([Entry(lb=self.lb, id=8, date=timezone.now(), in_reply_to=self.entry(4))])
+        out = StringIO()
+        call_command("thread_paths", "--status", stdout=out)
+        self.assertIn("Threads: 6 entries without thread paths", out.getvalue())
+
+        call_command("thread_paths", stdout=out)
+        self.assertIn("Threads: updated 6 entries", out.getvalue())
+        self.assertEqual([(1, 0), (2, 1), (4, 2), (8, 3), (3, 1)], tree_ids(self.entry(8)))
+        call_command("thread_paths", "-l", "Threads", stdout=out)
+        self.assertIn("Threads: updated 0 entries", out.getvalue())
+
+
+class TestThreadedListing(TestCase):
+    def setUp(self):
+        cache.clear()
+        ElogConfig.objects.create(name="global", config_text="")
+        self.lb = Logbook.objects.create(
+            name="Threaded", config="Attributes = Subject\nList display = ID, Date, Subject, Text\n",
+            auth_required=False,
+        )
+        self.url = reverse("flexelog:logbook", args=["Threaded"])
+        self.next_id = 1
+        self.roots = [self.add(None, f"Thread {i}") for i in range(3)]
+
+    def add(self, parent, subject):
+        entry = Entry.objects.create(
+            lb=self.lb, id=self.next_id, date=timezone.now(), attrs={"Subject": subject}, in_reply_to=parent
+        )
+        self.next_id += 1
+        return entry
+
+    def add_replies(self, depth):
+        for root in self.roots:
+            parent = root
+            for level in range(depth):
+                parent = self.add(parent, f"Re {level}")
+
+    def listing(self, query="mode=threaded"):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"{self.url}?{query}")
+        self.assertEqual(200, response.status_code)
+        return response, len(queries)
+
+    def test_pages_threads(self):
+        self.add_replies(2)
+        response, _ = self.listing()
+        self.assertEqual(3, response.context["page_obj"].paginator.count)
+        self.assertEqual([[8, 9], [6, 7], [4, 5]], [  # newest first
+            [reply.id for reply in root.thread_replies] for root in response.context["page_obj"]
+        ])
+        html = response.content.decode()
+        self.assertEqual(6, html.count('class="threadreply" colspan="3"'))
+        self.assertIn("&nbsp;" * 6 + "<a", html)  # second level replies indented twice
+        response, _ = self.listing("mode=threaded&id=9&npp=1")  # a reply: page with its thread
+        self.assertEqual([3], [root.id for root in response.context["page_obj"]])
+        self.assertIn("<b>", response.content.decode())
+
+        # Filters find threads with any matching entry; the Find form's mode name works too
+        response, _ = self.listing("mode=Threads&Subject=^Re 1$")
+        self.assertEqual(3, response.context["page_obj"].paginator.count)
+        Entry.objects.filter(lb=self.lb, id=2).update(attrs={"Subject": "Other"})
+        response, _ = self.listing("mode=threaded&Subject=other")
+        self.assertEqual([2], [root.id for root in response.context["page_obj"]])
+
+    def test_query_count_constant(self):
+        self.add_replies(1)
+        self.listing()  # fill caches
+        _, shallow_queries = self.listing()
+        self.add_replies(5)
+        self.listing()
+        _, deep_queries = self.listing()
+        self.assertEqual(shallow_queries, deep_queries)
@@ -0,0 +1,190 @@
+# Copyright 2025 flexelog authors. See LICENSE file for details.
+"""Materialized thread paths, so a whole thread is read with one query
+
+Each entry stores the id of the entry starting its thread (`thread_root`)
+and a `thread_path`: the ids from the thread's first entry down to the
+entry, zero-padded and joined with ".".  A thread's entries are then one
+indexed query on (lb, thread_root), and sorting them by path puts each
+reply right after its parent, with replies to the same entry in id order.
+
+The fields are set as entries are saved.  Replies under an entry are
+updated when it moves to another thread, or is deleted (its replies then
+start their own threads, as `in_reply_to` is set to null).  A reply to an
+entry without a thread path fills in the paths of its whole thread, so the
+thread isn't read without its earlier entries.
+Entries made without signals (bulk_create, fixtures) are filled in by the
+`thread_paths` management command, i.e. `rebuild_threads`.
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from flexelog.models import Entry, Logbook
+
+SEGMENT_WIDTH = 10  # digits in the largest IntegerField id
+SEPARATOR = "."
+UPDATE_BATCH_SIZE = 1000
+
+
+def path_segment(entry_id: int) -> str:
+    return f"{entry_id:0{SEGMENT_WIDTH}d}"
+
+
+def thread_depth(path: str) -> int:
+    """Return number of replies above the entry with this path (0 for the thread's first entry)"""
+    return path.count(SEPARATOR)
+
+
+def thread_position(entry: Entry, _seen=None) -> tuple[int | None, str]:
+    """Return (thread root id, thread path) for the entry, from its `in_reply_to` parent
+
+    If the parent's are not filled in, works them out from its ancestors
+    """
+    if entry.id is None:
+        return None, ""
+    parent = entry.in_reply_to if entry.in_reply_to_id else None
+    _seen = _seen or set()
+    _seen.add(entry.pk)
+    if parent is None or parent.pk in _seen:  # (a loop of replies is cut here)
+        return entry.id, path_segment(entry.id)
+    if not parent.thread_path:
+        parent.thread_root, parent.thread_path = thread_position(parent, _seen)
+    return parent.thread_root, f"{parent.thread_path}{SEPARATOR}{path_segment(entry.id)}"
+
+
+def _positions(rows: dict, known: dict) -> dict:
+    """Return {rowid: (thread root, path)} for rows {rowid: (id, in_reply_to rowid)}
+
+    `known` has the (root, path) of parents which are not in `rows`;
+    entries with a parent in neither are the first of a thread.
+    """
+    positions = dict(known)
+    for rowid in rows:
+        chain = []  # this entry, then ancestors not yet placed
+        current = rowid
+        while current in rows and current not in positions and current not in chain:
+            chain.append(current)
+            current = rows[current][1]
+        parent_position = positions.get(current) if current not in chain else None
+        for rowid_down in reversed(chain):
+            entry_id = rows[rowid_down][0]
+            if parent_position is None:
+                position = (entry_id, path_segment(entry_id))
+            else:
+                root, path = parent_position
+                position = (root, f"{path}{SEPARATOR}{path_segment(entry_id)}")
+            positions[rowid_down] = parent_position = position
+    return positions
+
+
+def rethread(queryset) -> int:
+    """Recalculate thread root and path for the entries in queryset; return the number changed"""
+    rows = {}
+    current = {}
+    for rowid, entry_id, parent, root, path in queryset.values_list(
+        "rowid", "id", "in_reply_to_id", "thread_root", "thread_path"
+    ):
+        rows[rowid] = (entry_id, parent)
+        current[rowid] = (root, path)
+
+    outside = {parent for _, parent in rows.values() if parent is not None and parent not in rows}
+    known = {}
+    for parent in Entry.objects.filter(rowid__in=outside):
+        if not parent.thread_path:
+            parent.thread_root, parent.thread_path = thread_position(parent)
+        known[parent.rowid] = (parent.thread_root, parent.thread_path)
+
+    positions = _positions(rows, known)
+    changed = [
+        Entry(rowid=rowid, thread_root=positions[rowid][0], thread_path=positions[rowid][1])
+        for rowid in rows
+        if positions[rowid] != current[rowid]
+    ]
+    Entry.objects.bulk_update(changed, ["thread_root", "thread_path"], batch_size=UPDATE_BATCH_SIZE)
+    return len(changed)
+
+
+def rebuild_threads(logbooks: list[Logbook] | None = None) -> dict[str, int]:
+    """Fill in thread root and path for all entries of the logbooks (default all)
+
+    Returns {logbook name: number of entries changed}
+    """
+    logbooks = Logbook.objects.all() if logbooks is None else logbooks
+    return {logbook.name: rethread(logbook.entries.all()) for logbook in logbooks}
+
+
+def thread_entries(entry: Entry) -> list[Entry]:
+    """Return all the entries in the entry's thread, in tree order"""
+    return list(
+        Entry.objects.filter(lb=entry.lb_id, thread_root=entry.thread_root).order_by("thread_path")
+    )
+
+
+def attach_thread_replies(roots: list[Entry]) -> list[Entry]:
+    """Set `thread_replies` on each entry starting a thread: the rest of its thread, in tree order
+
+    One query for all the threads, however many replies and levels they have
+    """
+    for root in roots:
+        root.thread_replies = []
+    if not roots:
+        return roots
+    by_root = {(root.lb_id, root.id): root for root in roots}
+    replies = Entry.objects.filter(
+        lb__in={root.lb_id for root in roots},
+        thread_root__in={root.id for root in roots},
+        in_reply_to__isnull=False,
+    ).order_by("thread_path")
+    for reply in replies:
+        if root := by_root.get((reply.lb_id, reply.thread_root)):
+            root.thread_replies.append(reply)
+    return roots
+
+
+def _thread_rowids(lb_id: int, root_id: int) -> list[int]:
+    """Return rowids of all entries in the thread from `in_reply_to`, one query per level"""
+    level = list(Entry.objects.filter(lb=lb_id, id=root_id).values_list("rowid", flat=True))
+    seen = set()
+    while level:
+        seen.update(level)
+        level = [
+            rowid for rowid in Entry.objects.filter(in_reply_to__in=level).values_list("rowid", flat=True)
+            if rowid not in seen
+        ]
+    return list(seen)
+
+
+def _replies_below(entry: Entry, root: int | None, path: str):
+    return Entry.objects.filter(lb=entry.lb_id, thread_root=root, thread_path__startswith=path + SEPARATOR)
+
+
+@receiver(pre_save, sender=Entry)
+def set_thread_position(sender, instance, raw, update_fields=None, **kwargs):
+    if raw or update_fields is not None:
+        return
+    instance._previous_thread = (instance.thread_root, instance.thread_path)
+    parent = instance.in_reply_to if instance.in_reply_to_id else None
+    # Parent's position is only worked out in memory, so fill in the thread after saving
+    instance._fill_thread = parent is not None and not parent.thread_path
+    instance.thread_root, instance.thread_path = thread_position(instance)
+
+
+@receiver(post_save, sender=Entry)
+def entry_moved(sender, instance, created, raw, **kwargs):
+    """Move the replies under an entry along with it, e.g. if made a reply to another entry
+
+    Or fill in the paths of the thread, if the entry's parent had none
+    """
+    if getattr(instance, "_fill_thread", False) and not raw:
+        instance._fill_thread = False
+        rethread(Entry.objects.filter(rowid__in=_thread_rowids(instance.lb_id, instance.thread_root)))
+        return
+    previous_root, previous_path = getattr(instance, "_previous_thread", (None, ""))
+    if created or raw or not previous_path or previous_path == instance.thread_path:
+        return
+    rethread(_replies_below(instance, previous_root, previous_path))
+
+
+@receiver(post_delete, sender=Entry)
+def entry_deleted(sender, instance, **kwargs):
+    if instance.thread_path:
+        rethread(_replies_below(instance, instance.thread_root, instance.thread_path))
@@ -12,6 +12,7 @@ urlpatterns = [
     path("accounts/do_logout", views.do_logout, name="do_logout"),
     path("", views.index, name="index"),
     path("<str:lb_name>/", views.logbook_view, name="logbook"),
+    path("<str:lb_name>/past<int:last_days>", views.logbook_past_view, name="logbook_past"),
     path("<str:lb_name>/<int:entry_id>/", views.entry_detail, name="entry_detail"),
     # path("test/<str:lb_name>/<int:entry_id>/", views.test, name="test"),
     path("attachments/<str:lb_name>/<int:entry_id>/<str:filename>", views.attachments, name="attachments"),
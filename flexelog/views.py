@@ -1,32 +1,42 @@
 # Copyright 2025 flexelog authors. See LICENSE file for details.
 from copy import copy
+from datetime import datetime, time, timedelta
 import logging
-import operator
 from pathlib import Path
 from typing import Any
 from django.conf import settings
-from django.core.paginator import Paginator
 from django.db import transaction 
 
-from django.db.models.functions import Lower
+from django.db.models import Count, F, Q
 from django.http import HttpResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import formats, timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils.translation import gettext as _
 
 from flexelog.forms import EntryForm, EntryViewerForm, ListingModeFullForm, SearchForm, AttachmentFormSet
 from flexelog.subst import apply_presets
-from guardian.shortcuts import get_perms
 
-from .models import Logbook, LogbookGroup, Entry
+from .models import Logbook, Entry
+from .counts import listing_count, logbook_index_stats
 from .elog_cfg import get_config
+from .fulltext import text_search_filter
+from .groups import group_membership
+from .permissions import ALL_LOGBOOKS, logbook_perms, user_logbook_perms
+from .listing import compile_filters, listing_plan, sort_expression, with_listing_relations
+from .pagination import KeysetPaginator, SORT_KEY
+from .threads import attach_thread_replies
 
 from urllib.parse import unquote_plus
 
 import logging
 logger = logging.getLogger("flexelog")
 
+LISTING_MODES = ("full", "summary", "threaded")
+_FIND_FORM_MODES = {"display full": "full", "threads": "threaded"}  # Find form's names for modes
+MAX_LAST_DAYS = 36500  # "last N days" beyond this covers any logbook (and larger can't be a date)
+
 # From https://stackoverflow.com/a/78769514/1987276
 # only used occasionally in dev - add decorator around functions
 # def query_debugger(view):
@@ -52,24 +62,37 @@ logger = logging.getLogger("flexelog")
 
 
 def available_logbooks(request) -> list[Logbook]:
-    return [
+    """Return the active logbooks the user can see, kept on the request for later calls
+
+    Uses the user's cached permissions for all logbooks, see `permissions.py`
+    """
+    if (logbooks := getattr(request, "_available_logbooks", None)) is not None:
+        return logbooks
+
+    user = request.user
+    perms = user_logbook_perms(user)
+    request._available_logbooks = logbooks = [
         lb
         for lb in Logbook.objects.filter(active=True).order_by("order")
         if not lb.auth_required
-        or (request.user.is_authenticated and request.user.has_perm("view_entries", lb))
-        or (not request.user.is_authenticated and not lb.is_unlisted)
+        or (user.is_authenticated and "view_entries" in (perms.get(ALL_LOGBOOKS) or perms.get(lb.id, ())))
+        or (not user.is_authenticated and not lb.is_unlisted)
     ]
+    return logbooks
 
 
 def available_groups(logbooks: list[Logbook]):
     """Return dict of {group name: logbooks for that group}, group name is None if logbook in no groups"""
+    logbooks_by_id = {lb.id: lb for lb in logbooks}
     groups = {}
-    for group in LogbookGroup.objects.all():
-        group_logbooks = [lb for lb in group.logbooks.all() if lb in logbooks]
+    grouped_ids = set()
+    for group_name, lb_ids in group_membership():
+        grouped_ids.update(lb_ids)
+        group_logbooks = [logbooks_by_id[lb_id] for lb_id in lb_ids if lb_id in logbooks_by_id]
         if group_logbooks:  # don't store it if has no logbooks in the group
-            groups[group.name] = group_logbooks
+            groups[group_name] = group_logbooks
 
-    unassigned = [lb for lb in logbooks if not lb.logbookgroup_set.count()]
+    unassigned = [lb for lb in logbooks if lb.id not in grouped_ids]
     if unassigned:
         groups[None] = unassigned
     return groups
@@ -100,7 +123,7 @@ def command_perm_response(request, command, commands, logbook, entry=None) -> Ht
     if logbook.auth_required and not request.user.is_authenticated:
         return redirect(f"{settings.LOGIN_URL}?next={request.path}")
 
-    perms = get_perms(request.user, logbook) if logbook.auth_required else [p[0] for p in logbook._meta.permissions]
+    perms = logbook_perms(request.user, logbook) if logbook.auth_required else [p[0] for p in logbook._meta.permissions]
 
     # If logbook is unlisted, then should look like doesn't exist to those without permissions
     if logbook.is_unlisted and not perms:
@@ -216,9 +239,12 @@ def index(request):
     #
     cfg = get_config()
     logbooks = available_logbooks(request)
+    entry_counts, latest_dates = logbook_index_stats(logbooks)
     context = dict(
         cfg=cfg,
         group_logbooks=available_groups(logbooks),
+        entry_counts=entry_counts,
+        latest_dates=latest_dates,
         heading="FlexElog Logbook Selection",
         cfg_css=cfg.get(
             "global", "css", valtype=str, default=""
@@ -315,6 +341,15 @@ def logbook_view(request, lb_name):
         return logbook_post(request, logbook)
     return logbook_get(request, logbook)
 
+
+def logbook_past_view(request, lb_name, last_days):
+    """Logbook listing of the last `last_days` days, e.g. url `<logbook>/past1`"""
+    logbook = logbook_from_name(request, lb_name)
+    if isinstance(logbook, HttpResponse):
+        return logbook
+    return logbook_get(request, logbook, last_days=last_days)
+
+
 def logbook_tabs_context(request, logbook):
     logbooks = available_logbooks(request)
     groups_dict = available_groups(logbooks)
@@ -343,48 +378,55 @@ def logbook_tabs_context(request, logbook):
     )
         
 
-def get_list_titles_and_fields(logbook):
-    cfg = get_config()
+def normalize_mode(mode: str | None, modes=LISTING_MODES) -> str:
+    """Return the listing mode for a `mode` url parameter, "summary" if not one of `modes`
 
-    config_attr_names = list(
-        cfg.lb_attrs[logbook.name].keys()
-    )
-    config_attr_names_lower = [attr.lower() for attr in config_attr_names]
+    Also takes the Find form's mode names, in any case
+    """
+    mode = (mode or "").lower()
+    mode = _FIND_FORM_MODES.get(mode, mode)
+    return mode if mode in modes else "summary"
 
-    # Get configured database and column titles
-    # Don't include Text even if listed, if config Show text=False
-    # "*attributes" puts in the Attributes for the logbook not otherwise listed
-    list_display = cfg.get(logbook, "list display", as_list=True) or []
-    list_display_lower = [x.lower() for x in list_display]
-    try:
-        i_star_attr = list_display_lower.index("*attributes")
-    except ValueError:
-        pass
-    else:
-        used_attributes = [name for name in config_attr_names if name.lower() in list_display_lower]
-        adding_attributes = [name for name in config_attr_names if name not in used_attributes]
-        list_display = list_display[:i_star_attr] + adding_attributes + list_display[i_star_attr + 1:]
-
-    col_db_fields = []
-    col_titles = []
-    show_text = cfg.get(logbook, "Show text", valtype=bool)
-    for attr_name in list_display:
-        if hasattr(Entry, attr_name.lower()):
-            # Don't add Text if configd Show text = False
-            if attr_name.lower() != "text" or show_text:
-                col_db_fields.append(attr_name.lower())
-                col_titles.append(_(attr_name))
-        elif attr_name.lower() in config_attr_names_lower:
-            col_db_fields.append(f"attrs__{attr_name}")
-            col_titles.append(attr_name)
-        # else ignore those not in Entry or config'd
-        # ^- XX could allow to show old attributes? 
-
-    return col_titles, col_db_fields
+
+def date_window(request, last_days: int | None = None) -> dict[str, datetime]:
+    """Return date filters for the listing, from a `past<N>` url or the Find form's date fields
+
+    e.g. {"date__gte": <datetime>}.  `last` (days) takes precedence over `start_date`;
+    it is limited to MAX_LAST_DAYS, and ignored if less than 1.
+    The start of "last N days" is whole minutes, so a listing's cached counts can be reused.
+    A date without a time includes the whole day, for the end date too
+    """
+    def as_datetime(value, day_time=time.min):
+        if not value:
+            return None
+        if d := parse_date(value):  # (parse_datetime would take a date as midnight)
+            dt = datetime.combine(d, day_time)
+        elif (dt := parse_datetime(value)) is None:
+            return None
+        return timezone.make_aware(dt) if timezone.is_naive(dt) else dt
+
+    window = {}
+    last_days = last_days or get_param(request, "last", valtype=int)
+    if last_days and last_days > 0:
+        last_days = min(last_days, MAX_LAST_DAYS)
+        window["date__gte"] = timezone.now().replace(second=0, microsecond=0) - timedelta(days=last_days)
+    elif start := as_datetime(get_param(request, "start_date")):
+        window["date__gte"] = start
+    if end := as_datetime(get_param(request, "end_date"), time.max):
+        window["date__lte"] = end
+    return window
+
+
+def date_window_titles(window: dict[str, datetime]) -> dict[str, str]:
+    """Return {title: local date text} to show a date_window's filters"""
+    titles = {"date__gte": _("Start"), "date__lte": _("End")}
+    return {
+        titles[lookup]: formats.localize(timezone.localtime(dt), use_l10n=True) for lookup, dt in window.items()
+    }
 
 
 # @query_debugger
-def logbook_get(request, logbook):    
+def logbook_get(request, logbook, last_days=None):    
     cmd = get_param(request, "cmd")
     commands = [_("New"), _("Find")] # _("Select"), ("Import"), ("Config"), _("Help")
     if response := command_perm_response(request, cmd, commands, logbook):
@@ -412,11 +454,13 @@ def logbook_get(request, logbook):
 
     # Now doing the logbook entry listing summary page
         # If get here, then are just doing the detail view, no editing
-    if logbook.auth_required and not request.user.has_perm("view_entries", logbook):
+    if logbook.auth_required and "view_entries" not in logbook_perms(request.user, logbook):
         context = {
             "message": _('User "%s" has no access to this logbook') % request.user.get_username()
         }
         return render(request, "flexelog/show_error.html", context)
+    if "all" in request.GET.getlist("options"):  # "Search all logbooks" from the Find form
+        return search_all_get(request, logbook)
     selected_id = get_param(request, "id", valtype=int)
 
     # XX Adjust available commands according to config
@@ -440,30 +484,32 @@ def logbook_get(request, logbook):
         (_("Summary"), "summary"),
         (_("Threaded"), "threaded"),
     )
-    mode = _(get_param(request, "mode", default=cfg.get(logbook, "display mode", default="summary")))
+    mode = normalize_mode(get_param(request, "mode", default=cfg.get(logbook, "display mode", default="summary")))
 
-    col_titles, col_db_fields = get_list_titles_and_fields(logbook)
-   
-    columns = dict(zip(col_titles, col_db_fields))
-    col_names_lower = [x.lower() for x in col_titles] + ["subtext"]
+    plan = listing_plan(logbook, cfg)
+    columns = plan.columns
     # XX could also be in columns not shown in display
     filters = {
         k: v
         for k, v in request.GET.items()
-        if k.lower() in col_names_lower and k.lower() != "id" and v != ""
+        if k.lower() in plan.filterable and v != ""
     }
-    # need to handle 'subtext' used in original psi elog query string
+    filter_attrs = {plan.filterable[k.lower()]: v for k, v in filters.items()}  # actually text and attrs
     if "subtext" in filters:
         filters["text"] = filters.pop("subtext")
 
-    config_attr_names_lower = [attr.lower() for attr in cfg.lb_attrs[logbook.name].keys()]
-    filter_attrs = {  # actually text and attrs
-        f"{'attrs__' if k.lower() in config_attr_names_lower else ''}{k}": v
-        for k, v in filters.items()
-    }
-
-    # XXX need to handle case-(in)sensitive
-    filter_fields = {f"{k}__regex": v for k, v in filter_attrs.items()}
+    casesensitive = get_param(request, "casesensitive", valtype=bool, default=False)
+    filter_conditions = compile_filters(
+        {k: v for k, v in filter_attrs.items() if k != "text"}, casesensitive, plan.val_types
+    )
+    if "text" in filter_attrs:
+        # "Search text also in attributes"
+        sall_fields = plan.attr_fields if get_param(request, "sall", valtype=bool) else []
+        filter_conditions.append(text_search_filter(filter_attrs["text"], casesensitive, sall_fields))
+    # Date range filters use the (lb, -date) index
+    if window := date_window(request, last_days):
+        filter_conditions.append(Q(**window))
+        filters.update(date_window_titles(window))
 
     # XX Need to exclude date, id from 'contains'-style search, translate back
 
@@ -475,22 +521,30 @@ def logbook_get(request, logbook):
     elif sort_attr_field := columns.get(get_param(request, "rsort")):
         is_rsort = True
     else:
-        is_rsort = cfg.get(logbook, "Reverse sort")
-        sort_attr_field = columns.get(_("Date"), "id")  # use ID if date not shown, likely id is usually shown
-    
-    # try:
-    if sort_attr_field in ("id", "date"):  # XXXX or attrs that are numeric or date-based
-        order_by = f"{'-' if is_rsort else ''}{sort_attr_field}"
-    else:  # text=based, make case-insensitive
-        order_by = Lower(sort_attr_field).desc() if is_rsort else Lower(sort_attr_field)
-    
-    cfg_reverse = cfg.get(logbook, "Reverse sort", valtype=bool)
+        is_rsort = plan.reverse_sort
+        sort_attr_field = plan.default_sort_field
+
+    listing_conditions = filter_conditions
+    if mode == "threaded":
+        # Pages of thread starts; if filtered, of threads with any matching entry
+        listing_conditions = [Q(in_reply_to__isnull=True)]
+        if filter_conditions:
+            listing_conditions.append(
+                Q(id__in=logbook.entries.filter(*filter_conditions).values("thread_root"))
+            )
+
+    cfg_reverse = plan.reverse_sort
     secondary_order = "-id" if cfg_reverse else "id"
     queryset = (
         logbook.entries # .values(*columns.values())
-        .filter(**filter_fields)
-        .order_by(order_by, secondary_order)  # secondary so ?id=# page find manageable for huge logbooks
+        .filter(*listing_conditions)
+        .annotate(**{SORT_KEY: sort_expression(sort_attr_field, plan.val_type(sort_attr_field))})
+        .order_by(
+            F(SORT_KEY).desc() if is_rsort else F(SORT_KEY).asc(),
+            secondary_order,  # secondary so ?id=# page find manageable for huge logbooks
+        )
     )
+    queryset = with_listing_relations(queryset, list(columns.values()))
 
     
     # except FieldError:
@@ -507,63 +561,28 @@ def logbook_get(request, logbook):
         )
     per_page = min(per_page, cfg.get(logbook, "all display limit", valtype=int))
 
-    paginator = Paginator(queryset, per_page=per_page)
-    
-    # If query string has "id=#", then need to position to page with that id
-    # ... assuming it exists.  Check that first. If not, then ignore the setting
-    page_obj = paginator.get_page(int(req_page_number))
+    paginator = KeysetPaginator(
+        queryset, per_page=per_page, sort_field=sort_attr_field, sort_desc=is_rsort, id_desc=cfg_reverse
+    )
+    paginator.count = listing_count(logbook, queryset, filtered=bool(listing_conditions))
 
+    # If query string has "id=#", then need to position to page with that id
+    # ... assuming it exists with the current filters. If not, then ignore the setting
+    # Previous/Next links carry a cursor, so any page costs the same as the first.
+    # Otherwise fall back to ?page=#
+    page_obj = None
     if selected_id:
-        try:
-            sel_entry = logbook.entries.filter(**filter_fields).get(id=selected_id)
-        except Entry.DoesNotExist:
-            sel_entry = None
-    if selected_id and sel_entry:
-        # Get just the sort field and id, even in huge logbooks should still be quick
-        pairs = (
-            logbook.entries
-            .filter(**filter_fields)
-            .order_by(order_by, secondary_order)  # secondary so ?id=# page find manageable for huge logbooks
-            .values_list(sort_attr_field.removeprefix("-"), "id")
-        )
-        if sort_attr_field.removeprefix("-") in ("id", "date", "text"):
-            sel_sort_val = getattr(sel_entry, sort_attr_field.removeprefix("-"))
-        else: # XX just attributes left?
-            sel_sort_val = sel_entry.attrs[sort_attr_field.removeprefix("attrs__")]
-        
-        # Tried bisect, but was quite slow. Instead just count number before it in sort order
-        sort_cmp = "gt" if is_rsort else "lt"
-        id_cmp = "gt" if cfg_reverse else "lt"
-        # For moption attributes, can't filter by list comparison,
-        # so just to get boundary, find one lt or gt item 0
-        if isinstance(sel_sort_val, list):
-            item_sel = "__0"
-            temp_sel_sort_val = sel_sort_val[0]
-        else:
-            item_sel = ""
-            temp_sel_sort_val = sel_sort_val
-        lo = logbook.entries.filter(**filter_fields, **{f"{sort_attr_field}{item_sel}__{sort_cmp}": temp_sel_sort_val}).count()
-        exact_field_find_id = {f"{sort_attr_field}":sel_sort_val, f"id__{id_cmp}": selected_id}
-        inner_index = logbook.entries.filter(**filter_fields, **exact_field_find_id).count()  # __gt if -id sort
-        
-        # For some unknown reason this doesn't always get to the right page
-        #   ? difference between ordering and comparing individually?
-        # So use that as start index and seek to the correct one.
-        # In my tests, page repaint is ~4-8 seconds for 216K entries logbook also with sorted column
-        #   (python bisect was ~30-50 seconds for same)
-        sel_index = lo + inner_index
-        op = operator.gt if is_rsort else operator.lt
-        direction = 1 if op(pairs[sel_index][0], sel_sort_val) else -1
-        while pairs[sel_index][0] != sel_sort_val:
-            sel_index += direction
-        # Same, but for id
-        op = operator.gt if cfg_reverse else operator.lt
-        direction = 1 if op(pairs[sel_index][1], selected_id) else -1
-        while pairs[sel_index][1] != selected_id:  # Must know that selected_id is there
-            sel_index += direction
-        
-        # now calc the page we found
-        page_obj = paginator.get_page(sel_index // per_page + 1)
+        position_id = selected_id
+        if mode == "threaded":  # page with the start of its thread
+            position_id = logbook.entries.filter(id=selected_id).values_list("thread_root", flat=True).first()
+        if position_id and (sel_index := paginator.position(position_id)) is not None:
+            page_obj = paginator.get_page(sel_index // per_page + 1)
+    elif cursor := get_param(request, "cursor"):
+        page_obj = paginator.page_from_cursor(cursor)
+    if page_obj is None:
+        page_obj = paginator.get_page(int(req_page_number))
+    if mode == "threaded":
+        page_obj.object_list = attach_thread_replies(list(page_obj.object_list))
 
     num_pages = paginator.num_pages
     if num_pages > 1:
@@ -592,12 +611,110 @@ def logbook_get(request, logbook):
         is_rsort=is_rsort,
         filters=filters,
         filter_attrs=filter_attrs,
-        casesensitive=get_param(request, "casesensitive", valtype=bool, default=False),
-        IOptions=[f"attrs__{attr_name}" for attr_name in cfg.IOptions(logbook)],
+        casesensitive=casesensitive,
+        IOptions=plan.io_options,
     )
     return render(request, "flexelog/entry_list.html", context)
 
 
+def search_all_get(request, logbook):
+    """List entries matching the search in all logbooks the user can view, newest first
+
+    One query for the page across all the logbooks, with keyset (cursor) pages
+    in date order, and one for the number of matches in each logbook.
+    """
+    cfg = get_config()
+    logbooks = available_logbooks(request)
+    lb_attr_names = {}  # lower-case: name, over all the logbooks
+    for lb in logbooks:
+        for attr_name in cfg.lb_attrs[lb.name]:
+            lb_attr_names.setdefault(attr_name.lower(), attr_name)
+
+    filters = {
+        k: v for k, v in request.GET.items()
+        if v != "" and (k.lower() in lb_attr_names or k in ("text", "subtext"))
+    }
+    if "subtext" in filters:
+        filters["text"] = filters.pop("subtext")
+    filter_attrs = {  # db field: search pattern
+        ("text" if k == "text" else f"attrs__{lb_attr_names[k.lower()]}"): v for k, v in filters.items()
+    }
+
+    casesensitive = get_param(request, "casesensitive", valtype=bool, default=False)
+    filter_conditions = compile_filters(
+        {k: v for k, v in filter_attrs.items() if k != "text"}, casesensitive
+    )
+    if "text" in filter_attrs:
+        sall_fields = []  # "Search text also in attributes"
+        if get_param(request, "sall", valtype=bool):
+            sall_fields = [f"attrs__{name}" for name in lb_attr_names.values()]
+            filter_attrs.update({field: filter_attrs["text"] for field in sall_fields})  # highlight
+        filter_conditions.append(text_search_filter(filter_attrs["text"], casesensitive, sall_fields))
+    if window := date_window(request):
+        filter_conditions.append(Q(**window))
+        filters.update(date_window_titles(window))
+
+    # Columns: attributes in all the logbooks, between the fixed ones
+    common_attrs = [
+        name for name in cfg.lb_attrs[logbook.name]
+        if all(name.lower() in (x.lower() for x in cfg.lb_attrs[lb.name]) for lb in logbooks)
+    ]
+    columns = {_("Logbook"): "lb", _("ID"): "id", _("Date"): "date", _("Author"): "author"}
+    columns.update({name: f"attrs__{name}" for name in common_attrs})
+    columns[_("Text")] = "text"
+
+    is_rsort = "reverse" in request.GET.getlist("options")  # newest first
+    queryset = (
+        Entry.objects.filter(lb__in=logbooks)
+        .filter(*filter_conditions)
+        .annotate(**{SORT_KEY: F("date")})
+        .order_by(F(SORT_KEY).desc() if is_rsort else F(SORT_KEY).asc(), "-rowid" if is_rsort else "rowid")
+    )
+    lb_hits = dict(
+        queryset.order_by().values("lb_id").annotate(hits=Count("pk")).values_list("lb_id", "hits")
+    )
+    queryset = with_listing_relations(queryset, list(columns.values()))
+
+    per_page = min(
+        get_param(request, "npp", valtype=int) or cfg.get(logbook, "entries per page", valtype=int),
+        cfg.get(logbook, "all display limit", valtype=int),
+    )
+    paginator = KeysetPaginator(
+        queryset, per_page=per_page, sort_field="date", sort_desc=is_rsort, id_desc=is_rsort, id_field="rowid"
+    )
+    paginator.count = sum(lb_hits.values())
+    page_obj = None
+    if cursor := get_param(request, "cursor"):
+        page_obj = paginator.page_from_cursor(cursor)
+    if page_obj is None:
+        page_obj = paginator.get_page(get_param(request, "page", valtype=int, default=1))
+
+    # Same search in each logbook on its own
+    lb_query = request.GET.copy()
+    for param in ("options", "cursor", "page"):
+        lb_query.pop(param, None)
+    lb_query = lb_query.urlencode()
+    logbook_hits = [
+        (lb, lb_hits[lb.id], f"{reverse('flexelog:logbook', args=[lb.name])}?{lb_query}")
+        for lb in logbooks if lb_hits.get(lb.id)
+    ]
+
+    context = logbook_tabs_context(request, logbook)
+    context.update(
+        form=ListingModeFullForm(),  # dummy to get media for Full mode
+        mode=normalize_mode(get_param(request, "mode"), modes=("full", "summary")),
+        columns=columns,
+        page_obj=page_obj,
+        page_range=list(paginator.get_elided_page_range(page_obj.number, on_each_side=1, on_ends=3)),
+        logbook_hits=logbook_hits,
+        filters=filters,
+        filter_attrs=filter_attrs,
+        casesensitive=casesensitive,
+        selected_id=None,
+    )
+    return render(request, "flexelog/search_all.html", context)
+
+
 def new_edit_get(request, logbook, command, entry):
     # XXXX check request.user permissions for each of these, for the logbook
     cfg = get_config()
@@ -754,7 +871,7 @@ def entry_detail_get(request, logbook, entry):
     context.update(entry=entry, commands=commands)
 
     # If get here, then are just doing the detail view, no editing
-    if logbook.auth_required and not request.user.has_perm("view_entries", logbook):
+    if logbook.auth_required and "view_entries" not in logbook_perms(request.user, logbook):
         context = {
             "message": _('User "%s" has no access to this logbook') % request.user.get_username()
         }